@@ -3,6 +3,8 @@ import sys
 import streamlit as st
 import json
 import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add src to path
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -12,76 +14,137 @@ if SRC_PATH not in sys.path:
 
 from src.orchestration.graph import InvoiceReconciliationGraph
 from src.config import Config
+# Same module instance as the graph's (imported via src/ on sys.path), so correlation ids are shared
+from monitoring.structured_logging import configure_logging, correlation, new_id
 
 st.set_page_config(page_title="Invoice Reconciliation", page_icon="📄", layout="wide")
 
 st.title(" Invoice Reconciliation Agent System")
 st.markdown("*Multi-agent AI for automated invoice processing*")
 
+
+@st.cache_resource
+def load_catalogue():
+    """PO catalogue, loaded once per server process and shared by every session"""
+    from src.matching.po_lookup import create_po_database
+    return create_po_database()
+
+
+@st.cache_resource
+def load_graph():
+    """Agents, LLM clients and the compiled workflow survive reruns"""
+    return InvoiceReconciliationGraph(po_db=load_catalogue())
+
+
+def process_upload(graph, name: str, data: bytes) -> dict:
+    # Save to temp file (cloud-compatible)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(name)[1]) as tmp_file:
+        tmp_file.write(data)
+        temp_path = tmp_file.name
+    try:
+        return graph.process_invoice(temp_path, name)
+    finally:
+        # Clean up temp file
+        try:
+            os.unlink(temp_path)
+        except:
+            pass
+
+
+def show_result(name: str, result: dict, key: str):
+    # Display results
+    st.success(f"✅ Action: {result['processing_results']['recommended_action'].replace('_', ' ').upper()}")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Confidence", f"{result['processing_results']['confidence']:.0%}")
+    with col2:
+        st.metric("Risk Level", result['processing_results']['risk_level'].upper())
+    with col3:
+        st.metric("Processing Time", f"{result['processing_duration_seconds']:.1f}s")
+
+    # Show discrepancies if any
+    if result['processing_results']['discrepancies']:
+        st.warning("⚠️ Discrepancies Detected:")
+        for disc in result['processing_results']['discrepancies']:
+            st.write(f"- **{disc['type']}** ({disc['severity']}): {disc['details']}")
+
+    # Show reasoning
+    st.markdown("**🧠 Agent Reasoning**")
+    st.write(result['processing_results']['agent_reasoning'])
+
+    # Full JSON (collapsed; expanders cannot be nested inside the per-file expander)
+    st.markdown("**📋 Full Results (JSON)**")
+    st.json(result, expanded=False)
+
+    # Download button for JSON
+    json_str = json.dumps(result, indent=2)
+    st.download_button(
+        label="💾 Download Results (JSON)",
+        data=json_str,
+        file_name=f"{name}_results.json",
+        mime="application/json",
+        key=f"download_{key}"
+    )
+
+
+def show_error(error: str):
+    st.error(f"❌ Error processing invoice: {error.splitlines()[-1] if error else ''}")
+    st.code(error)
+
+
 # Initialize
 Config.ensure_directories()
-graph = InvoiceReconciliationGraph()
+configure_logging()
+graph = load_graph()
+
+# Results survive reruns (e.g. download clicks) so files are processed only once
+results = st.session_state.setdefault("results", {})
 
 # File uploader
-uploaded_file = st.file_uploader(
-    "Upload Invoice (PDF, JPG, PNG)",
-    type=["pdf", "jpg", "jpeg", "png"]
+uploaded_files = st.file_uploader(
+    "Upload Invoices (PDF, JPG, PNG, TIFF, BMP)",
+    type=["pdf", "jpg", "jpeg", "png", "tiff", "bmp"],
+    accept_multiple_files=True
 )
 
-if uploaded_file:
-    # Save to temp file (cloud-compatible)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-        tmp_file.write(uploaded_file.getbuffer())
-        temp_path = tmp_file.name
-
-    # Process
-    with st.spinner("🤖 Processing invoice..."):
-        try:
-            result = graph.process_invoice(temp_path, uploaded_file.name)
-
-            # Display results
-            st.success(f"✅ Action: {result['processing_results']['recommended_action'].replace('_', ' ').upper()}")
-
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Confidence", f"{result['processing_results']['confidence']:.0%}")
-            with col2:
-                st.metric("Risk Level", result['processing_results']['risk_level'].upper())
-            with col3:
-                st.metric("Processing Time", f"{result['processing_duration_seconds']:.1f}s")
-
-            # Show discrepancies if any
-            if result['processing_results']['discrepancies']:
-                st.warning("⚠️ Discrepancies Detected:")
-                for disc in result['processing_results']['discrepancies']:
-                    st.write(f"- **{disc['type']}** ({disc['severity']}): {disc['details']}")
-
-            # Show reasoning
-            with st.expander("🧠 Agent Reasoning"):
-                st.write(result['processing_results']['agent_reasoning'])
-
-            # Full JSON
-            with st.expander("📋 Full Results (JSON)"):
-                st.json(result)
-
-            # Download button for JSON
-            json_str = json.dumps(result, indent=2)
-            st.download_button(
-                label="💾 Download Results (JSON)",
-                data=json_str,
-                file_name=f"{uploaded_file.name}_results.json",
-                mime="application/json"
-            )
-
-        except Exception as e:
-            st.error(f"❌ Error processing invoice: {str(e)}")
-            import traceback
-
-            st.code(traceback.format_exc())
-
-        finally:
-            # Clean up temp file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+def show_entry(uploaded_file, slot):
+    key = (uploaded_file.name, uploaded_file.size)
+    entry = results[key]
+    label = entry["result"]["processing_results"]["recommended_action"].replace("_", " ") if "result" in entry else "error"
+    with slot.expander(f"📄 {uploaded_file.name} — {label}", expanded=len(uploaded_files) == 1):
+        if "result" in entry:
+            show_result(uploaded_file.name, entry["result"], f"{key[0]}_{key[1]}")
+        else:
+            show_error(entry["error"])
+
+
+if uploaded_files:
+    pending = [f for f in uploaded_files if (f.name, f.size) not in results]
+    progress = st.progress(0.0, text=f"🤖 Processing {len(pending)} invoice(s)...") if pending else None
+
+    # One slot per file in upload order, filled as soon as that file's result is available
+    slots = {(f.name, f.size): st.empty() for f in uploaded_files}
+    for uploaded_file in uploaded_files:
+        if (uploaded_file.name, uploaded_file.size) in results:
+            show_entry(uploaded_file, slots[(uploaded_file.name, uploaded_file.size)])
+
+    if pending:
+        # One job id per upload batch; worker threads inherit it through the copied context
+        with correlation(job=new_id()), ThreadPoolExecutor(max_workers=Config.APP_WORKERS) as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, process_upload, graph, f.name, f.getvalue()): f
+                for f in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                uploaded_file = futures[future]
+                key = (uploaded_file.name, uploaded_file.size)
+                try:
+                    results[key] = {"result": future.result()}
+                except Exception:
+                    import traceback
+
+                    results[key] = {"error": traceback.format_exc()}
+                show_entry(uploaded_file, slots[key])
+                progress.progress(done / len(pending), text=f"Processed {done}/{len(pending)}: {uploaded_file.name}")
+        progress.empty()
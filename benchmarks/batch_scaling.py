@@ -0,0 +1,74 @@
+"""Throughput of a sharded batch run against the number of worker processes.
+
+Each run queues the invoice set on a fresh SQLite work queue and starts N local
+workers, exactly as `python src/main.py --coordinator --local-workers N` does.
+Wall time includes worker start-up (imports, graph construction), so use enough
+invoices (--repeat) for that to amortise before reading the speedup.
+
+Usage:
+    python benchmarks/batch_scaling.py --workers 1 2 4 --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+os.chdir(PROJECT_ROOT)
+
+from config import Config
+from batch.coordinator import Coordinator, spawn_local_workers
+from batch.work_queue import create_queue
+from monitoring.structured_logging import configure_logging
+
+
+def run(invoices: list, workers: int, shard_size: int, directory: str) -> tuple:
+    """(wall seconds, invoices completed) for one run with `workers` processes"""
+    url = "sqlite:///" + os.path.join(directory, f"queue_{workers}.db")
+    coordinator = Coordinator(create_queue(url), shard_size)
+    start = time.perf_counter()
+    coordinator.submit(invoices)
+    processes = spawn_local_workers(workers, url)
+    try:
+        coordinator.wait(processes)
+    finally:
+        for proc in processes:
+            proc.wait()
+    wall_seconds = time.perf_counter() - start
+    done = sum(len(result["invoices"]) for _, result in coordinator.queue.results())
+    return wall_seconds, done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=1, help="queue every invoice this many times")
+    parser.add_argument("--shard-size", type=int, default=1)
+    args = parser.parse_args()
+    configure_logging(level="WARNING")
+    # Worker processes inherit this: keep their per-invoice logs off the report
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    files = sorted(f for f in os.listdir(Config.INVOICES_DIR) if f.lower().endswith(Config.INVOICE_EXTENSIONS))
+    invoices = list(enumerate(files * args.repeat, 1))
+    if not invoices:
+        print("No invoices found")
+        return 1
+
+    print(f"{len(invoices)} invoices, shard size {args.shard_size}")
+    print(f"{'workers':>8}{'wall_s':>9}{'inv/s':>8}{'speedup':>9}{'efficiency':>12}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in args.workers:
+            wall_seconds, done = run(invoices, workers, args.shard_size, directory)
+            rate = done / wall_seconds
+            baseline = baseline or rate / workers
+            speedup = rate / baseline
+            print(f"{workers:>8}{wall_seconds:>9.2f}{rate:>8.2f}{speedup:>8.2f}x{speedup / workers:>11.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Check CLI import time against a budget using `python -X importtime`.
+
+Fails (exit code 1) when a module's cumulative import time exceeds the budget
+or when heavy OCR/UI dependencies are loaded just by importing it.
+
+Usage:
+    python benchmarks/import_time.py --budget-ms 150 --runs 5
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(PROJECT_ROOT, "src")
+
+MODULES = ["main", "orchestration.graph"]
+# Must only load once an image/PDF is actually processed (or under Streamlit)
+LAZY_MODULES = ["cv2", "numpy", "pytesseract", "PyPDF2", "PIL", "streamlit", "langgraph"]
+
+LINE_PATTERN = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(module: str) -> tuple:
+    """Return (cumulative microseconds, set of imported top-level packages)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    cumulative = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        loaded.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(match.group(2))
+    return cumulative, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        best_us, loaded = min(measure(module) for _ in range(args.runs))
+        eager = sorted(m for m in LAZY_MODULES if m in loaded)
+        status = "ok"
+        if best_us / 1000 > args.budget_ms or eager:
+            status = "FAIL"
+            failed = True
+        print(f"{module:<24}{best_us / 1000:>8.1f}ms  (budget {args.budget_ms:.0f}ms)  {status}")
+        if eager:
+            print(f"    eagerly imported: {', '.join(eager)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark full-page OCR against the region-of-interest preprocessing path.
+
+Character accuracy is measured against the matching .txt fixture when one
+exists (e.g. Invoice_1_Baseline_3.jpg -> Invoice_1_Baseline.txt).
+
+Usage:
+    python benchmarks/ocr_preprocessing.py --runs 3
+"""
+import argparse
+import difflib
+import glob
+import os
+import re
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+os.chdir(PROJECT_ROOT)
+
+import cv2
+from config import Config
+from extraction.ocr import DocumentExtractor
+
+
+def ground_truth(image_path: str):
+    """Reference text for an image fixture, if available"""
+    stem = os.path.splitext(image_path)[0]
+    for candidate in (stem, re.sub(r'_\d+$', '', stem)):
+        if os.path.exists(candidate + ".txt"):
+            with open(candidate + ".txt", "r", encoding="utf-8") as f:
+                return f.read()
+    return None
+
+
+def char_accuracy(text: str, reference: str) -> float:
+    """Similarity of whitespace-normalised text to the reference (0..1)"""
+    text, reference = " ".join(text.split()), " ".join(reference.split())
+    return difflib.SequenceMatcher(None, text, reference, autojunk=False).ratio()
+
+
+def time_path(fn, image, runs: int) -> tuple:
+    elapsed = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(image)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=1)
+    args = parser.parse_args()
+
+    extractor = DocumentExtractor()
+    images = sorted(glob.glob(os.path.join(Config.INVOICES_DIR, "*.jpg")))
+    print(f"{'image':<32}{'full_s':>8}{'roi_s':>8}{'speedup':>9}{'full_acc':>10}{'roi_acc':>9}{'roi_conf':>10}")
+
+    totals = {"full": 0.0, "roi": 0.0}
+    for path in images:
+        image = extractor.deskew_image(cv2.imread(path))
+        full_s, full = time_path(extractor.ocr_full_page, image, args.runs)
+        roi_s, roi = time_path(extractor.ocr_regions, image, args.runs)
+        totals["full"] += full_s
+        totals["roi"] += roi_s
+
+        reference = ground_truth(path)
+        full_acc = f"{char_accuracy(full.text, reference):.3f}" if reference else "n/a"
+        roi_acc = f"{char_accuracy(roi.text, reference):.3f}" if reference else "n/a"
+        roi_conf = f"{roi.mean_confidence():.1f}" if roi.confidences else "n/a"
+        print(f"{os.path.basename(path):<32}{full_s:>8.2f}{roi_s:>8.2f}{full_s / roi_s:>8.2f}x"
+              f"{full_acc:>10}{roi_acc:>9}{roi_conf:>10}")
+
+    if totals["roi"] > 0:
+        print(f"\nTotal: full-page {totals['full']:.2f}s, region {totals['roi']:.2f}s "
+              f"({totals['full'] / totals['roi']:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Re-run the whole graph over historical invoices with recorded LLM responses.
+
+Record once against the live model, then replay offline after every matching or
+discrepancy change and diff the results against the previous run:
+
+    python benchmarks/replay_regression.py --mode record --out runs/baseline.json
+    python benchmarks/replay_regression.py --baseline runs/baseline.json --out runs/candidate.json
+
+Only the LLM is replayed; OCR, matching, discrepancy detection and resolution run
+for real. Duplicate and price-history state starts empty on every run, so results
+depend only on the invoices and the code.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+os.chdir(PROJECT_ROOT)
+
+from config import Config
+from llm.recording import MODES, open_store
+from monitoring.structured_logging import configure_logging
+
+# Result fields compared between runs, as (label, path into the output JSON)
+COMPARED_FIELDS = (
+    ("invoice_id", ("invoice_id",)),
+    ("duplicate_of", ("document_info", "duplicate_of")),
+    ("extraction_confidence", ("processing_results", "extraction_confidence")),
+    ("total", ("processing_results", "extracted_data", "total")),
+    ("matched_po", ("processing_results", "matching_results", "matched_po")),
+    ("po_match_confidence", ("processing_results", "matching_results", "po_match_confidence")),
+    ("variance_amount", ("processing_results", "total_variance", "amount")),
+    ("action", ("processing_results", "recommended_action")),
+    ("risk", ("processing_results", "risk_level")),
+    ("confidence", ("processing_results", "confidence")),
+)
+
+
+def _get(data, path):
+    for part in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def snapshot(result: dict) -> dict:
+    """The parts of one output that define its outcome (timestamps and timings excluded)"""
+    snap = {label: _get(result, path) for label, path in COMPARED_FIELDS}
+    snap["discrepancies"] = sorted(
+        f"{d.get('type')}:{d.get('severity')}" for d in result["processing_results"].get("discrepancies", [])
+    )
+    snap["errors"] = len(result.get("errors", []))
+    return snap
+
+
+def run(paths: list, workers: int) -> tuple:
+    """Process every invoice; returns ({filename: snapshot}, {filename: seconds}, wall seconds)"""
+    # Fresh in-memory duplicate and price-history state, so runs are comparable
+    Config.FINGERPRINT_INDEX_FILE = ""
+    Config.PRICE_HISTORY_FILE = ""
+    from orchestration.graph import InvoiceReconciliationGraph
+
+    graph = InvoiceReconciliationGraph()
+
+    def process(path):
+        result = graph.process_invoice(path, os.path.basename(path))
+        return os.path.basename(path), result
+
+    results, durations = {}, {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, result in pool.map(process, paths):
+            results[name] = snapshot(result)
+            durations[name] = result["processing_duration_seconds"]
+    return results, durations, time.perf_counter() - start
+
+
+def compare(baseline: dict, current: dict) -> dict:
+    """Per-invoice field changes plus an action transition count"""
+    old, new = baseline["results"], current["results"]
+    changed = {}
+    transitions = Counter()
+    for name in sorted(old.keys() & new.keys()):
+        fields = {
+            field: (old[name].get(field), new[name].get(field))
+            for field in new[name] if old[name].get(field) != new[name].get(field)
+        }
+        if fields:
+            changed[name] = fields
+        if old[name].get("action") != new[name].get("action"):
+            transitions[f"{old[name].get('action')} -> {new[name].get('action')}"] += 1
+    return {
+        "changed": changed,
+        "added": sorted(new.keys() - old.keys()),
+        "removed": sorted(old.keys() - new.keys()),
+        "action_transitions": dict(transitions),
+        "throughput_ratio": (current["throughput_per_second"] / baseline["throughput_per_second"]
+                             if baseline.get("throughput_per_second") else None),
+    }
+
+
+def print_report(current: dict, diff: dict = None, baseline_file: str = None):
+    actions = Counter(snap["action"] for snap in current["results"].values())
+    llm = current["llm"]
+    print(f"Invoices: {current['invoices']} in {current['wall_seconds']:.2f}s "
+          f"({current['throughput_per_second']:.2f} inv/s, mean {current['mean_invoice_seconds']:.3f}s)")
+    print(f"LLM ({current['mode']}): {llm['hits']} replayed, {llm['misses']} missed, "
+          f"{llm['recorded']} recorded, {llm['responses']} in {current['recordings']}")
+    print(f"Actions: {dict(actions)}")
+    if diff is None:
+        return
+
+    print(f"\nAgainst {baseline_file}:")
+    if diff["throughput_ratio"] is not None:
+        print(f"  Throughput: {diff['throughput_ratio']:.2f}x baseline")
+    print(f"  Changed: {len(diff['changed'])}, added: {len(diff['added'])}, removed: {len(diff['removed'])}")
+    for transition, count in sorted(diff["action_transitions"].items()):
+        print(f"  {transition}: {count}")
+    for name, fields in diff["changed"].items():
+        print(f"  {name}")
+        for field, (before, after) in fields.items():
+            print(f"    {field}: {before!r} -> {after!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="invoice files or globs (default: every invoice in data/invoices)")
+    parser.add_argument("--mode", default="replay", choices=MODES[1:])
+    parser.add_argument("--recordings", default=Config.LLM_RECORDINGS_FILE)
+    parser.add_argument("--baseline", help="previous run JSON to diff against")
+    parser.add_argument("--out", help="write this run's results and throughput as JSON")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="invoices processed concurrently (>1 can reorder duplicate detection)")
+    parser.add_argument("--fail-on-diff", action="store_true", help="exit 1 if any result changed")
+    parser.add_argument("--verbose", action="store_true", help="log per-invoice progress (default: warnings only)")
+    args = parser.parse_args()
+
+    Config.LLM_RECORD_MODE = args.mode
+    Config.LLM_RECORDINGS_FILE = args.recordings
+    configure_logging(level=None if args.verbose else "WARNING")
+
+    patterns = args.paths or [os.path.join(Config.INVOICES_DIR, "*")]
+    paths = sorted({
+        path for pattern in patterns for path in glob.glob(pattern)
+        if path.lower().endswith(Config.INVOICE_EXTENSIONS)
+    })
+    if not paths:
+        print("No invoices found")
+        return 1
+
+    results, durations, wall_seconds = run(paths, args.workers)
+    current = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "mode": args.mode,
+        "recordings": args.recordings,
+        "invoices": len(results),
+        "wall_seconds": wall_seconds,
+        "throughput_per_second": len(results) / wall_seconds if wall_seconds > 0 else 0.0,
+        "mean_invoice_seconds": sum(durations.values()) / len(durations) if durations else 0.0,
+        "llm": open_store(args.recordings).stats(),
+        "results": results,
+    }
+
+    diff = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            diff = compare(json.load(f), current)
+        current["diff_against"] = args.baseline
+    print_report(current, diff, args.baseline)
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nRun written to {args.out}")
+
+    if args.fail_on_diff and diff and (diff["changed"] or diff["added"] or diff["removed"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
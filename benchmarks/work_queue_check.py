@@ -0,0 +1,214 @@
+"""Check every work-queue backend against the lease/ack/retry contract (see batch/work_queue.py).
+
+The same scenarios run on SQLite, a shared directory and Redis: lease and
+renew, first ack wins, an expired lease is reclaimed (and its old holder can
+neither renew nor ack), nack with backoff, dead-lettering, meta and clear.
+
+Redis runs against --redis-url if given (use a scratch database: the queue is
+cleared), otherwise against an in-process fakeredis server, which executes the
+Lua scripts too (pip install "fakeredis[lua]"). "redis-decoded" repeats the Redis
+scenarios with a client created with decode_responses=True. --batch additionally runs a
+sharded batch with two local workers on each backend, as
+`python src/main.py --coordinator --local-workers 2` does; with fakeredis the
+workers reach it over TCP.
+
+Usage:
+    python benchmarks/work_queue_check.py
+    python benchmarks/work_queue_check.py --redis-url redis://127.0.0.1:6379/15 --batch
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+os.chdir(PROJECT_ROOT)
+
+from config import Config
+from batch.coordinator import Coordinator, spawn_local_workers
+from batch.work_queue import REDIS_ACK, REDIS_CLAIM, REDIS_EXTEND, REDIS_RELEASE, RedisWorkQueue, create_queue
+from monitoring.structured_logging import configure_logging
+
+VISIBILITY = 0.5  # seconds; leases are left to expire in some scenarios
+
+
+def check_lease_and_ack(queue, check):
+    queue.put([{"id": "a", "n": 1}, {"id": "b", "n": 2}])
+    first = queue.get("w1", VISIBILITY)
+    check("claim returns the payload", first is not None and first.payload.get("n") in (1, 2))
+    check("first claim is attempt 1", first.attempts == 1 and first.error is None)
+    second = queue.get("w2", VISIBILITY)
+    check("claims hand out distinct jobs", second is not None and second.job_id != first.job_id)
+    check("nothing left to claim", queue.get("w3", VISIBILITY) is None)
+    check("a live lease can be renewed", queue.extend(first, VISIBILITY))
+    check("stats count leased jobs", queue.stats() == {"pending": 0, "leased": 2, "done": 0, "dead": 0})
+    check("first ack wins", queue.ack(first, {"by": "w1"}))
+    check("a second ack is rejected", not queue.ack(first, {"by": "again"}))
+    check("an acked lease cannot be renewed", not queue.extend(first, VISIBILITY))
+    queue.ack(second, {"by": "w2"})
+    results = dict(queue.results())
+    check("results travel with the ack", results == {first.job_id: {"by": "w1"}, second.job_id: {"by": "w2"}})
+    check("queue drains once everything is acked", queue.drained())
+
+
+def check_expired_lease(queue, check):
+    queue.put([{"id": "slow"}])
+    stale = queue.get("w1", VISIBILITY)
+    time.sleep(VISIBILITY + 0.2)
+    fresh = queue.get("w2", VISIBILITY)
+    check("an expired lease is reclaimed", fresh is not None and fresh.job_id == stale.job_id)
+    check("the reclaim counts as attempt 2", fresh.attempts == 2 and fresh.receipt != stale.receipt)
+    check("the old holder cannot renew", not queue.extend(stale, VISIBILITY))
+    check("the new holder can renew", queue.extend(fresh, VISIBILITY))
+    check("the new holder's ack wins", queue.ack(fresh, {"by": "w2"}))
+    check("the old holder's late ack is rejected", not queue.ack(stale, {"by": "w1"}))
+    check("the first result is kept", dict(queue.results()) == {"slow": {"by": "w2"}})
+
+
+def check_retry_and_dead_letter(queue, check):
+    queue.max_attempts, queue.retry_delay = 2, VISIBILITY
+    queue.put([{"id": "bad"}])
+    lease = queue.get("w1", VISIBILITY)
+    queue.nack(lease, "boom 1")
+    check("a nacked job waits out its backoff", queue.get("w1", VISIBILITY) is None)
+    check("a waiting job counts as pending", queue.stats()["pending"] == 1 and not queue.drained())
+    time.sleep(VISIBILITY + 0.2)
+    retry = queue.get("w2", VISIBILITY)
+    check("the retry carries the previous error", retry is not None and retry.error == "boom 1")
+    check("the retry is attempt 2", retry.attempts == 2)
+    queue.nack(retry, "boom 2")
+    check("the last attempt's nack dead-letters", queue.stats() == {"pending": 0, "leased": 0, "done": 0, "dead": 1})
+    check("the dead letter keeps payload and error", list(queue.dead()) == [("bad", {"id": "bad"}, "boom 2")])
+    check("a dead-lettered job is not handed out", queue.get("w3", VISIBILITY) is None)
+
+    queue.max_attempts = 1
+    queue.put([{"id": "hung"}])
+    queue.get("w1", VISIBILITY)
+    time.sleep(VISIBILITY + 0.2)
+    check("a job claimed too often is dead-lettered on reclaim", queue.get("w2", VISIBILITY) is None)
+    check("with the expiry as its error", dict((job, error) for job, _, error in queue.dead()).get("hung")
+          == "visibility timeout expired")
+
+
+def check_meta_and_clear(queue, check):
+    queue.set_meta("batch_id", "b1")
+    check("meta round-trips", queue.get_meta("batch_id") == "b1" and queue.get_meta("missing") is None)
+    queue.put([{"id": "x"}])
+    queue.clear()
+    check("clear empties the queue", queue.stats() == {"pending": 0, "leased": 0, "done": 0, "dead": 0})
+    check("clear removes meta", queue.get_meta("batch_id") is None)
+
+
+SCENARIOS = (check_lease_and_ack, check_expired_lease, check_retry_and_dead_letter, check_meta_and_clear)
+
+
+def run_batch(queue, url: str, check):
+    """A real sharded batch: two local worker processes drain the queue at `url`"""
+    invoices = sorted(f for f in os.listdir(Config.INVOICES_DIR) if f.lower().endswith(Config.INVOICE_EXTENSIONS))
+    coordinator = Coordinator(queue, shard_size=2)
+    coordinator.submit(list(enumerate(invoices, 1)))
+    processes = spawn_local_workers(2, url)
+    try:
+        coordinator.wait(processes)
+    finally:
+        for proc in processes:
+            proc.wait()
+    results, failed = coordinator.merge()
+    check(f"batch processed all {len(invoices)} invoices", len(results) == len(invoices) and not failed)
+
+
+@contextlib.contextmanager
+def fake_redis_server():
+    """(redis:// URL, queue factory) for an in-process fakeredis server.
+
+    The checks talk to it in-process; worker processes connect over TCP. Its TCP
+    front end drops the connection after an error reply (unlike Redis), so the Lua
+    scripts are preloaded and EVALSHA never meets NOSCRIPT.
+    """
+    from fakeredis import FakeRedis, TcpFakeServer
+    server = TcpFakeServer(("127.0.0.1", 0))
+    server.daemon_threads, server.block_on_close = True, False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = FakeRedis(server=server.fake_server)
+    for script in (REDIS_CLAIM, REDIS_EXTEND, REDIS_ACK, REDIS_RELEASE):
+        client.script_load(script)
+    try:
+        yield (f"redis://127.0.0.1:{server.server_address[1]}/0",
+               lambda decoded: RedisWorkQueue(client=FakeRedis(server=server.fake_server, decode_responses=decoded)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "file", "redis", "redis-decoded"])
+    parser.add_argument("--redis-url", help="real Redis server to test against (default: fakeredis)")
+    parser.add_argument("--batch", action="store_true", help="also run a sharded batch with two local workers")
+    args = parser.parse_args()
+    configure_logging(level="WARNING")
+    # Worker processes inherit this: keep their per-invoice logs off the report
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    failures = []
+    fake_redis = None
+    with tempfile.TemporaryDirectory() as directory, contextlib.ExitStack() as stack:
+        for backend in args.backends:
+            decoded = backend == "redis-decoded"
+            if backend == "sqlite":
+                url = "sqlite:///" + os.path.join(directory, "queue.db")
+            elif backend == "file":
+                url = "file://" + os.path.join(directory, "queue")
+            elif args.redis_url:
+                url = args.redis_url
+            else:
+                try:
+                    fake_redis = fake_redis or stack.enter_context(fake_redis_server())
+                except ImportError:
+                    print(f'{backend}: skipped (pass --redis-url or pip install "fakeredis[lua]")')
+                    continue
+                url, open_fake = fake_redis
+                open_queue = lambda open_fake=open_fake, decoded=decoded: open_fake(decoded)
+            if not backend.startswith("redis"):
+                open_queue = lambda url=url: create_queue(url)
+            elif args.redis_url:
+                import redis
+                open_queue = lambda url=url, decoded=decoded: RedisWorkQueue(
+                    client=redis.Redis.from_url(url, decode_responses=decoded))
+
+            def check(label, ok, backend=backend):
+                print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+                if not ok:
+                    failures.append(f"{backend}: {label}")
+
+            print(f"{backend} ({url})")
+            for scenario in SCENARIOS:
+                queue = open_queue()
+                queue.clear()
+                try:
+                    scenario(queue, check)
+                except Exception as e:
+                    check(f"{scenario.__name__} raised {type(e).__name__}: {e}", False)
+                finally:
+                    queue.clear()
+                    queue.close()
+            if args.batch:
+                queue = open_queue()
+                try:
+                    run_batch(queue, url, check)
+                finally:
+                    queue.close()
+
+    print(f"\n{len(failures)} failure(s)" if failures else "\nAll checks passed")
+    for failure in failures:
+        print(f"  {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
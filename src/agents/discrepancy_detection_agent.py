@@ -1,14 +1,22 @@
 from orchestration.state import AgentState, Discrepancy
-from matching.po_lookup import PODatabase
+from matching.po_lookup import create_po_database
+from matching.normalization import Normalizer, normalize_supplier
+from matching.price_history import PriceHistory
+from matching.line_alignment import LineAligner, LineAlignment
 from config import Config
+from functools import partial
 import time
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 class DiscrepancyDetectionAgent:
-    def __init__(self):
-        self.po_db = PODatabase()
+    def __init__(self, po_db=None):
+        self.po_db = po_db or create_po_database()
+        self.normalizer = Normalizer()
+        self.aligner = LineAligner(self.normalizer)
+        # An item without history starts from the catalogue's agreed prices
+        self.price_history = PriceHistory(seeder=self._po_prices)
     
     def process(self, state: AgentState) -> AgentState:
         """Detect discrepancies between invoice and PO"""
@@ -24,47 +32,61 @@ class DiscrepancyDetectionAgent:
             
             discrepancies = []
             
-            # If no PO matched
-            if not matching["matched_po"]:
+            # Same invoice submitted more than once (possible double billing)
+            duplicate = state.get("duplicate_of")
+            if duplicate:
                 discrepancies.append({
-                    "type": "missing_po_reference",
-                    "severity": "high" if not extracted.get("po_reference") else "medium",
-                    "field": "po_reference",
-                    "details": "Invoice does not match any PO in database.",
+                    "type": "duplicate_invoice",
+                    "severity": "high",
+                    "field": "invoice_number",
+                    "details": f"Invoice {extracted.get('invoice_number', 'UNKNOWN')} duplicates {duplicate['filename']} ({duplicate['match_type'].replace('_', ' ')}). Possible double billing.",
                     "invoice_value": None,
                     "po_value": None,
                     "variance_percentage": None,
-                    "confidence": 0.95
+                    "confidence": 0.99 if duplicate["match_type"] == "exact_file" else 0.90
                 })
+            
+            po = None
+            pairs = []
+            
+            # If no PO matched
+            if not matching["matched_po"]:
+                discrepancies.append(self.missing_po_discrepancy(extracted))
             else:
                 # Get PO data
                 po = self.po_db.get_po_by_number(matching["matched_po"])
                 if po:
                     # Check line item discrepancies
-                    discrepancies.extend(self._check_line_items(extracted, po))
+                    pairs = self._line_pairs(extracted, po, matching)
+                    discrepancies.extend(self._check_line_items(extracted, po, pairs))
                     
                     # Check total variance
                     total_disc = self._check_total_variance(extracted, po)
                     if total_disc:
                         discrepancies.append(total_disc)
             
-            # Calculate total variance
+            # Compare against price history (also covers missing or stale POs)
+            item_codes = self._item_codes(extracted, po, pairs)
+            discrepancies.extend(self._check_price_history(extracted, po, discrepancies, item_codes))
+            
+            # Calculate total variance (amount in base currency)
             total_variance_amount = 0.0
             total_variance_pct = 0.0
             
             if matching["matched_po"]:
                 po = self.po_db.get_po_by_number(matching["matched_po"])
                 if po:
-                    po_total = po.get("total", 0)
-                    inv_total = extracted.get("total", 0)
-                    total_variance_amount = abs(inv_total - po_total)
-                    if po_total > 0:
-                        total_variance_pct = total_variance_amount / po_total
+                    inv_total, po_total, currency = self._comparable_totals(extracted, po)
+                    if inv_total is not None and po_total is not None:
+                        total_variance_amount = self.normalizer.to_base(
+                            abs(inv_total - po_total), currency, extracted.get("invoice_date")) or 0.0
+                        if po_total > 0:
+                            total_variance_pct = abs(inv_total - po_total) / po_total
             
             state["discrepancies"] = discrepancies
             state["total_variance_amount"] = total_variance_amount
             state["total_variance_percentage"] = total_variance_pct
-            state["discrepancy_reasoning"] = self._build_reasoning(discrepancies)
+            state["discrepancy_reasoning"] = self.build_reasoning(discrepancies)
             
             # Update trace
             duration = time.time() - start_time
@@ -79,22 +101,178 @@ class DiscrepancyDetectionAgent:
         
         return state
     
-    def _check_line_items(self, invoice, po) -> list:
-        """Check line item discrepancies"""
+    @staticmethod
+    def missing_po_discrepancy(invoice) -> Discrepancy:
+        return {
+            "type": "missing_po_reference",
+            "severity": "high" if not invoice.get("po_reference") else "medium",
+            "field": "po_reference",
+            "details": "Invoice does not match any PO in database.",
+            "invoice_value": None,
+            "po_value": None,
+            "variance_percentage": None,
+            "confidence": 0.95
+        }
+    
+    def _comparable_totals(self, invoice, po) -> tuple:
+        """Invoice and PO totals in their comparison currency (see Normalizer.comparison_currency), and that currency"""
+        currency = self.normalizer.comparison_currency(invoice, po)
+        on_date = invoice.get("invoice_date")
+        inv_total = self.normalizer.convert(invoice.get("total", 0), invoice.get("currency"), currency, on_date)
+        po_total = self.normalizer.convert(po.get("total", 0), po.get("currency"), currency, on_date)
+        return inv_total, po_total, currency
+    
+    def _po_prices(self, supplier, item_code):
+        """(unit price, PO date) of the item on this supplier's POs, in base currency per base unit"""
+        supplier_key = normalize_supplier(supplier)
+        for result in self.po_db.search_by_products([item_code]):
+            po = result["po"]
+            if normalize_supplier(po.get("supplier", "")) != supplier_key:
+                continue
+            for item in po.get("line_items", []):
+                if (item.get("item_id") or "").upper() == item_code.strip().upper():
+                    price = self.normalizer.normalize_line(item, po.get("currency"), po.get("date"))["unit_price"]
+                    yield price, po.get("date", "")
+    
+    def _line_pairs(self, invoice, po, matching) -> list:
+        """Invoice/PO line pairs computed by the Matching Agent, or aligned here if absent"""
+        alignment = matching.get("line_item_alignment")
+        if alignment is None:
+            return self.aligner.align(invoice, po)
+        return [LineAlignment(a["invoice_line"], a["po_line"], a["score"], a["method"]) for a in alignment]
+    
+    def _item_codes(self, invoice, po, pairs) -> list:
+        """Per invoice line, the PO item id it was paired with (else its own code) for price history"""
+        codes = [item.get("item_code") for item in invoice.get("line_items", [])]
+        for pair in pairs:
+            codes[pair.invoice_index] = po["line_items"][pair.po_index].get("item_id") or codes[pair.invoice_index]
+        return codes
+    
+    def _supplier(self, invoice, po) -> str:
+        return invoice.get("supplier_name") or (po or {}).get("supplier", "")
+    
+    def _check_price_history(self, invoice, po, existing, item_codes) -> list:
+        """Flag unit prices that deviate from this supplier's history for the item"""
         discrepancies = []
-        po_items = {item["item_id"]: item for item in po.get("line_items", [])}
+        flagged = {d["field"] for d in existing}
+        supplier = self._supplier(invoice, po)
+        fmt = self.normalizer.format
+        
+        for idx, item in enumerate(invoice.get("line_items", [])):
+            field = f"line_items[{idx}].unit_price"
+            if field in flagged:
+                continue  # already reported against the PO
+            norm = self.normalizer.normalize_line(item, invoice.get("currency"), invoice.get("invoice_date"))
+            if norm["unit_price"] is None:
+                continue
+            anomaly = self.price_history.check(supplier, item_codes[idx], norm["unit_price"])
+            if not anomaly:
+                continue
+            variance = (norm["unit_price"] - anomaly["mean"]) / anomaly["mean"]
+            discrepancies.append({
+                "type": "price_anomaly",
+                "severity": "medium",
+                "field": field,
+                "details": f"Line item '{item.get('description', '')}': Price {fmt(norm['unit_price'])}/{norm['unit']} vs historical mean {fmt(anomaly['mean'])} (median {fmt(anomaly['p50'])}, {anomaly['samples']} invoices, z={anomaly['z_score']:.1f})",
+                "invoice_value": round(norm["unit_price"], 4),
+                "po_value": round(anomaly["mean"], 4),
+                "variance_percentage": abs(variance),
+                "confidence": 0.85
+            })
+        return discrepancies
+    
+    def record_prices(self, state: AgentState):
+        """Add an invoice's unit prices to the price history once it has been approved.
+
+        Flagged invoices are left out, so disputed or anomalous prices never become
+        the baseline later invoices are compared against.
+        """
+        invoice = state.get("extracted_data")
+        matching = state.get("matching_results") or {}
+        if state.get("recommended_action") != "auto_approve" or state.get("duplicate_of") or not invoice:
+            return
+        po = self.po_db.get_po_by_number(matching["matched_po"]) if matching.get("matched_po") else None
+        pairs = self._line_pairs(invoice, po, matching) if po else []
+        item_codes = self._item_codes(invoice, po, pairs)
+        supplier = self._supplier(invoice, po)
+        for item, item_code in zip(invoice.get("line_items", []), item_codes):
+            norm = self.normalizer.normalize_line(item, invoice.get("currency"), invoice.get("invoice_date"))
+            self.price_history.update(supplier, item_code, norm["unit_price"], invoice.get("invoice_date", ""))
+    
+    def _check_line_items(self, invoice, po, pairs) -> list:
+        """Check line item discrepancies (prices in the comparison currency, quantities in base units)"""
+        discrepancies = []
+        currency = self.normalizer.comparison_currency(invoice, po)
+        on_date = invoice.get("invoice_date")
+        fmt = partial(self.normalizer.format, currency=currency)
+        po_line = {pair.invoice_index: pair for pair in pairs}
         
         for idx, inv_item in enumerate(invoice["line_items"]):
-            item_code = inv_item["item_code"]
+            pair = po_line.get(idx)
+            if pair is None:
+                discrepancies.append({
+                    "type": "unmatched_line_item",
+                    "severity": "medium",
+                    "field": f"line_items[{idx}]",
+                    "details": f"Line item '{inv_item['description']}' ({inv_item.get('item_code') or 'no code'}) does not correspond to any line on PO {po.get('po_number')}",
+                    "invoice_value": inv_item.get("line_total"),
+                    "po_value": None,
+                    "variance_percentage": None,
+                    "confidence": 0.80
+                })
+                continue
             
-            if item_code not in po_items:
-                continue  # Skip unmatched items
+            po_item = po["line_items"][pair.po_index]
+            if pair.method != "exact_code":
+                discrepancies.append({
+                    "type": "item_code_mismatch",
+                    "severity": "low",
+                    "field": f"line_items[{idx}].item_code",
+                    "details": f"Line item '{inv_item['description']}': Invoice code '{inv_item.get('item_code')}' paired with PO item '{po_item.get('item_id')}' ({po_item.get('description')}) by similarity {pair.score:.2f}",
+                    "invoice_value": None,
+                    "po_value": None,
+                    "variance_percentage": None,
+                    "confidence": round(pair.score, 2)
+                })
+            inv_norm = self.normalizer.normalize_line(inv_item, invoice.get("currency"), on_date, currency)
+            po_norm = self.normalizer.normalize_line(po_item, po.get("currency"), on_date, currency)
             
-            po_item = po_items[item_code]
+            if not (inv_norm["dimension"] and po_norm["dimension"]):
+                # Unit missing or unknown on either side: compare as printed, without conversion
+                inv_norm = self.normalizer.normalize_line({**inv_item, "unit": None}, invoice.get("currency"), on_date, currency)
+                po_norm = self.normalizer.normalize_line({**po_item, "unit": None}, po.get("currency"), on_date, currency)
+                inv_norm["unit"] = po_norm["unit"] = po_item.get("unit") or inv_item.get("unit") or "unit"
+            elif inv_norm["dimension"] != po_norm["dimension"]:
+                # e.g. kg vs litres - not convertible
+                discrepancies.append({
+                    "type": "unit_mismatch",
+                    "severity": "medium",
+                    "field": f"line_items[{idx}].unit",
+                    "details": f"Line item '{inv_item['description']}': Invoice unit '{inv_item.get('unit')}' is not comparable with PO unit '{po_item.get('unit')}'",
+                    "invoice_value": None,
+                    "po_value": None,
+                    "variance_percentage": None,
+                    "confidence": 0.90
+                })
+                continue
+            if inv_norm["unit_price"] is None or po_norm["unit_price"] is None:
+                discrepancies.append({
+                    "type": "currency_mismatch",
+                    "severity": "medium",
+                    "field": f"line_items[{idx}].unit_price",
+                    "details": f"Line item '{inv_item['description']}': No exchange rate for {invoice.get('currency') or po.get('currency')}",
+                    "invoice_value": inv_item["unit_price"],
+                    "po_value": po_item["unit_price"],
+                    "variance_percentage": None,
+                    "confidence": 0.90
+                })
+                continue
+            
+            unit = inv_norm["unit"]
             
             # Check price variance
-            inv_price = inv_item["unit_price"]
-            po_price = po_item["unit_price"]
+            inv_price = inv_norm["unit_price"]
+            po_price = po_norm["unit_price"]
             
             if po_price > 0:
                 variance = abs(inv_price - po_price) / po_price
@@ -104,9 +282,9 @@ class DiscrepancyDetectionAgent:
                         "type": "price_mismatch",
                         "severity": "high",
                         "field": f"line_items[{idx}].unit_price",
-                        "details": f"Line item '{inv_item['description']}': Invoice price £{inv_price:.2f} vs PO price £{po_price:.2f} ({variance*100:.1f}% variance)",
-                        "invoice_value": inv_price,
-                        "po_value": po_price,
+                        "details": f"Line item '{inv_item['description']}': Invoice price {fmt(inv_price)}/{unit} vs PO price {fmt(po_price)}/{unit} ({variance*100:.1f}% variance)",
+                        "invoice_value": round(inv_price, 4),
+                        "po_value": round(po_price, 4),
                         "variance_percentage": variance,
                         "confidence": 0.99
                     })
@@ -116,21 +294,21 @@ class DiscrepancyDetectionAgent:
                         "severity": "medium",
                         "field": f"line_items[{idx}].unit_price",
                         "details": f"Line item '{inv_item['description']}': Price variance of {variance*100:.1f}% (within review threshold)",
-                        "invoice_value": inv_price,
-                        "po_value": po_price,
+                        "invoice_value": round(inv_price, 4),
+                        "po_value": round(po_price, 4),
                         "variance_percentage": variance,
                         "confidence": 0.98
                     })
             
             # Check quantity variance
-            if inv_item["quantity"] != po_item["quantity"]:
+            if abs(inv_norm["quantity"] - po_norm["quantity"]) > 1e-9 * max(abs(po_norm["quantity"]), 1):
                 discrepancies.append({
                     "type": "quantity_mismatch",
                     "severity": "medium",
                     "field": f"line_items[{idx}].quantity",
-                    "details": f"Line item '{inv_item['description']}': Invoice quantity {inv_item['quantity']} vs PO quantity {po_item['quantity']}",
-                    "invoice_value": inv_item["quantity"],
-                    "po_value": po_item["quantity"],
+                    "details": f"Line item '{inv_item['description']}': Invoice quantity {inv_norm['quantity']:g} {unit} vs PO quantity {po_norm['quantity']:g} {unit}",
+                    "invoice_value": inv_norm["quantity"],
+                    "po_value": po_norm["quantity"],
                     "variance_percentage": None,
                     "confidence": 0.99
                 })
@@ -138,35 +316,38 @@ class DiscrepancyDetectionAgent:
         return discrepancies
     
     def _check_total_variance(self, invoice, po) -> dict:
-        """Check total amount variance"""
-        inv_total = invoice.get("total", 0)
-        po_total = po.get("total", 0)
+        """Check total amount variance (in the comparison currency; the amount tolerance is in base currency)"""
+        inv_total, po_total, currency = self._comparable_totals(invoice, po)
+        if inv_total is None or po_total is None:
+            return None
         
         variance_amount = abs(inv_total - po_total)
         variance_pct = variance_amount / po_total if po_total > 0 else 0
         
         # Check if within tolerance
-        if variance_amount <= Config.TOTAL_VARIANCE_AMOUNT:
+        base_variance = self.normalizer.to_base(variance_amount, currency, invoice.get("invoice_date"))
+        if base_variance is not None and base_variance <= Config.TOTAL_VARIANCE_AMOUNT:
             return None
         
         if variance_pct <= Config.TOTAL_VARIANCE_PERCENT:
             return None
         
         # Significant variance
+        fmt = partial(self.normalizer.format, currency=currency)
         severity = "high" if variance_pct > 0.10 else "medium"
         
         return {
             "type": "total_variance",
             "severity": severity,
             "field": "total",
-            "details": f"Invoice total £{inv_total:.2f} vs PO total £{po_total:.2f} (£{variance_amount:.2f} difference, {variance_pct*100:.1f}% variance)",
-            "invoice_value": inv_total,
-            "po_value": po_total,
+            "details": f"Invoice total {fmt(inv_total)} vs PO total {fmt(po_total)} ({fmt(variance_amount)} difference, {variance_pct*100:.1f}% variance)",
+            "invoice_value": round(inv_total, 2),
+            "po_value": round(po_total, 2),
             "variance_percentage": variance_pct,
             "confidence": 0.99
         }
     
-    def _build_reasoning(self, discrepancies: list) -> str:
+    def build_reasoning(self, discrepancies: list) -> str:
         """Build reasoning text"""
         if not discrepancies:
             return "No discrepancies detected. All line items and totals match PO within acceptable tolerance."
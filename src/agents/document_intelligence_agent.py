@@ -1,22 +1,75 @@
-from orchestration.state import AgentState, ExtractedInvoice, LineItem
+from orchestration.state import AgentState, ExtractedInvoice
 from extraction.ocr import DocumentExtractor
+from extraction.compaction import TextCompactor
+from extraction.template_parser import TemplateParser
+from extraction.validation import InvoiceValidator
 from llm.client import LLMClient
-import json
+from matching.duplicate_index import FingerprintIndex
+from orchestration.payloads import PayloadStore
+from monitoring.metrics import DUPLICATES
+from config import Config
+from typing import Optional
+import logging
+import threading
 import time
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+logger = logging.getLogger(__name__)
+
+
 class DocumentIntelligenceAgent:
-    def __init__(self):
+    def __init__(self, payloads: PayloadStore = None):
+        self.payloads = payloads if payloads is not None else PayloadStore()
         self.extractor = DocumentExtractor()
+        self.compactor = TextCompactor()
+        self.template_parser = TemplateParser()
+        self.validator = InvoiceValidator()
         self.llm = LLMClient()
+        self._large_llm = None
+        self._large_llm_failed = False
+        self._large_llm_lock = threading.Lock()
+        self.fingerprints = FingerprintIndex()
+        # The graph (and this agent) is shared by concurrent invoices
+        self._stats_lock = threading.Lock()
+        self.tier_stats = {
+            tier: {"attempts": 0, "accepted": 0, "total_ms": 0.0} for tier in Config.EXTRACTION_TIERS
+        }
+    
+    @property
+    def large_llm(self) -> Optional[LLMClient]:
+        """Escalation model, only loaded the first time a cheaper tier fails validation.
+
+        None when no large model is configured for the backend or it failed to load;
+        the failure is remembered so the constructor is not retried for every invoice.
+        """
+        if self._large_llm is None and not self._large_llm_failed:
+            with self._large_llm_lock:
+                if self._large_llm is None and not self._large_llm_failed:
+                    model = Config.LLM_LARGE_MODEL or Config.LLM_LARGE_MODEL_DEFAULTS.get(Config.LLM_BACKEND)
+                    if not model:
+                        logger.info("No LLM_LARGE_MODEL for backend %s; large_llm tier disabled", Config.LLM_BACKEND)
+                        self._large_llm_failed = True
+                        return None
+                    try:
+                        self._large_llm = LLMClient(model=model)
+                    except Exception as e:
+                        logger.error("Error loading large model %s, large_llm tier disabled: %s", model, e)
+                        self._large_llm_failed = True
+        return self._large_llm
     
     def process(self, state: AgentState) -> AgentState:
         """Extract structured data from invoice"""
         start_time = time.time()
         
         try:
+            # Identical file already processed: skip OCR and LLM entirely
+            content_hash = self.fingerprints.content_hash(state["invoice_path"])
+            original = self.fingerprints.find_exact(content_hash)
+            if original:
+                return self._mark_duplicate(state, original, "exact_file", original["quality"], start_time)
+            
             # Extract raw text
             raw_text, quality = self.extractor.extract_text(state["invoice_path"])
             
@@ -25,33 +78,59 @@ class DocumentIntelligenceAgent:
                 state["extraction_confidence"] = 0.0
                 state["document_quality"] = "poor"
                 return state
+            # Kept out of the state: later nodes fetch it by reference only if they need it
+            state["raw_text_ref"] = self.payloads.put(raw_text, state.get("raw_text_ref"))
             
-            # Use LLM to structure the data
-            prompt = self._build_extraction_prompt(raw_text)
-            structured_data = self.llm.generate_structured(prompt, max_tokens=2000)
+            # Same document in another form (e.g. PDF vs scan): skip the LLM. Similar text is only
+            # a candidate; a different invoice from the same template can be a few bits away
+            fingerprint = self.fingerprints.simhash(raw_text)
+            original = self.fingerprints.find_near(fingerprint)
+            if original and self._same_invoice(original, raw_text):
+                self.fingerprints.register_alias(content_hash, original)
+                return self._mark_duplicate(state, original, "near_duplicate_text", quality, start_time)
             
-            if not structured_data:
-                # Fallback to basic parsing
-                structured_data = self._basic_parse(raw_text)
+            # Strip noise and cap the input before it reaches the LLM
+            compaction = self.compactor.compact(raw_text)
+            max_tokens = self.compactor.output_token_budget(compaction["line_item_count"])
             
-            # Build extracted invoice
-            extracted_invoice = self._build_extracted_invoice(structured_data)
+            # Cheapest tier whose result validates wins
+            extracted_invoice, confidence, validation, tier, tier_trace = self._extract_tiered(
+                raw_text, compaction, max_tokens, quality
+            )
             
-            # Calculate confidence
-            confidence = self._calculate_confidence(extracted_invoice, quality)
+            # Re-keyed copy of a known invoice (same supplier, number and total)
+            key = self.fingerprints.invoice_key(
+                extracted_invoice["supplier_name"], extracted_invoice["invoice_number"], extracted_invoice["total"]
+            )
+            original = self.fingerprints.find_by_key(key)
+            if original:
+                state["duplicate_of"] = {"filename": original["filename"], "match_type": "invoice_key"}
+                DUPLICATES.inc("invoice_key")
+                self.fingerprints.register_alias(content_hash, original)
+            else:
+                self.fingerprints.register(
+                    state["invoice_filename"], content_hash, fingerprint, key,
+                    extracted=extracted_invoice, quality=quality
+                )
             
             # Update state
             state["extracted_data"] = extracted_invoice
             state["extraction_confidence"] = confidence
+            state["extraction_validation"] = validation
             state["document_quality"] = quality
-            state["extraction_reasoning"] = self._build_reasoning(extracted_invoice, quality, confidence)
+            state["extraction_reasoning"] = self._build_reasoning(extracted_invoice, quality, confidence, validation)
             
             # Update trace
             duration = time.time() - start_time
             state["agent_execution_trace"]["document_intelligence_agent"] = {
                 "duration_ms": int(duration * 1000),
                 "confidence": confidence,
-                "status": "success"
+                "status": "success",
+                "extraction_tier": tier,
+                "tiers": tier_trace,
+                "prompt_tokens": compaction["compacted_tokens"],
+                "prompt_reduction_ratio": round(compaction["reduction_ratio"], 3),
+                "max_new_tokens": max_tokens
             }
             
         except Exception as e:
@@ -60,6 +139,153 @@ class DocumentIntelligenceAgent:
             
         return state
     
+    def _extract_tiered(self, raw_text: str, compaction: dict, max_tokens: int, quality: str) -> tuple:
+        """Run template parser -> small LLM -> large LLM, stopping at the first valid result.
+
+        Returns (invoice, confidence, validation, tier, per-tier trace). If no tier
+        validates, the highest-confidence candidate is returned.
+        """
+        best = None
+        tier_trace = {}
+        
+        for tier in Config.EXTRACTION_TIERS:
+            if tier == "large_llm" and self.large_llm is None:
+                continue
+            start = time.perf_counter()
+            try:
+                data = self._run_tier(tier, raw_text, compaction, max_tokens)
+            except Exception as e:
+                logger.warning("Extraction tier %s failed: %s", tier, e, extra={"tier": tier})
+                data = {}
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            
+            accepted = False
+            if data:
+                invoice, confidence, validation = self._score(self._build_extracted_invoice(data), quality)
+                accepted = validation["valid"] and confidence >= Config.TIER_ACCEPT_CONFIDENCE
+                if best is None or confidence > best[1]:
+                    best = (invoice, confidence, validation, tier)
+            
+            tier_trace[tier] = {"duration_ms": int(elapsed_ms), "accepted": accepted}
+            with self._stats_lock:
+                stats = self.tier_stats[tier]
+                stats["attempts"] += 1
+                stats["total_ms"] += elapsed_ms
+                if accepted:
+                    stats["accepted"] += 1
+            if accepted:
+                logger.info("Extraction accepted at tier: %s", tier, extra={"tier": tier, "sample": True})
+                return best[0], best[1], best[2], tier, tier_trace
+        
+        if best is None:
+            invoice, confidence, validation = self._score(self._build_extracted_invoice({}), quality)
+            return invoice, confidence, validation, "none", tier_trace
+        return best[0], best[1], best[2], best[3], tier_trace
+    
+    def _same_invoice(self, original: dict, raw_text: str) -> bool:
+        """Confirm a near-duplicate candidate: a cheap template parse must give the original's
+        (supplier, invoice number, total) key before its extraction is reused"""
+        parsed = self.template_parser.parse(raw_text)
+        key = self.fingerprints.invoice_key(parsed["supplier_name"], parsed["invoice_number"], parsed["total"])
+        return key is not None and original.get("key") is not None and list(key) == list(original["key"])
+    
+    def _run_tier(self, tier: str, raw_text: str, compaction: dict, max_tokens: int) -> dict:
+        if tier == "template":
+            return self.template_parser.parse(raw_text)
+        
+        prompt = self._build_extraction_prompt(compaction["text"])
+        if tier == "small_llm":
+            logger.info("Prompt compaction: %d -> %d tokens", compaction["original_tokens"],
+                        compaction["compacted_tokens"], extra={"max_new_tokens": max_tokens, "sample": True})
+            return self.llm.generate_structured(prompt, max_tokens=max_tokens)
+        if tier == "large_llm":
+            return self.large_llm.generate_structured(prompt, max_tokens=Config.LLM_MAX_OUTPUT_TOKENS)
+        raise ValueError(f"Unknown extraction tier '{tier}'")
+    
+    def _score(self, invoice: ExtractedInvoice, quality: str) -> tuple:
+        """Validate/repair arithmetic and score it: returns (invoice, confidence, validation)"""
+        validation = self.validator.validate(invoice)
+        invoice = validation.pop("invoice")
+        return invoice, self._calculate_confidence(invoice, quality, validation), validation
+    
+    def tier_summary(self) -> dict:
+        """Hit rate and mean latency per extraction tier"""
+        with self._stats_lock:
+            tier_stats = {tier: dict(stats) for tier, stats in self.tier_stats.items()}
+        return {
+            tier: {
+                "attempts": stats["attempts"],
+                "hit_rate": stats["accepted"] / stats["attempts"] if stats["attempts"] else 0.0,
+                "mean_ms": stats["total_ms"] / stats["attempts"] if stats["attempts"] else 0.0
+            }
+            for tier, stats in tier_stats.items()
+        }
+    
+    def reextract(self, state: AgentState) -> AgentState:
+        """Second LLM pass over the full, uncompacted text when the first extraction was weak"""
+        start_time = time.time()
+        status = "no_improvement"
+        
+        try:
+            raw_text = self.payloads.get(state.get("raw_text_ref"))
+            if not raw_text:
+                return state
+            
+            prompt = self._build_extraction_prompt(raw_text)
+            llm = self.large_llm or self.llm
+            structured_data = llm.generate_structured(prompt, max_tokens=Config.LLM_MAX_OUTPUT_TOKENS)
+            
+            if structured_data:
+                extracted_invoice, confidence, validation = self._score(
+                    self._build_extracted_invoice(structured_data), state["document_quality"]
+                )
+                
+                if confidence > state["extraction_confidence"]:
+                    status = "improved"
+                    state["extracted_data"] = extracted_invoice
+                    state["extraction_confidence"] = confidence
+                    state["extraction_validation"] = validation
+                    state["extraction_reasoning"] = self._build_reasoning(
+                        extracted_invoice, state["document_quality"], confidence, validation
+                    ) + " (after LLM re-extraction)"
+            
+            duration = time.time() - start_time
+            state["agent_execution_trace"]["llm_re_extraction"] = {
+                "duration_ms": int(duration * 1000),
+                "confidence": state["extraction_confidence"],
+                "status": status
+            }
+            
+        except Exception as e:
+            state["errors"].append(f"LLM re-extraction error: {str(e)}")
+        
+        return state
+    
+    def _mark_duplicate(self, state: AgentState, original: dict, match_type: str, quality: str,
+                        start_time: float) -> AgentState:
+        """Short-circuit a duplicate: reuse the original's extraction instead of calling the LLM"""
+        extracted_invoice, confidence, validation = self._score(original["extracted"], quality)
+        
+        state["duplicate_of"] = {"filename": original["filename"], "match_type": match_type}
+        DUPLICATES.inc(match_type)
+        state["extracted_data"] = extracted_invoice
+        state["extraction_confidence"] = confidence
+        state["extraction_validation"] = validation
+        state["document_quality"] = quality
+        state["extraction_reasoning"] = (
+            f"Duplicate of {original['filename']} ({match_type.replace('_', ' ')}). "
+            f"Reused its extraction of invoice {extracted_invoice['invoice_number']}; LLM extraction skipped."
+        )
+        
+        duration = time.time() - start_time
+        state["agent_execution_trace"]["document_intelligence_agent"] = {
+            "duration_ms": int(duration * 1000),
+            "confidence": confidence,
+            "status": "duplicate",
+            "duplicate_match": match_type
+        }
+        return state
+    
     def _build_extraction_prompt(self, raw_text: str) -> str:
         return f"""Extract invoice data from the following text and return ONLY a JSON object.
 
@@ -91,40 +317,6 @@ Return a JSON object with this structure:
 
 Return ONLY the JSON, no other text."""
     
-    def _basic_parse(self, text: str) -> dict:
-        """Fallback basic parsing if LLM fails"""
-        import re
-        
-        result = {
-            "invoice_number": "",
-            "invoice_date": "",
-            "supplier_name": "",
-            "po_reference": None,
-            "currency": "GBP",
-            "line_items": [],
-            "subtotal": 0.0,
-            "vat_amount": 0.0,
-            "vat_rate": 0.20,
-            "total": 0.0
-        }
-        
-        # Extract invoice number
-        inv_match = re.search(r'(?:Invoice|INV)[:\s#-]*([A-Z0-9-]+)', text, re.IGNORECASE)
-        if inv_match:
-            result["invoice_number"] = inv_match.group(1)
-        
-        # Extract PO reference
-        po_match = re.search(r'PO[:\s#-]*([A-Z0-9-]+)', text, re.IGNORECASE)
-        if po_match:
-            result["po_reference"] = po_match.group(1)
-        
-        # Extract total
-        total_match = re.search(r'Total[:\s]*[£$€]?([0-9,]+\.?[0-9]*)', text, re.IGNORECASE)
-        if total_match:
-            result["total"] = float(total_match.group(1).replace(',', ''))
-        
-        return result
-    
     def _build_extracted_invoice(self, data: dict) -> ExtractedInvoice:
         """Build ExtractedInvoice from parsed data"""
         return {
@@ -154,8 +346,8 @@ Return ONLY the JSON, no other text."""
             "total": float(data.get("total", 0))
         }
     
-    def _calculate_confidence(self, invoice: ExtractedInvoice, quality: str) -> float:
-        """Calculate extraction confidence score"""
+    def _calculate_confidence(self, invoice: ExtractedInvoice, quality: str, validation: dict = None) -> float:
+        """Calculate extraction confidence score from quality, field presence and arithmetic"""
         score = 0.5  # Base score
         
         # Quality bonus
@@ -173,11 +365,25 @@ Return ONLY the JSON, no other text."""
             score += 0.05
         if invoice["total"] > 0:
             score += 0.05
-        if len(invoice["line_items"]) > 0:
-            score += 0.1
         
-        return min(score, 0.99)
+        # Arithmetic consistency replaces the old "has line items" bonus
+        if validation is None:
+            validation = self.validator.validate(invoice)
+        if invoice["line_items"]:
+            score += 0.1 * validation["score"]
+            if validation["score"] < 0.5:
+                score -= 0.15  # Numbers contradict each other
+        score -= 0.02 * len(validation["repairs"])
+        
+        return max(0.0, min(score, 0.99))
     
-    def _build_reasoning(self, invoice: ExtractedInvoice, quality: str, confidence: float) -> str:
+    def _build_reasoning(self, invoice: ExtractedInvoice, quality: str, confidence: float,
+                         validation: dict = None) -> str:
         """Build human-readable reasoning"""
-        return f"Extracted invoice {invoice['invoice_number']} with {quality} quality. Found {len(invoice['line_items'])} line items. Extraction confidence: {confidence:.2%}."
+        reasoning = f"Extracted invoice {invoice['invoice_number']} with {quality} quality. Found {len(invoice['line_items'])} line items. Extraction confidence: {confidence:.2%}."
+        if validation:
+            if validation["repairs"]:
+                reasoning += f" Repaired: {'; '.join(validation['repairs'])}."
+            if validation["issues"]:
+                reasoning += f" Arithmetic issues: {'; '.join(validation['issues'])}."
+        return reasoning
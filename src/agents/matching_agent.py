@@ -1,18 +1,24 @@
 from orchestration.state import AgentState, MatchingResult
-from matching.po_lookup import PODatabase
+from matching.po_lookup import create_po_database
 from matching.fuzzy_matching import FuzzyMatcher
+from matching.line_alignment import LineAligner
 import time
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 class MatchingAgent:
-    def __init__(self):
-        self.po_db = PODatabase()
+    def __init__(self, po_db=None):
+        self.po_db = po_db or create_po_database()
         self.fuzzy = FuzzyMatcher()
+        self.aligner = LineAligner()
     
-    def process(self, state: AgentState) -> AgentState:
-        """Match invoice to PO database"""
+    def process(self, state: AgentState, stages: tuple = ("exact", "fallback")) -> AgentState:
+        """Match invoice to PO database.
+
+        The graph runs the cheap exact stage first and only calls the fallback
+        stage (supplier / product search) when no PO reference matched.
+        """
         start_time = time.time()
         
         try:
@@ -21,35 +27,21 @@ class MatchingAgent:
                 state["errors"].append("No extracted data to match")
                 return state
             
-            # Try primary matching (exact PO reference)
             matched_po = None
             match_method = "none"
             confidence = 0.0
             
-            po_ref = extracted.get("po_reference")
-            if po_ref:
-                matched_po = self.po_db.get_po_by_number(po_ref)
-                if matched_po:
-                    match_method = "exact_po_reference"
-                    confidence = 0.99
-            
-            # Fallback: match by supplier
-            if not matched_po:
-                supplier_matches = self.po_db.search_by_supplier(extracted["supplier_name"])
-                if supplier_matches:
-                    matched_po = supplier_matches[0]
-                    match_method = "supplier_match"
-                    confidence = 0.75
+            # Try primary matching (exact PO reference)
+            if "exact" in stages:
+                po_ref = extracted.get("po_reference")
+                if po_ref:
+                    matched_po = self.po_db.get_po_by_number(po_ref)
+                    if matched_po:
+                        match_method = "exact_po_reference"
+                        confidence = 0.99
             
-            # Fallback: match by products
-            if not matched_po and extracted["line_items"]:
-                product_codes = [item["item_code"] for item in extracted["line_items"] if item["item_code"]]
-                product_matches = self.po_db.search_by_products(product_codes)
-                if product_matches:
-                    best = product_matches[0]
-                    matched_po = best["po"]
-                    match_method = "product_fuzzy_match"
-                    confidence = best["match_rate"] * 0.8
+            if not matched_po and "fallback" in stages:
+                matched_po, match_method, confidence = self._fallback_match(extracted)
             
             # Build matching results
             if matched_po:
@@ -64,7 +56,8 @@ class MatchingAgent:
             
             # Update trace
             duration = time.time() - start_time
-            state["agent_execution_trace"]["matching_agent"] = {
+            trace_key = "fallback_matching" if stages == ("fallback",) else "matching_agent"
+            state["agent_execution_trace"][trace_key] = {
                 "duration_ms": int(duration * 1000),
                 "confidence": confidence,
                 "status": "success"
@@ -75,20 +68,39 @@ class MatchingAgent:
         
         return state
     
+    def _fallback_match(self, extracted) -> tuple:
+        """Supplier, then product-code search; returns (po, method, confidence)"""
+        # Fallback: match by supplier
+        supplier_matches = self.po_db.search_by_supplier(extracted["supplier_name"])
+        if supplier_matches:
+            return supplier_matches[0], "supplier_match", 0.75
+        
+        # Fallback: match by products
+        if extracted["line_items"]:
+            product_codes = [item["item_code"] for item in extracted["line_items"] if item["item_code"]]
+            product_matches = self.po_db.search_by_products(product_codes)
+            if product_matches:
+                best = product_matches[0]
+                return best["po"], "product_fuzzy_match", best["match_rate"] * 0.8
+        
+        return None, "none", 0.0
+    
     def _build_matching_result(self, invoice, po, method, confidence) -> MatchingResult:
         """Build matching result"""
-        # Count matched line items
-        matched_items = 0
+        # Pair line items, including those whose codes differ from the PO's
+        alignment = []
         total_items = len(invoice["line_items"])
         
         if po:
             po_items = po.get("line_items", [])
-            invoice_codes = [item["item_code"] for item in invoice["line_items"]]
-            po_codes = [item["item_id"] for item in po_items]
-            
-            for code in invoice_codes:
-                if code in po_codes:
-                    matched_items += 1
+            alignment = [{
+                "invoice_line": pair.invoice_index,
+                "po_line": pair.po_index,
+                "po_item_id": po_items[pair.po_index].get("item_id"),
+                "score": pair.score,
+                "method": pair.method
+            } for pair in self.aligner.align(invoice, po)]
+        matched_items = len(alignment)
         
         match_rate = matched_items / total_items if total_items > 0 else 0.0
         
@@ -107,6 +119,7 @@ class MatchingAgent:
             "line_items_matched": matched_items,
             "line_items_total": total_items,
             "match_rate": match_rate,
+            "line_item_alignment": alignment,
             "alternative_matches": []
         }
     
@@ -120,12 +133,15 @@ class MatchingAgent:
             "line_items_matched": 0,
             "line_items_total": 0,
             "match_rate": 0.0,
+            "line_item_alignment": [],
             "alternative_matches": []
         }
     
     def _build_reasoning(self, result: MatchingResult, invoice) -> str:
         """Build reasoning text"""
         if result["matched_po"]:
-            return f"Matched to PO {result['matched_po']} using {result['match_method']} with {result['po_match_confidence']:.0%} confidence. {result['line_items_matched']}/{result['line_items_total']} line items matched."
+            aligned = sum(1 for pair in result["line_item_alignment"] if pair["method"] == "aligned")
+            by_alignment = f" ({aligned} paired despite differing item codes)" if aligned else ""
+            return f"Matched to PO {result['matched_po']} using {result['match_method']} with {result['po_match_confidence']:.0%} confidence. {result['line_items_matched']}/{result['line_items_total']} line items matched{by_alignment}."
         else:
             return f"No PO match found for invoice {invoice.get('invoice_number', 'UNKNOWN')}. No matching supplier or products in database."
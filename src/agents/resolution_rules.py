@@ -0,0 +1,140 @@
+import json
+import logging
+import operator
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import List, NamedTuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "==": operator.eq, "!=": operator.ne
+}
+ACTIONS = ("auto_approve", "flag_for_review", "escalate_to_human")
+
+
+class Facts(dict):
+    """Aggregates for one invoice; absent counters read as 0"""
+
+    def __missing__(self, key):
+        return 0
+
+
+class CompiledRule(NamedTuple):
+    name: str
+    priority: float
+    test: object  # Facts -> bool
+    action: str
+    risk: str
+    confidence: float
+    reasoning: str
+
+
+def _compile_condition(spec, rule_name: str):
+    """[fact, op, value] triples, lists (all) or {"all"/"any": [...]} groups -> predicate"""
+    if isinstance(spec, dict):
+        if len(spec) != 1 or next(iter(spec)) not in ("all", "any"):
+            raise ValueError(f"Rule '{rule_name}': condition groups must be {{'all': [...]}} or {{'any': [...]}}")
+        mode, children = next(iter(spec.items()))
+        tests = [_compile_condition(child, rule_name) for child in children]
+        combine = all if mode == "all" else any
+        return lambda facts: combine(test(facts) for test in tests)
+
+    if spec and not isinstance(spec[0], (list, dict)):
+        fact, op, value = spec
+        if op not in OPERATORS:
+            raise ValueError(f"Rule '{rule_name}': unknown operator '{op}'")
+        if isinstance(value, str) and value.startswith("$"):
+            # Thresholds shared with the rest of the pipeline
+            value = getattr(Config, value[1:])
+        compare = OPERATORS[op]
+        return lambda facts: compare(facts[fact], value)
+
+    return _compile_condition({"all": list(spec)}, rule_name)
+
+
+def compile_rules(spec: dict) -> List[CompiledRule]:
+    rules = []
+    for raw in spec.get("rules", []):
+        name = raw["name"]
+        if raw["action"] not in ACTIONS:
+            raise ValueError(f"Rule '{name}': unknown action '{raw['action']}'")
+        rules.append(CompiledRule(
+            name=name,
+            priority=float(raw.get("priority", 0)),
+            test=_compile_condition(raw.get("when", []), name),
+            action=raw["action"],
+            risk=raw["risk"],
+            confidence=float(raw["confidence"]),
+            reasoning=raw.get("reasoning", "")
+        ))
+    rules.sort(key=lambda rule: rule.priority)
+    return rules
+
+
+@lru_cache(maxsize=None)
+def load_rules(rules_file: str) -> tuple:
+    """Read and compile a rules file once per process (JSON, or YAML when PyYAML is installed)"""
+    with open(rules_file, "r") as f:
+        if rules_file.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    return tuple(compile_rules(spec))
+
+
+# Used when the rules file cannot be loaded: never auto-approve without a policy
+FALLBACK_RULE = CompiledRule(
+    "rules_unavailable", 0, lambda facts: True, "escalate_to_human", "high", 0.50,
+    "Resolution rules could not be loaded. Human review required."
+)
+
+
+class ResolutionRules:
+    """Evaluation plan: one aggregation pass over discrepancies, then rules in priority order"""
+
+    def __init__(self, rules_file: str = None):
+        self.rules_file = rules_file or Config.RESOLUTION_RULES_FILE
+        try:
+            self.rules = load_rules(self.rules_file)
+        except Exception as e:
+            logger.error("Error loading resolution rules: %s", e)
+            self.rules = (FALLBACK_RULE,)
+        self.hits = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def aggregate(extraction_conf: float, matching: dict, discrepancies: list) -> Facts:
+        facts = Facts(
+            extraction_confidence=extraction_conf,
+            matched_po=bool(matching and matching.get("matched_po")),
+            po_match_confidence=(matching or {}).get("po_match_confidence", 0),
+            discrepancy_count=len(discrepancies)
+        )
+        for disc in discrepancies:
+            dtype, severity = disc.get("type"), disc.get("severity")
+            facts[f"count_{severity}"] += 1
+            facts[f"count_{dtype}"] += 1
+            facts[f"count_{dtype}_{severity}"] += 1
+            # Details and variance of the first discrepancy of each kind, for reasoning text
+            facts.setdefault(f"details_{dtype}", disc.get("details"))
+            facts.setdefault(f"variance_{dtype}_{severity}", disc.get("variance_percentage") or 0)
+        return facts
+
+    def evaluate(self, extraction_conf: float, matching: dict, discrepancies: list) -> tuple:
+        """(action, risk, confidence, reasoning, rule name) of the first matching rule"""
+        facts = self.aggregate(extraction_conf, matching, discrepancies)
+        for rule in self.rules:
+            if rule.test(facts):
+                with self._lock:
+                    self.hits[rule.name] += 1
+                return rule.action, rule.risk, rule.confidence, rule.reasoning.format_map(facts), rule.name
+        return FALLBACK_RULE.action, FALLBACK_RULE.risk, FALLBACK_RULE.confidence, FALLBACK_RULE.reasoning, None
+
+    def hit_summary(self) -> dict:
+        with self._lock:
+            return {rule.name: self.hits[rule.name] for rule in self.rules if self.hits[rule.name]}
@@ -0,0 +1,169 @@
+"""Sharded batch runs across machines (python src/main.py --coordinator / --worker).
+
+The coordinator splits the invoice set into shards of BATCH_SHARD_SIZE and puts
+them on a work queue (see batch/work_queue.py). Workers on any number of nodes
+lease shards, run each invoice through their own graph and ack the results with
+the shard. Once the queue drains the coordinator writes every result to
+OUTPUT_DIR under the names a local run uses. Each ack also carries the metrics
+the worker recorded since its previous ack, which the coordinator adds to its
+own registry (so METRICS_DUMP_FILE covers the whole batch). Queue events after
+a worker's last ack (a final nack or lost lease) stay in that worker's metrics.
+
+Invoices are queued by file name and read from INVOICES_DIR on the worker, so
+every node needs the same files there (shared storage or a synced copy).
+Duplicate detection and price history are per worker unless
+FINGERPRINT_INDEX_FILE / PRICE_HISTORY_FILE point at shared files.
+"""
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import List
+from config import Config
+from orchestration.output import write_json
+from monitoring.metrics import BATCH_JOBS, REGISTRY, snapshot_delta
+from monitoring.structured_logging import correlation, new_id
+from batch.work_queue import Lease, WorkQueue
+
+logger = logging.getLogger(__name__)
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def shard(batch_id: str, invoices: list, size: int = None) -> list:
+    """Jobs of up to `size` consecutive (index, filename) pairs"""
+    size = max(1, size or Config.BATCH_SHARD_SIZE)
+    return [
+        {"id": f"{batch_id}-{n:05d}", "batch": batch_id,
+         "invoices": [{"index": index, "filename": filename} for index, filename in invoices[start:start + size]]}
+        for n, start in enumerate(range(0, len(invoices), size), 1)
+    ]
+
+
+class Coordinator:
+    """Enqueue one batch, wait for the workers to drain it and merge their results"""
+
+    def __init__(self, queue: WorkQueue, shard_size: int = None):
+        self.queue = queue
+        self.shard_size = shard_size or Config.BATCH_SHARD_SIZE
+        self.batch_id = None
+
+    def submit(self, invoices: list) -> str:
+        """Queue (index, filename) pairs as a new batch, replacing whatever the queue held"""
+        self.batch_id = new_id()
+        jobs = shard(self.batch_id, invoices, self.shard_size)
+        self.queue.clear()
+        self.queue.set_meta("batch_id", self.batch_id)
+        self.queue.put(jobs)
+        # Workers exit once a sealed batch has drained; until then an empty queue means "wait"
+        self.queue.set_meta("sealed", "1")
+        logger.info("Queued %d invoices as %d shards", len(invoices), len(jobs),
+                    extra={"batch": self.batch_id, "shards": len(jobs)})
+        return self.batch_id
+
+    def wait(self, workers: List[subprocess.Popen] = (), poll: float = None, report_every: float = 30.0):
+        """Block until no shard is pending or leased"""
+        poll = poll or Config.BATCH_POLL_SECONDS
+        last_report = time.monotonic()
+        while not self.queue.drained():
+            if workers and all(proc.poll() is not None for proc in workers):
+                # Only reachable when no remote worker is helping either
+                logger.error("All local workers exited with shards left", extra={"queue": self.queue.stats()})
+                break
+            if time.monotonic() - last_report >= report_every:
+                logger.info("Waiting for workers", extra={"queue": self.queue.stats()})
+                last_report = time.monotonic()
+            time.sleep(poll)
+
+    def merge(self) -> tuple:
+        """Write every result of this batch to OUTPUT_DIR; returns (results by index, failed filenames)"""
+        os.makedirs(Config.OUTPUT_DIR, exist_ok=True)
+        merged = {}
+        for job_id, shard_result in self.queue.results():
+            if not job_id.startswith(f"{self.batch_id}-"):
+                continue  # a straggler from an earlier batch
+            for entry in shard_result["invoices"]:
+                output_path = os.path.join(Config.OUTPUT_DIR, f"invoice_{entry['index']}_output.json")
+                write_json(output_path, entry["result"])
+                merged[entry["index"]] = entry["result"]
+            REGISTRY.merge(shard_result.get("metrics", {}))
+
+        failed = []
+        for job_id, payload, error in self.queue.dead():
+            if payload.get("batch") == self.batch_id:
+                failed.extend((invoice["filename"], error) for invoice in payload["invoices"])
+        return [merged[index] for index in sorted(merged)], failed
+
+
+def spawn_local_workers(count: int, queue_url: str) -> List[subprocess.Popen]:
+    """Worker processes on this node, each with its own graph (and GIL)"""
+    return [
+        subprocess.Popen([sys.executable, MAIN_SCRIPT, "--worker", "--queue", queue_url],
+                         stdout=subprocess.DEVNULL)
+        for _ in range(count)
+    ]
+
+
+class BatchWorker:
+    """Lease shards until the sealed batch drains; the lease is renewed after every invoice"""
+
+    def __init__(self, queue: WorkQueue, graph, name: str = None, visibility: float = None):
+        self.queue = queue
+        self.graph = graph
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.visibility = visibility or Config.BATCH_VISIBILITY_SECONDS
+        self.shards = 0
+        self.invoices = 0
+        self._reported_metrics = {}
+
+    def run(self, idle_timeout: float = None) -> int:
+        """Process shards until the batch is finished (or nothing arrives for idle_timeout seconds)"""
+        idle_since = time.monotonic()
+        while True:
+            lease = self.queue.get(self.name, self.visibility)
+            if lease is None:
+                if self.queue.get_meta("sealed") and self.queue.drained():
+                    break
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(Config.BATCH_POLL_SECONDS)
+                continue
+            # Logs from this shard carry the batch id as their job id
+            with correlation(job=lease.payload.get("batch")):
+                self._process(lease)
+            idle_since = time.monotonic()
+        logger.info("Worker %s finished: %d shards, %d invoices", self.name, self.shards, self.invoices,
+                    extra={"shards": self.shards, "invoices": self.invoices})
+        return self.invoices
+
+    def _process(self, lease: Lease):
+        entries = []
+        try:
+            for invoice in lease.payload["invoices"]:
+                path = os.path.join(Config.INVOICES_DIR, invoice["filename"])
+                result = self.graph.process_invoice(path, invoice["filename"])
+                entries.append({**invoice, "result": result})
+                if not self.queue.extend(lease, self.visibility):
+                    # Lease expired and the shard went to another worker; it will redo it
+                    BATCH_JOBS.inc("lost")
+                    logger.warning("Lost lease on %s", lease.job_id, extra={"job": lease.job_id})
+                    return
+        except Exception as e:
+            logger.error("Error processing shard %s: %s", lease.job_id, e, exc_info=True,
+                         extra={"job": lease.job_id, "attempt": lease.attempts})
+            self.queue.nack(lease, f"{type(e).__name__}: {e}")
+            return
+
+        # Metrics since the last successful ack, including this shard's own "acked"
+        metrics = snapshot_delta(REGISTRY.snapshot(), self._reported_metrics)
+        metrics.setdefault(BATCH_JOBS.name, []).append([["acked"], 1.0])
+        if self.queue.ack(lease, {"worker": self.name, "invoices": entries, "metrics": metrics}):
+            BATCH_JOBS.inc("acked")
+            self._reported_metrics = REGISTRY.snapshot()
+            self.shards += 1
+            self.invoices += len(entries)
+            logger.info("Completed shard %s", lease.job_id, extra={
+                "job": lease.job_id, "invoices": len(entries), "attempt": lease.attempts, "sample": True
+            })
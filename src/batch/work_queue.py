@@ -0,0 +1,569 @@
+"""Work queues for sharded batch runs: SQLite, a shared directory or Redis.
+
+All backends share one at-least-once contract. `get` leases a job for a
+visibility timeout; a job neither acked nor nacked before its lease runs out is
+handed to the next worker that asks. `nack` puts a job back after an exponential
+backoff, and a job claimed more than BATCH_MAX_ATTEMPTS times is dead-lettered
+with its last error. Results travel with the ack, so the coordinator can merge
+them without a shared output directory. The first ack of a job wins.
+
+Lease deadlines use the clock of the node that takes the lease; keep nodes
+NTP-synced and the visibility timeout well above any expected skew.
+"""
+import contextlib
+import glob
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+from config import Config
+from monitoring.metrics import BATCH_JOBS
+from monitoring.structured_logging import new_id
+
+logger = logging.getLogger(__name__)
+
+
+class Lease(NamedTuple):
+    job_id: str
+    receipt: str  # identifies this claim; a reclaimed job gets a new one
+    attempts: int  # claims so far, including this one
+    payload: dict
+    error: Optional[str]  # error of the previous attempt, if any
+
+
+class WorkQueue:
+    """Backend-independent retry and dead-letter policy over the _claim/_release/_bury primitives"""
+
+    def __init__(self, max_attempts: int = None, retry_delay: float = None):
+        self.max_attempts = max_attempts or Config.BATCH_MAX_ATTEMPTS
+        self.retry_delay = Config.BATCH_RETRY_DELAY_SECONDS if retry_delay is None else retry_delay
+
+    def get(self, worker: str, visibility: float = None) -> Optional[Lease]:
+        """Lease the next available job, or None if nothing is available right now"""
+        visibility = visibility or Config.BATCH_VISIBILITY_SECONDS
+        while True:
+            lease = self._claim(worker, visibility, new_id())
+            if lease is None or lease.attempts <= self.max_attempts:
+                return lease
+            # Claimed once too often: its previous workers died or hung while holding it
+            self._bury(lease, lease.error or "visibility timeout expired")
+            BATCH_JOBS.inc("dead")
+            logger.error("Dead-lettered %s after %d attempts", lease.job_id, lease.attempts - 1,
+                         extra={"job": lease.job_id})
+
+    def nack(self, lease: Lease, error: str):
+        """Give a job back for retry after a backoff (or dead-letter it on its last attempt)"""
+        if lease.attempts >= self.max_attempts:
+            self._bury(lease, error)
+            BATCH_JOBS.inc("dead")
+            logger.error("Dead-lettered %s after %d attempts: %s", lease.job_id, lease.attempts, error,
+                         extra={"job": lease.job_id})
+            return
+        delay = self.retry_delay * 2 ** (lease.attempts - 1)
+        self._release(lease, error, time.time() + delay)
+        BATCH_JOBS.inc("retried")
+        logger.warning("Retrying %s in %.0fs: %s", lease.job_id, delay, error, extra={"job": lease.job_id})
+
+    def drained(self) -> bool:
+        stats = self.stats()
+        return stats["pending"] + stats["leased"] == 0
+
+    # Backend primitives
+
+    def put(self, jobs: list):
+        """Enqueue jobs ({"id": ..., **payload}); available immediately"""
+        raise NotImplementedError
+
+    def extend(self, lease: Lease, visibility: float = None) -> bool:
+        """Renew a lease; False once it has expired and been taken by another worker"""
+        raise NotImplementedError
+
+    def ack(self, lease: Lease, result: dict) -> bool:
+        """Complete a job with its result; False if another worker already completed it"""
+        raise NotImplementedError
+
+    def results(self) -> Iterator[tuple]:
+        """(job_id, result) of every completed job"""
+        raise NotImplementedError
+
+    def dead(self) -> Iterator[tuple]:
+        """(job_id, payload, error) of every dead-lettered job"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Job counts: pending, leased, done, dead"""
+        raise NotImplementedError
+
+    def set_meta(self, key: str, value: str):
+        raise NotImplementedError
+
+    def get_meta(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove every job, result and meta entry"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _claim(self, worker: str, visibility: float, receipt: str) -> Optional[Lease]:
+        raise NotImplementedError
+
+    def _release(self, lease: Lease, error: str, available_at: float):
+        raise NotImplementedError
+
+    def _bury(self, lease: Lease, error: str):
+        raise NotImplementedError
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    available_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    receipt TEXT,
+    worker TEXT,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_available ON jobs (state, available_at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# state is pending / leased / done / dead; available_at is "not before" while
+# pending and the lease deadline while leased, so expired leases are just available
+CLAIM = """
+SELECT id, payload, attempts, error FROM jobs
+WHERE state IN ('pending', 'leased') AND available_at <= ?
+ORDER BY available_at, id LIMIT 1
+"""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Jobs in one SQLite file (WAL); for a single node or CI, not for network filesystems"""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; writes take the lock up front with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def put(self, jobs: list):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO jobs (id, payload, state, available_at) VALUES (?, ?, 'pending', ?)",
+                [(job["id"], json.dumps(job), now) for job in jobs]
+            )
+
+    def _claim(self, worker: str, visibility: float, receipt: str) -> Optional[Lease]:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(CLAIM, (now,)).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts, error = row
+            conn.execute(
+                "UPDATE jobs SET state = 'leased', available_at = ?, attempts = ?, receipt = ?, worker = ? "
+                "WHERE id = ?", (now + visibility, attempts + 1, receipt, worker, job_id)
+            )
+        return Lease(job_id, receipt, attempts + 1, json.loads(payload), error)
+
+    def extend(self, lease: Lease, visibility: float = None) -> bool:
+        deadline = time.time() + (visibility or Config.BATCH_VISIBILITY_SECONDS)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET available_at = ? WHERE id = ? AND state = 'leased' AND receipt = ?",
+                (deadline, lease.job_id, lease.receipt)
+            )
+        return cursor.rowcount == 1
+
+    def ack(self, lease: Lease, result: dict) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, receipt = NULL WHERE id = ? AND state != 'done'",
+                (json.dumps(result), lease.job_id)
+            )
+        return cursor.rowcount == 1
+
+    def _release(self, lease: Lease, error: str, available_at: float):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'pending', available_at = ?, error = ?, receipt = NULL "
+                "WHERE id = ? AND state = 'leased' AND receipt = ?",
+                (available_at, error, lease.job_id, lease.receipt)
+            )
+
+    def _bury(self, lease: Lease, error: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'dead', error = ?, receipt = NULL "
+                "WHERE id = ? AND state = 'leased' AND receipt = ?",
+                (error, lease.job_id, lease.receipt)
+            )
+
+    def results(self) -> Iterator[tuple]:
+        for job_id, result in self.conn.execute("SELECT id, result FROM jobs WHERE state = 'done' ORDER BY id"):
+            yield job_id, json.loads(result)
+
+    def dead(self) -> Iterator[tuple]:
+        for job_id, payload, error in self.conn.execute(
+            "SELECT id, payload, error FROM jobs WHERE state = 'dead' ORDER BY id"
+        ):
+            yield job_id, json.loads(payload), error
+
+    def stats(self) -> dict:
+        counts = dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return {state: counts.get(state, 0) for state in ("pending", "leased", "done", "dead")}
+
+    def set_meta(self, key: str, value: str):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jobs")
+            conn.execute("DELETE FROM meta")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class FileWorkQueue(WorkQueue):
+    """Jobs as files in a shared directory; every state change is an atomic rename.
+
+    pending/<available_ms>~<id>.json   waiting (not before available_ms)
+    leased/<id>~<receipt>~<deadline_ms>.json
+    done/<id>.json, dead/<id>.json, meta/<key>
+    Putting the times in the file names means a claim, a renewal or a takeover of
+    an expired lease is a single rename that exactly one worker can win.
+    """
+
+    STATES = ("pending", "leased", "done", "dead", "meta")
+
+    def __init__(self, root: str, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+        for state in self.STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    def _path(self, state: str, name: str) -> str:
+        return os.path.join(self.root, state, name)
+
+    def _write(self, path: str, data: dict):
+        tmp = f"{path}.{new_id()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _names(self, state: str) -> list:
+        return sorted(name for name in os.listdir(os.path.join(self.root, state)) if name.endswith(".json"))
+
+    def _leased_file(self, lease: Lease) -> Optional[str]:
+        matches = glob.glob(self._path("leased", f"{glob.escape(lease.job_id)}~{lease.receipt}~*.json"))
+        return matches[0] if matches else None
+
+    def put(self, jobs: list):
+        for job in jobs:
+            if "~" in job["id"]:
+                raise ValueError(f"Job id may not contain '~': {job['id']}")
+            record = {"id": job["id"], "payload": job, "attempts": 0, "error": None}
+            self._write(self._path("pending", f"{0:015d}~{job['id']}.json"), record)
+
+    def _claim(self, worker: str, visibility: float, receipt: str) -> Optional[Lease]:
+        now_ms = int(time.time() * 1000)
+        deadline_ms = now_ms + int(visibility * 1000)
+        candidates = [
+            (name, self._path("pending", name), name[:-5].split("~", 1)[1])
+            for name in self._names("pending") if int(name.split("~", 1)[0]) <= now_ms
+        ] + [
+            (name, self._path("leased", name), name.split("~", 1)[0])
+            for name in self._names("leased") if int(name[:-5].rsplit("~", 1)[1]) <= now_ms
+        ]
+        for _, source, job_id in candidates:
+            target = self._path("leased", f"{job_id}~{receipt}~{deadline_ms}.json")
+            try:
+                os.rename(source, target)
+            except FileNotFoundError:
+                continue  # another worker won this one
+            if os.path.exists(self._path("done", f"{job_id}.json")):
+                # A worker whose lease had expired completed it after all
+                os.remove(target)
+                continue
+            record = self._read(target)
+            record["attempts"] += 1
+            record["worker"] = worker
+            self._write(target, record)
+            return Lease(job_id, receipt, record["attempts"], record["payload"], record["error"])
+        return None
+
+    def extend(self, lease: Lease, visibility: float = None) -> bool:
+        current = self._leased_file(lease)
+        if current is None:
+            return False
+        deadline_ms = int((time.time() + (visibility or Config.BATCH_VISIBILITY_SECONDS)) * 1000)
+        try:
+            os.rename(current, self._path("leased", f"{lease.job_id}~{lease.receipt}~{deadline_ms}.json"))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def ack(self, lease: Lease, result: dict) -> bool:
+        done = self._path("done", f"{lease.job_id}.json")
+        tmp = f"{done}.{new_id()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"id": lease.job_id, "result": result}, f)
+        try:
+            # link() fails if the target exists, so only the first ack lands
+            os.link(tmp, done)
+            completed = True
+        except FileExistsError:
+            completed = False
+        finally:
+            os.remove(tmp)
+        current = self._leased_file(lease)
+        if current is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(current)
+        return completed
+
+    def _release(self, lease: Lease, error: str, available_at: float):
+        current = self._leased_file(lease)
+        if current is None:
+            return
+        record = self._read(current)
+        record["error"] = error
+        self._write(self._path("pending", f"{int(available_at * 1000):015d}~{lease.job_id}.json"), record)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(current)
+
+    def _bury(self, lease: Lease, error: str):
+        current = self._leased_file(lease)
+        if current is None:
+            return
+        record = self._read(current)
+        record["error"] = error
+        self._write(self._path("dead", f"{lease.job_id}.json"), record)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(current)
+
+    def results(self) -> Iterator[tuple]:
+        for name in self._names("done"):
+            record = self._read(self._path("done", name))
+            yield record["id"], record["result"]
+
+    def dead(self) -> Iterator[tuple]:
+        for name in self._names("dead"):
+            record = self._read(self._path("dead", name))
+            yield record["id"], record["payload"], record["error"]
+
+    def stats(self) -> dict:
+        return {state: len(self._names(state)) for state in ("pending", "leased", "done", "dead")}
+
+    def set_meta(self, key: str, value: str):
+        self._write(self._path("meta", f"{key}.json"), {"value": value})
+
+    def get_meta(self, key: str) -> Optional[str]:
+        try:
+            return self._read(self._path("meta", f"{key}.json"))["value"]
+        except FileNotFoundError:
+            return None
+
+    def clear(self):
+        for state in self.STATES:
+            shutil.rmtree(os.path.join(self.root, state), ignore_errors=True)
+            os.makedirs(os.path.join(self.root, state), exist_ok=True)
+
+
+# Every state change that depends on the current owner is one script, so it is atomic
+# on the server. KEYS are hash-tagged with the queue name to stay in one cluster slot.
+REDIS_CLAIM = """
+local now = tonumber(ARGV[1])
+local id = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)[1]
+if not id then
+    id = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, 1)[1]
+    if not id then return false end
+end
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), id)
+redis.call('HSET', KEYS[3], id, ARGV[3])
+local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+return {id, redis.call('HGET', KEYS[5], id), attempts, redis.call('HGET', KEYS[6], id) or ''}
+"""
+REDIS_EXTEND = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZADD', KEYS[1], 'XX', ARGV[3], ARGV[1])
+return 1
+"""
+REDIS_ACK = """
+local first = redis.call('HSETNX', KEYS[3], ARGV[1], ARGV[3])
+if first == 1 or redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return first
+"""
+REDIS_RELEASE = """
+if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[3])
+if ARGV[4] == '' then return 1 end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+return 1
+"""
+
+
+def _text(value):
+    """Redis reply as str, from either a bytes client or one created with decode_responses=True"""
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisWorkQueue(WorkQueue):
+    """Jobs in Redis (or any server speaking its protocol with EVAL): sorted sets of
+    pending and leased ids scored by availability/deadline, hashes for the rest."""
+
+    def __init__(self, url: str = None, name: str = None, client=None, **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        name = name or Config.WORK_QUEUE_NAME
+        self.keys = {part: f"{{{name}}}:{part}" for part in (
+            "pending", "leased", "receipts", "attempts", "jobs", "errors", "results", "dead", "meta"
+        )}
+        self._claim_script = client.register_script(REDIS_CLAIM)
+        self._extend_script = client.register_script(REDIS_EXTEND)
+        self._ack_script = client.register_script(REDIS_ACK)
+        self._release_script = client.register_script(REDIS_RELEASE)
+
+    def _k(self, *parts) -> list:
+        return [self.keys[part] for part in parts]
+
+    def put(self, jobs: list):
+        now = time.time()
+        pipe = self.client.pipeline()
+        for job in jobs:
+            pipe.hset(self.keys["jobs"], job["id"], json.dumps(job))
+            pipe.hdel(self.keys["attempts"], job["id"])
+            pipe.zadd(self.keys["pending"], {job["id"]: now})
+        pipe.execute()
+
+    def _claim(self, worker: str, visibility: float, receipt: str) -> Optional[Lease]:
+        claimed = self._claim_script(
+            keys=self._k("pending", "leased", "receipts", "attempts", "jobs", "errors"),
+            args=[time.time(), visibility, receipt]
+        )
+        if not claimed:
+            return None
+        job_id, payload, attempts, error = claimed
+        return Lease(_text(job_id), receipt, int(attempts), json.loads(payload), _text(error) or None)
+
+    def extend(self, lease: Lease, visibility: float = None) -> bool:
+        deadline = time.time() + (visibility or Config.BATCH_VISIBILITY_SECONDS)
+        return bool(self._extend_script(keys=self._k("leased", "receipts"),
+                                        args=[lease.job_id, lease.receipt, deadline]))
+
+    def ack(self, lease: Lease, result: dict) -> bool:
+        return bool(self._ack_script(keys=self._k("leased", "receipts", "results", "pending"),
+                                     args=[lease.job_id, lease.receipt, json.dumps(result)]))
+
+    def _release(self, lease: Lease, error: str, available_at: float):
+        self._release_script(keys=self._k("pending", "leased", "receipts", "errors"),
+                             args=[lease.job_id, lease.receipt, error, available_at])
+
+    def _bury(self, lease: Lease, error: str):
+        # Released with no next availability, then recorded as dead
+        if self._release_script(keys=self._k("pending", "leased", "receipts", "errors"),
+                                args=[lease.job_id, lease.receipt, error, ""]):
+            self.client.hset(self.keys["dead"], lease.job_id, error)
+
+    def results(self) -> Iterator[tuple]:
+        for job_id, result in sorted(self.client.hgetall(self.keys["results"]).items()):
+            yield _text(job_id), json.loads(result)
+
+    def dead(self) -> Iterator[tuple]:
+        for job_id, error in sorted(self.client.hgetall(self.keys["dead"]).items()):
+            payload = self.client.hget(self.keys["jobs"], job_id)
+            yield _text(job_id), json.loads(payload), _text(error)
+
+    def stats(self) -> dict:
+        pipe = self.client.pipeline()
+        pipe.zcard(self.keys["pending"])
+        pipe.zcard(self.keys["leased"])
+        pipe.hlen(self.keys["results"])
+        pipe.hlen(self.keys["dead"])
+        return dict(zip(("pending", "leased", "done", "dead"), pipe.execute()))
+
+    def set_meta(self, key: str, value: str):
+        self.client.hset(self.keys["meta"], key, value)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        value = self.client.hget(self.keys["meta"], key)
+        return _text(value)
+
+    def clear(self):
+        self.client.delete(*self.keys.values())
+
+    def close(self):
+        self.client.close()
+
+
+QUEUES = {
+    "sqlite": lambda url: SQLiteWorkQueue(url[len("sqlite:///"):]),
+    "file": lambda url: FileWorkQueue(url[len("file://"):]),
+    "redis": lambda url: RedisWorkQueue(url),
+    "rediss": lambda url: RedisWorkQueue(url),
+}
+
+
+def create_queue(url: str = None) -> WorkQueue:
+    """Work queue for a URL: sqlite:///path.db, file:///shared/dir or redis://host:6379/0"""
+    url = url or Config.WORK_QUEUE_URL
+    scheme = url.split(":", 1)[0].lower()
+    if scheme not in QUEUES:
+        raise ValueError(f"Unknown work queue '{url}'. Schemes: {', '.join(QUEUES)}")
+    return QUEUES[scheme](url)
@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 import tempfile
 
@@ -6,19 +7,53 @@ load_dotenv()
 
 
 class Config:
-    # Hugging Face - Try Streamlit secrets first, then .env
-    try:
-        import streamlit as st
-        HF_TOKEN = st.secrets.get("HF_TOKEN", os.getenv("HF_TOKEN", ""))
-    except:
-        HF_TOKEN = os.getenv("HF_TOKEN", "")
+    # Hugging Face - Try Streamlit secrets first (only when running under Streamlit), then .env
+    HF_TOKEN = os.getenv("HF_TOKEN", "")
+    if "streamlit" in sys.modules:
+        try:
+            HF_TOKEN = sys.modules["streamlit"].secrets.get("HF_TOKEN", HF_TOKEN)
+        except:
+            pass
 
     HF_MODEL = "meta-llama/Llama-3.2-3B-Instruct"
 
+    # LLM backend - "huggingface" (remote), "llamacpp" (local GGUF) or "openai_local"
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "huggingface")
+    LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", os.path.join("models", "llama-3.2-3b-instruct.Q4_K_M.gguf"))
+    LOCAL_MODEL_THREADS = int(os.getenv("LOCAL_MODEL_THREADS", os.cpu_count() or 4))
+    LOCAL_MODEL_CONTEXT = int(os.getenv("LOCAL_MODEL_CONTEXT", 4096))
+    LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8080/v1")
+    LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+    # Record/replay - "record" saves every response, "replay" serves them offline only,
+    # "auto" replays when recorded and records otherwise ("off" calls the backend directly)
+    LLM_RECORD_MODE = os.getenv("LLM_RECORD_MODE", "off")
+    LLM_RECORDINGS_FILE = os.getenv("LLM_RECORDINGS_FILE", os.path.join("data", "llm_recordings", "responses.jsonl"))
+
     # Paths - use temp directory for cloud deployment
     DATA_DIR = "data"
     INVOICES_DIR = os.path.join(DATA_DIR, "invoices")
     PO_FILE = os.path.join(DATA_DIR, "purchase_orders", "purchase_orders.json")
+    INVOICE_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.txt')
+
+    # Watch-folder daemon (python src/main.py --watch)
+    INBOX_DIR = os.getenv("INBOX_DIR", os.path.join(DATA_DIR, "inbox"))
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive"))
+    WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", 2.0))
+    WATCH_WORKERS = int(os.getenv("WATCH_WORKERS", 4))
+
+    # Sharded batch runs (python src/main.py --coordinator / --worker) - the work queue is
+    # sqlite:///path.db (one node), file:///dir (shared filesystem) or redis://host:6379/0
+    WORK_QUEUE_URL = os.getenv("WORK_QUEUE_URL", "sqlite:///" + os.path.join(DATA_DIR, "work_queue", "queue.db"))
+    WORK_QUEUE_NAME = os.getenv("WORK_QUEUE_NAME", "invoice_recon")  # Redis key prefix
+    BATCH_SHARD_SIZE = int(os.getenv("BATCH_SHARD_SIZE", 4))  # invoices per queued job
+    BATCH_VISIBILITY_SECONDS = float(os.getenv("BATCH_VISIBILITY_SECONDS", 300))  # lease, renewed per invoice
+    BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", 3))  # then the shard is dead-lettered
+    BATCH_RETRY_DELAY_SECONDS = float(os.getenv("BATCH_RETRY_DELAY_SECONDS", 5))  # doubled per attempt
+    BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", 1.0))
+    # "json" loads PO_FILE into memory; "sqlite" queries PO_SQLITE_FILE (see matching/po_repository.py)
+    PO_BACKEND = os.getenv("PO_BACKEND", "json")
+    PO_SQLITE_FILE = os.getenv("PO_SQLITE_FILE", os.path.join(DATA_DIR, "purchase_orders", "purchase_orders.db"))
 
     # Output directory - use temp for cloud, local for CLI
     if os.getenv("STREAMLIT_RUNTIME_ENV") or os.getenv("HOME") == "/home/appuser":
@@ -28,19 +63,99 @@ class Config:
         # Running locally
         OUTPUT_DIR = "src/outputs"
 
+    # Output JSON - compact (no indentation) and orjson-encoded when installed
+    OUTPUT_COMPACT = os.getenv("OUTPUT_COMPACT", "0") == "1"
+
+    # Analytics export - partitioned Parquet datasets (needs pyarrow); empty disables
+    PARQUET_EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", "")
+    PARQUET_BATCH_SIZE = int(os.getenv("PARQUET_BATCH_SIZE", 500))  # invoices per written file
+
+    # Metrics - Prometheus text format on http://127.0.0.1:METRICS_PORT/metrics (0 disables)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+    METRICS_DUMP_FILE = os.getenv("METRICS_DUMP_FILE", "")  # written at the end of a batch run
+
+    # Logging - JSON lines on stderr, written by a background thread (LOG_FORMAT=text for humans)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))  # share of per-stage progress records kept
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, never waited on
+
+    # Streamlit app - invoices from one upload processed concurrently
+    APP_WORKERS = int(os.getenv("APP_WORKERS", 4))
+
+    # Prompt compaction / generation budget
+    PROMPT_MAX_INPUT_TOKENS = 1500
+    LLM_BASE_OUTPUT_TOKENS = 350
+    LLM_TOKENS_PER_LINE_ITEM = 90
+    LLM_MAX_OUTPUT_TOKENS = 2000
+
     # Confidence thresholds
     HIGH_CONFIDENCE = 0.90
     MEDIUM_CONFIDENCE = 0.70
     LOW_CONFIDENCE = 0.50
 
+    # Tiered extraction: deterministic template parser, then small LLM, then large LLM.
+    # A tier's result is accepted once it validates with at least TIER_ACCEPT_CONFIDENCE.
+    EXTRACTION_TIERS = ["template", "small_llm", "large_llm"]
+    # Escalation model for the configured LLM_BACKEND (a GGUF path for llamacpp, a served model
+    # name for openai_local); only huggingface has a default, elsewhere the tier is skipped if unset
+    LLM_LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "")
+    LLM_LARGE_MODEL_DEFAULTS = {"huggingface": "meta-llama/Llama-3.1-8B-Instruct"}
+    TIER_ACCEPT_CONFIDENCE = HIGH_CONFIDENCE
+
+    # Arithmetic validation tolerance - sums (lines, subtotal + VAT = total) allow rounding only;
+    # products of a rounded unit price or VAT rate may also differ by the relative tolerance
+    ARITHMETIC_ABS_TOLERANCE = 0.02  # rounding, in currency units
+    ARITHMETIC_REL_TOLERANCE = 0.001
+
     # Matching thresholds
     PRICE_TOLERANCE = 0.02  # 2%
     SIGNIFICANT_PRICE_VARIANCE = 0.15  # 15%
-    TOTAL_VARIANCE_AMOUNT = 5.0  # £5
+    TOTAL_VARIANCE_AMOUNT = 5.0  # in BASE_CURRENCY
     TOTAL_VARIANCE_PERCENT = 0.01  # 1%
 
+    # Line-item alignment - invoice lines whose codes differ from the PO's are paired by
+    # weighted similarity (see matching/line_alignment.py); weaker pairs stay unmatched
+    LINE_ALIGN_WEIGHTS = {"code": 0.4, "description": 0.4, "quantity": 0.1, "price": 0.1}
+    LINE_ALIGN_MIN_SCORE = 0.5
+
+    # Currency / unit normalisation - amounts are compared in BASE_CURRENCY and base units
+    FX_RATES_FILE = os.getenv("FX_RATES_FILE", os.path.join(DATA_DIR, "reference", "fx_rates.json"))
+    BASE_CURRENCY = os.getenv("BASE_CURRENCY", "GBP")
+
+    # Price history - per (supplier, item) streaming statistics; set PRICE_HISTORY_FILE to persist
+    PRICE_HISTORY_FILE = os.getenv("PRICE_HISTORY_FILE", "")
+    PRICE_HISTORY_ALPHA = 0.1  # weight of the newest price (~ last 10 invoices)
+    PRICE_HISTORY_MIN_SAMPLES = 5
+    PRICE_ANOMALY_Z = 3.0
+
+    # Resolution policy - declarative rules, compiled once per process (JSON, or YAML with PyYAML)
+    RESOLUTION_RULES_FILE = os.getenv("RESOLUTION_RULES_FILE", os.path.join(DATA_DIR, "reference", "resolution_rules.json"))
+
+    # Duplicate detection - set FINGERPRINT_INDEX_FILE to persist fingerprints across runs
+    FINGERPRINT_INDEX_FILE = os.getenv("FINGERPRINT_INDEX_FILE", "")
+    DUPLICATE_SIMHASH_DISTANCE = 7  # max differing bits (of 64) for a near-duplicate
+
     # OCR settings
     TESSERACT_CONFIG = '--oem 3 --psm 6'
+    # Region-of-interest OCR (off until benchmarks/ocr_preprocessing.py shows no accuracy loss)
+    OCR_REGION_MODE = os.getenv("OCR_REGION_MODE", "0") == "1"
+    OCR_TARGET_DPI = 250
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", 4))
+    OCR_REGION_PSM = {"header": 4, "table": 6, "text": 4}
+    # Page quality from Tesseract per-word confidences (0-100)
+    OCR_EXCELLENT_CONFIDENCE = 90
+    OCR_ACCEPTABLE_CONFIDENCE = 70
+    OCR_LOW_WORD_CONFIDENCE = 60  # a word below this counts as doubtful
+    # Regions whose mean word confidence is below this are OCRed once more, upscaled, with another PSM
+    OCR_RETRY_CONFIDENCE = 70
+    OCR_RETRY_SCALE = 2.0
+    OCR_RETRY_PSM = {"header": 6, "table": 4, "text": 6}
+    # "auto" uses a pool of persistent tesserocr instances when installed, else pytesseract
+    OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+    OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", OCR_WORKERS))
+    # "thread" (default) or "process" - process workers read pages from shared memory
+    OCR_EXECUTOR = os.getenv("OCR_EXECUTOR", "thread")
 
     @staticmethod
     def ensure_directories():
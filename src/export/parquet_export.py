@@ -0,0 +1,226 @@
+"""Columnar export of reconciliation results for analytics (requires pyarrow).
+
+Writes four Hive-partitioned Parquet datasets under the export directory,
+partitioned by processing_month=YYYY-MM: invoices, line_items, discrepancies
+and trace_timings. Rows join on result_id.
+
+Backfill from existing JSON outputs (from the project root):
+    PYTHONPATH=src python -m export.parquet_export --out exports src/outputs/*.json
+"""
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from config import Config
+
+SCHEMA_VERSION = 1
+
+
+def _float(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _schemas(pa) -> dict:
+    common = [
+        ("schema_version", pa.int16()),
+        ("result_id", pa.string()),
+        ("invoice_id", pa.string()),
+        ("filename", pa.string()),
+        ("processing_month", pa.string()),
+    ]
+    tables = {
+        "invoices": common + [
+            ("processing_timestamp", pa.timestamp("us", tz="UTC")),
+            ("processing_duration_seconds", pa.float64()),
+            ("document_quality", pa.string()),
+            ("duplicate_of", pa.string()),
+            ("extraction_confidence", pa.float64()),
+            ("supplier_name", pa.string()),
+            ("invoice_date", pa.string()),
+            ("po_reference", pa.string()),
+            ("currency", pa.string()),
+            ("subtotal", pa.float64()),
+            ("vat_amount", pa.float64()),
+            ("total", pa.float64()),
+            ("matched_po", pa.string()),
+            ("match_method", pa.string()),
+            ("po_match_confidence", pa.float64()),
+            ("total_variance_amount", pa.float64()),
+            ("total_variance_percentage", pa.float64()),
+            ("recommended_action", pa.string()),
+            ("risk_level", pa.string()),
+            ("recommendation_confidence", pa.float64()),
+            ("line_item_count", pa.int32()),
+            ("discrepancy_count", pa.int32()),
+            ("error_count", pa.int32()),
+        ],
+        "line_items": common + [
+            ("line_no", pa.int32()),
+            ("item_code", pa.string()),
+            ("description", pa.string()),
+            ("quantity", pa.float64()),
+            ("unit", pa.string()),
+            ("unit_price", pa.float64()),
+            ("line_total", pa.float64()),
+        ],
+        "discrepancies": common + [
+            ("type", pa.string()),
+            ("severity", pa.string()),
+            ("field", pa.string()),
+            ("details", pa.string()),
+            ("invoice_value", pa.float64()),
+            ("po_value", pa.float64()),
+            ("variance_percentage", pa.float64()),
+            ("confidence", pa.float64()),
+        ],
+        "trace_timings": common + [
+            ("stage", pa.string()),
+            ("duration_ms", pa.int64()),
+            ("status", pa.string()),
+            ("confidence", pa.float64()),
+        ],
+    }
+    metadata = {b"schema_version": str(SCHEMA_VERSION).encode()}
+    return {name: pa.schema(fields, metadata=metadata) for name, fields in tables.items()}
+
+
+def flatten(result: dict) -> dict:
+    """Split one result into rows for each export table"""
+    processing = result.get("processing_results", {})
+    extracted = processing.get("extracted_data") or {}
+    matching = processing.get("matching_results") or {}
+    document = result.get("document_info", {})
+    timestamp = datetime.fromisoformat(result["processing_timestamp"].rstrip("Z")).replace(tzinfo=timezone.utc)
+    filename = document.get("filename", "")
+    key = {
+        "schema_version": SCHEMA_VERSION,
+        "result_id": f"{filename}@{result['processing_timestamp']}",
+        "invoice_id": result.get("invoice_id"),
+        "filename": filename,
+        "processing_month": timestamp.strftime("%Y-%m"),
+    }
+    duplicate = document.get("duplicate_of")
+    variance = processing.get("total_variance", {})
+
+    invoice = dict(key, **{
+        "processing_timestamp": timestamp,
+        "processing_duration_seconds": result.get("processing_duration_seconds"),
+        "document_quality": document.get("document_quality"),
+        "duplicate_of": duplicate["filename"] if duplicate else None,
+        "extraction_confidence": processing.get("extraction_confidence"),
+        "supplier_name": extracted.get("supplier_name"),
+        "invoice_date": extracted.get("invoice_date"),
+        "po_reference": extracted.get("po_reference"),
+        "currency": extracted.get("currency"),
+        "subtotal": _float(extracted.get("subtotal")),
+        "vat_amount": _float(extracted.get("vat_amount")),
+        "total": _float(extracted.get("total")),
+        "matched_po": matching.get("matched_po"),
+        "match_method": matching.get("match_method"),
+        "po_match_confidence": _float(matching.get("po_match_confidence")),
+        "total_variance_amount": _float(variance.get("amount")),
+        "total_variance_percentage": _float(variance.get("percentage")),
+        "recommended_action": processing.get("recommended_action"),
+        "risk_level": processing.get("risk_level"),
+        "recommendation_confidence": _float(processing.get("confidence")),
+        "line_item_count": len(extracted.get("line_items", [])),
+        "discrepancy_count": len(processing.get("discrepancies", [])),
+        "error_count": len(result.get("errors", [])),
+    })
+    line_items = [dict(key, **{
+        "line_no": idx,
+        "item_code": item.get("item_code"),
+        "description": item.get("description"),
+        "quantity": _float(item.get("quantity")),
+        "unit": item.get("unit"),
+        "unit_price": _float(item.get("unit_price")),
+        "line_total": _float(item.get("line_total")),
+    }) for idx, item in enumerate(extracted.get("line_items", []), 1)]
+    discrepancies = [dict(key, **{
+        "type": disc.get("type"),
+        "severity": disc.get("severity"),
+        "field": disc.get("field"),
+        "details": disc.get("details"),
+        "invoice_value": _float(disc.get("invoice_value")),
+        "po_value": _float(disc.get("po_value")),
+        "variance_percentage": _float(disc.get("variance_percentage")),
+        "confidence": _float(disc.get("confidence")),
+    }) for disc in processing.get("discrepancies", [])]
+    timings = [dict(key, **{
+        "stage": stage,
+        "duration_ms": entry.get("duration_ms"),
+        "status": entry.get("status"),
+        "confidence": _float(entry.get("confidence")),
+    }) for stage, entry in result.get("agent_execution_trace", {}).items() if "duration_ms" in entry]
+
+    return {"invoices": [invoice], "line_items": line_items, "discrepancies": discrepancies, "trace_timings": timings}
+
+
+class ParquetExporter:
+    """Buffers flattened results and writes them as one Parquet file per table and partition per batch"""
+
+    def __init__(self, export_dir: str = None, batch_size: int = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export requires pyarrow. Install it with: pip install pyarrow")
+        self.pa, self.pq = pa, pq
+        self.export_dir = export_dir or Config.PARQUET_EXPORT_DIR
+        self.batch_size = batch_size or Config.PARQUET_BATCH_SIZE
+        self.schemas = _schemas(pa)
+        self._rows = {name: [] for name in self.schemas}
+        self._pending = 0
+        self.files_written = 0
+
+    def add(self, result: dict):
+        for name, rows in flatten(result).items():
+            self._rows[name].extend(rows)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch_id = uuid.uuid4().hex[:12]
+        for name, rows in self._rows.items():
+            if not rows:
+                continue
+            table = self.pa.Table.from_pylist(rows, schema=self.schemas[name])
+            self.pq.write_to_dataset(
+                table,
+                root_path=os.path.join(self.export_dir, name),
+                partition_cols=["processing_month"],
+                basename_template=f"part-{batch_id}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+            self.files_written += 1
+            rows.clear()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export JSON reconciliation outputs to partitioned Parquet")
+    parser.add_argument("files", nargs="+", help="per-invoice output JSON files")
+    parser.add_argument("--out", default=Config.PARQUET_EXPORT_DIR or "exports")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    with ParquetExporter(args.out, args.batch_size) as exporter:
+        for path in args.files:
+            with open(path, "r") as f:
+                exporter.add(json.load(f))
+    print(f"Exported {len(args.files)} results to {args.out} (schema v{SCHEMA_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import re
+from config import Config
+
+AMOUNT_PATTERN = re.compile(r'[£$€]\s?\d[\d,]*(?:\.\d+)?|\b\d[\d,]*\.\d{2}\b')
+CODE_PATTERN = re.compile(r'\b[A-Z]{2,}(?=[A-Z0-9-]*\d)[A-Z0-9]*(?:-[A-Z0-9]+)*\b')
+DATE_PATTERN = re.compile(
+    r'\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b'
+    r'|\b\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?\s+\d{2,4}\b',
+    re.IGNORECASE
+)
+QUANTITY_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\s*(?:kg|g|mg|l|ml|units?|pcs|each|ea)?\b', re.IGNORECASE)
+HEADER_PATTERN = re.compile(
+    r'\b(?:invoice|inv|po|purchase order|order|ref|date|supplier|vat|subtotal|sub-total|net|'
+    r'total|amount due|balance|currency|payment terms|terms|qty|quantity|unit|price|code|description)\b',
+    re.IGNORECASE
+)
+NOISE_PATTERN = re.compile(
+    r'\b(?:bank|sort code|iban|swift|bic|account (?:no|number|name)|terms and conditions|t&cs?|'
+    r'thank you|page \d+ of \d+|www\.|https?://|registered in|company (?:no|number)|'
+    r'e-?mail|retention of title|late payment)\b',
+    re.IGNORECASE
+)
+TOTALS_PATTERN = re.compile(r'\b(?:sub-?total|total|net amount|amount due|balance due|vat)\b', re.IGNORECASE)
+SEPARATOR_PATTERN = re.compile(r'^[\s\-_=*.~|#]+$')
+
+
+class TextCompactor:
+    """Score OCR lines for invoice relevance and trim noise before prompting the LLM"""
+
+    def __init__(self, max_input_tokens: int = None, header_lines: int = 6):
+        self.max_input_tokens = max_input_tokens or Config.PROMPT_MAX_INPUT_TOKENS
+        self.header_lines = header_lines
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Cheap token estimate (~4 characters per token)"""
+        return (len(text) + 3) // 4
+
+    @staticmethod
+    def is_line_item(line: str) -> bool:
+        """Heuristic: an item code plus a quantity and a money amount"""
+        return bool(CODE_PATTERN.search(line)) and len(AMOUNT_PATTERN.findall(line)) >= 1 \
+            and len(QUANTITY_PATTERN.findall(line)) >= 2
+
+    def score_line(self, line: str, position: int) -> float:
+        """Relevance score for a single (normalised) line"""
+        score = 0.0
+        if self.is_line_item(line):
+            score += 3.0
+        if AMOUNT_PATTERN.search(line):
+            score += 1.5
+            if TOTALS_PATTERN.search(line):
+                score += 2.0
+        if CODE_PATTERN.search(line):
+            score += 1.0
+        if DATE_PATTERN.search(line):
+            score += 1.0
+        if HEADER_PATTERN.search(line):
+            score += 1.0
+        # Supplier name/address usually sit at the top without any keyword
+        if position < self.header_lines:
+            score += 1.0
+        # Bank details, T&Cs etc. are dropped unless they also carry invoice fields
+        if NOISE_PATTERN.search(line):
+            score -= 3.0
+        return score
+
+    def compact(self, raw_text: str) -> dict:
+        """Return compacted text plus statistics about the reduction"""
+        lines = []
+        previous = None
+        for raw_line in raw_text.splitlines():
+            line = re.sub(r'[ \t]+', ' ', raw_line).strip()
+            if not line or SEPARATOR_PATTERN.match(line) or line == previous:
+                continue
+            lines.append(line)
+            previous = line
+
+        scored = [(idx, line, self.score_line(line, idx)) for idx, line in enumerate(lines)]
+        kept = [(idx, line, score) for idx, line, score in scored if score >= 0]
+
+        # Drop lowest-value lines until the input fits the token budget
+        budget = self.max_input_tokens
+        total_tokens = sum(self.estimate_tokens(line) + 1 for _, line, _ in kept)
+        if total_tokens > budget:
+            for idx, line, score in sorted(kept, key=lambda x: (x[2], -x[0])):
+                if total_tokens <= budget:
+                    break
+                kept.remove((idx, line, score))
+                total_tokens -= self.estimate_tokens(line) + 1
+
+        compacted = "\n".join(line for _, line, _ in sorted(kept))
+        original_tokens = self.estimate_tokens(raw_text)
+        compacted_tokens = self.estimate_tokens(compacted)
+
+        return {
+            "text": compacted,
+            "line_item_count": sum(1 for _, line, _ in kept if self.is_line_item(line)),
+            "original_tokens": original_tokens,
+            "compacted_tokens": compacted_tokens,
+            "lines_dropped": len(scored) - len(kept),
+            "reduction_ratio": 1 - compacted_tokens / original_tokens if original_tokens else 0.0
+        }
+
+    @staticmethod
+    def output_token_budget(line_item_count: int) -> int:
+        """Scale max_new_tokens with the number of detected line items"""
+        budget = Config.LLM_BASE_OUTPUT_TOKENS + Config.LLM_TOKENS_PER_LINE_ITEM * max(line_item_count, 1)
+        return min(budget, Config.LLM_MAX_OUTPUT_TOKENS)
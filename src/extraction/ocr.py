@@ -1,18 +1,238 @@
-import PyPDF2
-import pytesseract
-from PIL import Image
-import cv2
-import numpy as np
+import logging
 import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import NamedTuple, Optional
+from config import Config
+from monitoring.metrics import OCR_SECONDS, OCR_REGION_RETRIES
 
+# PyPDF2, pytesseract, PIL, OpenCV and numpy are imported inside the code paths
+# that need them, so text-only batches never pay for loading them
+
+logger = logging.getLogger(__name__)
+
+
+class OCRResult(NamedTuple):
+    text: str
+    confidences: tuple  # Tesseract confidence (0-100) of every recognised word
+
+    def mean_confidence(self) -> Optional[float]:
+        return sum(self.confidences) / len(self.confidences) if self.confidences else None
+
+    @classmethod
+    def join(cls, results) -> "OCRResult":
+        """Page result from its regions, top to bottom"""
+        results = [r for r in results if r.text.strip()]
+        return cls("\n".join(r.text.strip() for r in results), tuple(c for r in results for c in r.confidences))
+
+
+def result_from_data(data: dict) -> OCRResult:
+    """Rebuild the text layout of pytesseract image_to_data output and keep the word confidences"""
+    lines, confidences = {}, []
+    for block, par, line, word, conf in zip(
+        data["block_num"], data["par_num"], data["line_num"], data["text"], data["conf"]
+    ):
+        word = str(word).strip()
+        if not word:
+            continue
+        lines.setdefault((block, par, line), []).append(word)
+        if float(conf) >= 0:
+            confidences.append(float(conf))
+
+    text, paragraph = [], None
+    for (block, par, _), words in lines.items():
+        # Blank line between paragraphs, as image_to_string lays them out
+        if paragraph is not None and paragraph != (block, par):
+            text.append("")
+        text.append(" ".join(words))
+        paragraph = (block, par)
+    return OCRResult("\n".join(text), tuple(confidences))
+
+
+def ocr_quality(result: OCRResult) -> str:
+    """excellent / acceptable / poor from the mean word confidence and the share of doubtful words"""
+    mean = result.mean_confidence()
+    if mean is None or len(result.text.strip()) <= 100:
+        return "poor"
+    doubtful = sum(1 for c in result.confidences if c < Config.OCR_LOW_WORD_CONFIDENCE) / len(result.confidences)
+    if mean >= Config.OCR_EXCELLENT_CONFIDENCE and doubtful <= 0.05:
+        return "excellent"
+    if mean >= Config.OCR_ACCEPTABLE_CONFIDENCE:
+        return "acceptable"
+    return "poor"
+
+
+class OCREngine:
+    """Base OCR engine; records per-call latency for every recognition"""
+
+    name = "base"
 
-class DocumentExtractor:
     def __init__(self):
-        self.tesseract_config = '--oem 3 --psm 6'
+        self.latencies_ms = deque(maxlen=1000)
+
+    def recognize(self, image, psm: int = 6) -> OCRResult:
+        """Text and per-word confidences from a single recognition pass"""
+        start = time.perf_counter()
+        try:
+            return self._recognize(image, psm)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.latencies_ms.append(elapsed * 1000)
+            OCR_SECONDS.observe(elapsed, self.name)
+
+    def image_to_string(self, image, psm: int = 6) -> str:
+        return self.recognize(image, psm).text
+
+    def _recognize(self, image, psm: int) -> OCRResult:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Latency summary over the most recent calls"""
+        # Snapshot first: pool threads keep appending while we sort
+        samples = sorted(list(self.latencies_ms))
+        if not samples:
+            return {"engine": self.name, "calls": 0, "mean_ms": 0.0, "p95_ms": 0.0}
+        return {
+            "engine": self.name,
+            "calls": len(samples),
+            "mean_ms": sum(samples) / len(samples),
+            "p95_ms": samples[int(0.95 * (len(samples) - 1))]
+        }
+
+    def close(self):
+        pass
+
+
+class SubprocessTesseractEngine(OCREngine):
+    """pytesseract: one tesseract process (and language-data load) per call"""
+
+    name = "pytesseract"
+
+    def _recognize(self, image, psm: int) -> OCRResult:
+        import pytesseract
+
+        data = pytesseract.image_to_data(image, config=f'--oem 3 --psm {psm}', output_type=pytesseract.Output.DICT)
+        return result_from_data(data)
+
+
+class TesseractAPIPool(OCREngine):
+    """Pool of long-lived in-process Tesseract instances (tesserocr C API bindings)"""
+
+    name = "tesserocr"
+
+    def __init__(self, size: int = None, lang: str = "eng"):
+        super().__init__()
+        from tesserocr import PyTessBaseAPI, OEM
+
+        self.size = size or Config.OCR_POOL_SIZE
+        self._apis = queue.Queue()
+        try:
+            for _ in range(self.size):
+                # Language data is loaded once here, not per image
+                self._apis.put(PyTessBaseAPI(lang=lang, oem=OEM.DEFAULT))
+        except Exception:
+            # e.g. RuntimeError when tessdata is missing; free the instances already built
+            self.close()
+            raise
+
+    def _recognize(self, image, psm: int) -> OCRResult:
+        from PIL import Image
+
+        api = self._apis.get()
+        try:
+            api.SetPageSegMode(psm)
+            # Hand the decoded array over in memory; no temp file or fork
+            api.SetImage(Image.fromarray(image))
+            text = api.GetUTF8Text()
+            # Confidences of the recognition GetUTF8Text just ran; no second pass
+            return OCRResult(text, tuple(float(c) for c in api.AllWordConfidences()))
+        finally:
+            api.Clear()
+            self._apis.put(api)
+
+    def close(self):
+        while not self._apis.empty():
+            self._apis.get_nowait().End()
+
+
+def create_ocr_engine(name: str = None) -> OCREngine:
+    """Build the engine selected by Config.OCR_ENGINE ("auto" prefers the API pool)"""
+    name = (name or Config.OCR_ENGINE).lower()
+    if name in ("auto", TesseractAPIPool.name):
+        try:
+            return TesseractAPIPool()
+        except ImportError:
+            if name != "auto":
+                raise
+        except Exception as e:
+            # Installed but unusable (missing or misconfigured tessdata)
+            if name != "auto":
+                raise
+            logger.warning("tesserocr unavailable, falling back to pytesseract: %s", e)
+    return SubprocessTesseractEngine()
+
+
+# One engine per OCR worker process, created on its first task and reused afterwards
+_worker_engine = None
+
+
+def _ocr_shared_region(handle, top: int, bottom: int, psm: int) -> OCRResult:
+    """Process-pool task: OCR a slice of a page that lives in shared memory"""
+    from extraction.shared_images import attach_shared_image
+
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = create_ocr_engine()
+    with attach_shared_image(handle) as page:
+        return _worker_engine.recognize(page[top:bottom], psm=psm)
+
+
+class DocumentExtractor:
+    def __init__(self, engine: OCREngine = None):
+        self._engine = engine
+        self._preprocessor = None
+        # Tesseract runs outside the GIL (own process or C API), so threads parallelise fine
+        self.ocr_pool = ThreadPoolExecutor(max_workers=Config.OCR_WORKERS)
+        # Process mode: pages are handed to workers through shared memory, not pickled
+        self._process_pool = None
+        self._image_store = None
+
+    @property
+    def engine(self) -> OCREngine:
+        """OCR engine, created on first image"""
+        if self._engine is None:
+            self._engine = create_ocr_engine()
+        return self._engine
+
+    def ocr_stats(self) -> dict:
+        """Latency summary of the OCR engine, or None if no image was processed"""
+        return self._engine.stats() if self._engine is not None else None
+
+    @property
+    def preprocessor(self):
+        if self._preprocessor is None:
+            from extraction.preprocessing import ImagePreprocessor
+
+            self._preprocessor = ImagePreprocessor()
+        return self._preprocessor
+
+    def close(self):
+        """Shut down OCR pools and free any shared-memory pages still held"""
+        self.ocr_pool.shutdown(wait=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
+        if self._image_store is not None:
+            self._image_store.close()
+        if self._engine is not None:
+            self._engine.close()
 
     def extract_text_from_pdf(self, pdf_path: str) -> tuple[str, str]:
         """Extract text from PDF, return (text, quality)"""
         try:
+            import PyPDF2
+
             text = ""
             with open(pdf_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
@@ -25,41 +245,121 @@ class DocumentExtractor:
             else:
                 return text, "poor"
         except Exception as e:
-            print(f"PDF extraction error: {e}")
+            logger.error("PDF extraction error: %s", e)
             return "", "poor"
 
     def extract_text_from_image(self, image_path: str) -> tuple[str, str]:
         """Extract text from image using OCR"""
         try:
+            import cv2
+
             # Load and preprocess image
             image = cv2.imread(image_path)
 
             # Rotate if needed
             image = self.deskew_image(image)
 
-            # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            # Apply thresholding
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
             # OCR
-            text = pytesseract.image_to_string(thresh, config=self.tesseract_config)
-
-            # Determine quality
-            if len(text.strip()) > 100:
-                quality = "acceptable"
+            if Config.OCR_REGION_MODE:
+                result = self.ocr_regions(image)
             else:
-                quality = "poor"
+                result = self.ocr_full_page(image)
 
-            return text, quality
+            # Determine quality from Tesseract's own word confidences
+            quality = ocr_quality(result)
+            mean = result.mean_confidence()
+            logger.info("OCR page quality: %s", quality, extra={
+                "mean_word_confidence": round(mean, 1) if mean is not None else None,
+                "words": len(result.confidences), "sample": True
+            })
+            return result.text, quality
         except Exception as e:
-            print(f"Image OCR error: {e}")
+            logger.error("Image OCR error: %s", e)
             return "", "poor"
 
+    def ocr_full_page(self, image) -> OCRResult:
+        """Threshold the whole page and OCR it in a single pass"""
+        import cv2
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return self.engine.recognize(thresh, psm=6)
+
+    def ocr_regions(self, image) -> OCRResult:
+        """Normalise DPI, crop blank space and OCR detected regions in parallel.
+
+        Regions whose words come back with low confidence get one more pass;
+        the rest of the page is not OCRed again.
+        """
+        page, regions = self.preprocessor.prepare(image)
+        if not regions:
+            return self.engine.recognize(page, psm=6)
+
+        if Config.OCR_EXECUTOR == "process":
+            results = self._ocr_regions_in_processes(page, regions)
+        else:
+            def ocr_region(region):
+                psm = Config.OCR_REGION_PSM.get(region["kind"], 6)
+                return self.engine.recognize(region["image"], psm=psm)
+
+            results = list(self.ocr_pool.map(ocr_region, regions))
+
+        retry = [
+            idx for idx, result in enumerate(results)
+            if result.confidences and result.mean_confidence() < Config.OCR_RETRY_CONFIDENCE
+        ]
+        if retry:
+            retried = self.ocr_pool.map(
+                self._retry_region, [regions[idx] for idx in retry], [results[idx] for idx in retry]
+            )
+            for idx, result in zip(retry, retried):
+                results[idx] = result
+        return OCRResult.join(results)
+
+    def _retry_region(self, region: dict, first: OCRResult) -> OCRResult:
+        """Re-OCR one low-confidence region upscaled and with its alternative PSM; keep the better read"""
+        import cv2
+
+        scale = Config.OCR_RETRY_SCALE
+        image = cv2.resize(region["image"], None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        retried = self.engine.recognize(image, psm=Config.OCR_RETRY_PSM.get(region["kind"], 6))
+        # A retry that drops words can look confident simply by reading less
+        improved = (
+            retried.confidences
+            and len(retried.confidences) >= 0.8 * len(first.confidences)
+            and retried.mean_confidence() > first.mean_confidence()
+        )
+        OCR_REGION_RETRIES.inc("improved" if improved else "kept")
+        return retried if improved else first
+
+    def _ocr_regions_in_processes(self, page, regions) -> list:
+        """Put the page in shared memory once; workers slice their region from it"""
+        from extraction.shared_images import SharedImageStore
+
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=Config.OCR_WORKERS)
+            self._image_store = SharedImageStore()
+
+        handle = self._image_store.put(page)
+        try:
+            futures = [
+                self._process_pool.submit(
+                    _ocr_shared_region, handle, region["top"], region["bottom"],
+                    Config.OCR_REGION_PSM.get(region["kind"], 6)
+                )
+                for region in regions
+            ]
+            return [future.result() for future in futures]
+        finally:
+            # Every future has completed (or failed) here, so the block can go
+            self._image_store.release(handle)
+
     def deskew_image(self, image):
         """Deskew image if rotated"""
         try:
+            import cv2
+            import numpy as np
+
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             gray = cv2.bitwise_not(gray)
             coords = np.column_stack(np.where(gray > 0))
@@ -98,7 +398,7 @@ class DocumentExtractor:
                     text = f.read()
                 return text, "excellent"
             except Exception as e:
-                print(f"Text file error: {e}")
+                logger.error("Text file error: %s", e)
                 return "", "poor"
         else:
             return "", "poor"
@@ -0,0 +1,126 @@
+import cv2
+import numpy as np
+from config import Config
+
+A4_WIDTH_INCHES = 8.27
+
+
+class ImagePreprocessor:
+    """Normalise resolution, crop blank margins and split a page into OCR regions"""
+
+    def __init__(self, target_dpi: int = None, margin_padding: int = 12):
+        self.target_dpi = target_dpi or Config.OCR_TARGET_DPI
+        self.margin_padding = margin_padding
+
+    def normalize_dpi(self, image, source_dpi: float = None):
+        """Rescale so the page is roughly target_dpi (DPI estimated from A4 width if unknown)"""
+        h, w = image.shape[:2]
+        source_dpi = source_dpi or w / A4_WIDTH_INCHES
+        scale = self.target_dpi / source_dpi
+
+        # Small differences aren't worth a resample
+        if 0.9 <= scale <= 1.1:
+            return image
+
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=interpolation)
+
+    def binarize(self, image):
+        """Grayscale + Otsu threshold (black text on white)"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+
+    def crop_margins(self, thresh):
+        """Crop to the bounding box of ink, keeping a small padding"""
+        ink = thresh < 128
+        rows = np.flatnonzero(ink.any(axis=1))
+        cols = np.flatnonzero(ink.any(axis=0))
+        if rows.size == 0 or cols.size == 0:
+            return thresh
+
+        pad = self.margin_padding
+        top, bottom = max(rows[0] - pad, 0), min(rows[-1] + pad + 1, thresh.shape[0])
+        left, right = max(cols[0] - pad, 0), min(cols[-1] + pad + 1, thresh.shape[1])
+        return thresh[top:bottom, left:right]
+
+    def _text_bands(self, ink) -> list:
+        """Horizontal bands of consecutive rows containing ink: [(start, end), ...]"""
+        row_has_ink = ink.sum(axis=1) > max(2, ink.shape[1] // 500)
+        bands = []
+        start = None
+        for y, has_ink in enumerate(row_has_ink):
+            if has_ink and start is None:
+                start = y
+            elif not has_ink and start is not None:
+                bands.append((start, y))
+                start = None
+        if start is not None:
+            bands.append((start, len(row_has_ink)))
+        return bands
+
+    def _ruling_lines(self, ink) -> list:
+        """Y positions of long horizontal rules (table borders)"""
+        width = ink.shape[1]
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 3, 1), 1))
+        lines = cv2.morphologyEx(ink.astype(np.uint8) * 255, cv2.MORPH_OPEN, kernel)
+        return list(np.flatnonzero(lines.any(axis=1)))
+
+    @staticmethod
+    def _column_gaps(ink_block) -> int:
+        """Number of wide vertical whitespace gaps (multi-column rows suggest a table)"""
+        col_has_ink = ink_block.any(axis=0)
+        min_gap = max(ink_block.shape[1] // 40, 8)
+        gaps = 0
+        run = 0
+        seen_ink = False
+        for has_ink in col_has_ink:
+            if has_ink:
+                if seen_ink and run >= min_gap:
+                    gaps += 1
+                run = 0
+                seen_ink = True
+            else:
+                run += 1
+        return gaps
+
+    def detect_regions(self, thresh) -> list:
+        """Split the cropped page into header/table/text regions, top to bottom"""
+        ink = thresh < 128
+        bands = self._text_bands(ink)
+        if not bands:
+            return []
+
+        # Group lines into blocks separated by gaps noticeably larger than line spacing
+        gaps = [bands[i + 1][0] - bands[i][1] for i in range(len(bands) - 1)]
+        block_gap = 2 * float(np.median(gaps)) if gaps else 0
+        blocks = [[bands[0]]]
+        for gap, band in zip(gaps, bands[1:]):
+            if gap > block_gap:
+                blocks.append([band])
+            else:
+                blocks[-1].append(band)
+
+        rules = self._ruling_lines(ink)
+        pad = self.margin_padding // 2
+        regions = []
+        for idx, block in enumerate(blocks):
+            top, bottom = max(block[0][0] - pad, 0), min(block[-1][1] + pad, thresh.shape[0])
+            crossed_by_rule = any(top <= y <= bottom for y in rules)
+            multi_column = len(block) >= 2 and self._column_gaps(ink[top:bottom]) >= 3
+
+            if crossed_by_rule or multi_column:
+                kind = "table"
+            elif idx == 0:
+                kind = "header"
+            else:
+                kind = "text"
+            regions.append({"kind": kind, "top": top, "bottom": bottom, "image": thresh[top:bottom]})
+
+        return regions
+
+    def prepare(self, image, source_dpi: float = None) -> tuple:
+        """Full pipeline: returns (cropped binary page, regions)"""
+        image = self.normalize_dpi(image, source_dpi)
+        thresh = self.crop_margins(self.binarize(image))
+        return thresh, self.detect_regions(thresh)
@@ -0,0 +1,73 @@
+import atexit
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import NamedTuple, Tuple
+import numpy as np
+
+
+class SharedImageHandle(NamedTuple):
+    """Picklable reference to a decoded image living in shared memory"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedImageStore:
+    """Owns shared-memory blocks for decoded pages and guarantees they are unlinked"""
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+        # Safety net: never leave /dev/shm segments behind on interpreter exit
+        atexit.register(self.close)
+
+    def put(self, image) -> SharedImageHandle:
+        """Copy an array into a new shared block (the only copy made)"""
+        image = np.ascontiguousarray(image)
+        block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+        with self._lock:
+            self._blocks[block.name] = block
+        return SharedImageHandle(block.name, tuple(image.shape), image.dtype.str)
+
+    def release(self, handle: SharedImageHandle):
+        """Free a block once every worker reading it has finished"""
+        with self._lock:
+            block = self._blocks.pop(handle.name, None)
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    def close(self):
+        with self._lock:
+            handles = list(self._blocks)
+        for name in handles:
+            self.release(SharedImageHandle(name, (), ""))
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def attach_shared_image(handle: SharedImageHandle):
+    """Worker side: map the block and yield a read-only array view (valid inside the block only)"""
+    try:
+        block = shared_memory.SharedMemory(name=handle.name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track flag; the owning process still unlinks the block
+        block = shared_memory.SharedMemory(name=handle.name)
+    view = None
+    try:
+        view = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+        view.flags.writeable = False
+        yield view
+    finally:
+        del view
+        block.close()
@@ -0,0 +1,135 @@
+import re
+from datetime import datetime
+from typing import Optional
+from extraction.compaction import CODE_PATTERN
+
+MONEY = r'[£$€]?\s?(\d[\d,]*\.\d{2})'
+
+INVOICE_NUMBER_PATTERN = re.compile(
+    r'^\s*(?:Invoice\s*(?:Number|No\.?|#)|Inv\.?\s*No\.?|No\.?)\s*[:#]\s*([A-Z0-9][A-Z0-9/-]*)',
+    re.IGNORECASE | re.MULTILINE
+)
+DATE_PATTERN = re.compile(r'^\s*(?:Invoice\s+|Tax\s+Point\s+)?Date\s*:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+PO_PATTERN = re.compile(
+    r'(?:PO(?:\s*(?:Reference|Ref\.?|Number|No\.?))?|Purchase\s+Order|(?:Customer\s+|Order\s+)?Ref\.?)\s*[:#]\s*([A-Z0-9][A-Z0-9/-]*)',
+    re.IGNORECASE
+)
+SUBTOTAL_PATTERN = re.compile(r'(?:Sub-?total|Net\s+Amount|Net\s+Total)\s*:?\s*' + MONEY, re.IGNORECASE)
+VAT_PATTERN = re.compile(
+    r'VAT\s*(?:\(\s*(\d+(?:\.\d+)?)\s*%\s*\)|@\s*(\d+(?:\.\d+)?)\s*%)?\s*:?\s*' + MONEY, re.IGNORECASE
+)
+TOTAL_PATTERN = re.compile(
+    r'(?:Total\s+Due|Amount\s+Due|Grand\s+Total|Invoice\s+Total|^\s*Total)\s*:?\s*' + MONEY,
+    re.IGNORECASE | re.MULTILINE
+)
+LINE_ITEM_PATTERN = re.compile(
+    r'^(?P<text>.+?)\s+(?P<qty>\d+(?:\.\d+)?)\s*(?P<unit>kg|g|mg|l|ml|units?|pcs|ea|each)\s+'
+    + r'[£$€]?\s?(?P<price>\d[\d,]*\.\d{2})(?:\s*/\s*\w+)?\s+[£$€]?\s?(?P<total>\d[\d,]*\.\d{2})\s*$',
+    re.IGNORECASE
+)
+DATE_FORMATS = ["%d %B %Y", "%d %b %Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%B %d, %Y", "%d/%m/%y"]
+CURRENCY_SYMBOLS = {"£": "GBP", "€": "EUR", "$": "USD"}
+
+
+def _amount(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+class TemplateParser:
+    """Deterministic regex parser for common invoice layouts (no LLM involved)"""
+
+    def parse(self, text: str) -> dict:
+        vat_amount, vat_rate = self._vat(text)
+        return {
+            "invoice_number": self._invoice_number(text),
+            "invoice_date": self._invoice_date(text),
+            "supplier_name": self._supplier_name(text),
+            "po_reference": self._po_reference(text),
+            "currency": self._currency(text),
+            "line_items": self._line_items(text),
+            "subtotal": self._first_amount(SUBTOTAL_PATTERN, text),
+            "vat_amount": vat_amount,
+            "vat_rate": vat_rate,
+            "total": self._first_amount(TOTAL_PATTERN, text)
+        }
+
+    @staticmethod
+    def _invoice_number(text: str) -> str:
+        for match in INVOICE_NUMBER_PATTERN.finditer(text):
+            if re.search(r'\d', match.group(1)):
+                return match.group(1)
+        return ""
+
+    @staticmethod
+    def _invoice_date(text: str) -> str:
+        match = DATE_PATTERN.search(text)
+        if not match:
+            return ""
+        raw = match.group(1)
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(raw, fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+        return raw
+
+    @staticmethod
+    def _supplier_name(text: str) -> str:
+        """Suppliers print their name first; skip document-title lines"""
+        for line in text.splitlines():
+            line = line.strip()
+            if line and not re.search(r'\b(?:invoice|tax invoice|page)\b', line, re.IGNORECASE):
+                return line
+        return ""
+
+    @staticmethod
+    def _po_reference(text: str) -> Optional[str]:
+        for match in PO_PATTERN.finditer(text):
+            value = match.group(1)
+            # "Customer Ref: N/A" and similar are not PO references
+            if re.search(r'\d', value):
+                return value.upper()
+        return None
+
+    @staticmethod
+    def _currency(text: str) -> str:
+        for symbol, code in CURRENCY_SYMBOLS.items():
+            if symbol in text:
+                return code
+        match = re.search(r'\b(GBP|EUR|USD)\b', text)
+        return match.group(1) if match else "GBP"
+
+    @staticmethod
+    def _first_amount(pattern, text: str) -> float:
+        match = pattern.search(text)
+        return _amount(match.group(match.lastindex)) if match else 0.0
+
+    @staticmethod
+    def _vat(text: str) -> tuple:
+        """(vat_amount, vat_rate); rate defaults to UK standard 20% when not printed"""
+        match = VAT_PATTERN.search(text)
+        if not match:
+            return 0.0, 0.20
+        rate = match.group(1) or match.group(2)
+        return _amount(match.group(3)), float(rate) / 100 if rate else 0.20
+
+    @staticmethod
+    def _line_items(text: str) -> list:
+        items = []
+        for line in text.splitlines():
+            match = LINE_ITEM_PATTERN.match(line.strip())
+            if not match:
+                continue
+            code_match = CODE_PATTERN.search(match.group("text"))
+            if not code_match:
+                continue
+            description = (match.group("text")[:code_match.start()] + match.group("text")[code_match.end():]).strip()
+            items.append({
+                "item_code": code_match.group(),
+                "description": re.sub(r'\s+', ' ', description),
+                "quantity": float(match.group("qty")),
+                "unit": match.group("unit"),
+                "unit_price": _amount(match.group("price")),
+                "line_total": _amount(match.group("total"))
+            })
+        return items
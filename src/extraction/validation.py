@@ -0,0 +1,134 @@
+import copy
+from config import Config
+
+
+def _close(a: float, b: float) -> bool:
+    """Equal within rounding (a few pence): for sums of printed amounts, where any larger gap is a misread"""
+    return abs(a - b) <= Config.ARITHMETIC_ABS_TOLERANCE
+
+
+def _close_product(a: float, b: float) -> bool:
+    """Equal within rounding or relative tolerance: for products of a rounded rate or unit price"""
+    return abs(a - b) <= max(Config.ARITHMETIC_ABS_TOLERANCE, Config.ARITHMETIC_REL_TOLERANCE * max(abs(a), abs(b)))
+
+
+class InvoiceValidator:
+    """Arithmetic consistency checks with deterministic single-field repair.
+
+    Constraints: quantity x unit_price = line_total per line, sum(lines) = subtotal,
+    subtotal x vat_rate = vat_amount, subtotal + vat_amount = total. Without a
+    subtotal, the line totals (plus VAT) must still add up to the total.
+    """
+
+    REQUIRED_FIELDS = ("invoice_number", "supplier_name", "total", "line_items")
+
+    def validate(self, invoice: dict) -> dict:
+        invoice = copy.deepcopy(invoice)
+        repairs = []
+
+        self._repair_lines(invoice, repairs)
+        self._repair_totals(invoice, repairs)
+        checks, issues = self._run_checks(invoice)
+
+        missing = [field for field in self.REQUIRED_FIELDS if not invoice.get(field)]
+        passed = sum(checks.values())
+        score = passed / len(checks) if checks else 0.0
+        valid = not issues and not missing
+
+        return {
+            "invoice": invoice,
+            "valid": valid,
+            "score": score,
+            "checks": checks,
+            "issues": issues,
+            "missing_fields": missing,
+            "repairs": repairs,
+            # Arithmetic holds after repair: another LLM pass cannot improve the numbers
+            "needs_reextraction": not valid
+        }
+
+    def _repair_lines(self, invoice: dict, repairs: list):
+        items = invoice.get("line_items", [])
+        subtotal = invoice.get("subtotal", 0)
+        lines_match_subtotal = subtotal > 0 and _close(sum(i["line_total"] for i in items), subtotal)
+
+        bad = [idx for idx, i in enumerate(items)
+               if i["quantity"] and i["unit_price"]
+               and not _close_product(i["quantity"] * i["unit_price"], i["line_total"])]
+        # Only one inconsistent line can be repaired unambiguously
+        if len(bad) != 1:
+            return
+
+        idx = bad[0]
+        item = items[idx]
+        computed_total = round(item["quantity"] * item["unit_price"], 2)
+        others = sum(i["line_total"] for j, i in enumerate(items) if j != idx)
+
+        if not lines_match_subtotal and (subtotal <= 0 or _close(others + computed_total, subtotal)):
+            repairs.append(f"line_items[{idx}].line_total {item['line_total']} -> {computed_total}")
+            item["line_total"] = computed_total
+        elif lines_match_subtotal:
+            # line_total is confirmed by the subtotal, so quantity or unit_price was misread
+            quantity = item["line_total"] / item["unit_price"]
+            if abs(quantity - round(quantity)) < 1e-6 and round(quantity) > 0:
+                repairs.append(f"line_items[{idx}].quantity {item['quantity']} -> {round(quantity)}")
+                item["quantity"] = float(round(quantity))
+            else:
+                unit_price = round(item["line_total"] / item["quantity"], 2)
+                repairs.append(f"line_items[{idx}].unit_price {item['unit_price']} -> {unit_price}")
+                item["unit_price"] = unit_price
+
+    def _repair_totals(self, invoice: dict, repairs: list):
+        items = invoice.get("line_items", [])
+        lines_sum = round(sum(i["line_total"] for i in items), 2)
+        subtotal, vat, total = invoice.get("subtotal", 0), invoice.get("vat_amount", 0), invoice.get("total", 0)
+        rate = invoice.get("vat_rate", 0)
+
+        # Subtotal missing or misread, but lines and VAT explain the total
+        if items and not _close(lines_sum, subtotal) and total > 0 and _close(lines_sum + vat, total):
+            repairs.append(f"subtotal {subtotal} -> {lines_sum}")
+            invoice["subtotal"] = subtotal = lines_sum
+
+        if subtotal > 0 and total > 0 and not _close(subtotal + vat, total):
+            expected_vat = round(subtotal * rate, 2)
+            if _close_product(total - subtotal, expected_vat):
+                repairs.append(f"vat_amount {vat} -> {round(total - subtotal, 2)}")
+                invoice["vat_amount"] = round(total - subtotal, 2)
+            elif _close_product(vat, expected_vat):
+                repairs.append(f"total {total} -> {round(subtotal + vat, 2)}")
+                invoice["total"] = round(subtotal + vat, 2)
+
+    def _run_checks(self, invoice: dict) -> tuple:
+        checks = {}
+        issues = []
+        items = invoice.get("line_items", [])
+
+        for idx, item in enumerate(items):
+            ok = _close_product(item["quantity"] * item["unit_price"], item["line_total"])
+            checks[f"line_items[{idx}]"] = ok
+            if not ok:
+                issues.append(f"Line {idx + 1}: {item['quantity']} x {item['unit_price']} != {item['line_total']}")
+
+        subtotal, vat, total = invoice.get("subtotal", 0), invoice.get("vat_amount", 0), invoice.get("total", 0)
+        lines_sum = round(sum(i["line_total"] for i in items), 2)
+        if items and subtotal > 0:
+            checks["lines_sum"] = _close(lines_sum, subtotal)
+            if not checks["lines_sum"]:
+                issues.append(f"Line totals {lines_sum:.2f} != subtotal {subtotal:.2f}")
+        elif items and total > 0:
+            # No subtotal to check against: the lines must still explain the total
+            rate = invoice.get("vat_rate") or 0
+            vat_options = [vat] if vat > 0 else [0.0, round(lines_sum * rate, 2)]
+            checks["lines_total"] = any(_close(lines_sum + option, total) for option in vat_options)
+            if not checks["lines_total"]:
+                issues.append(f"Line totals {lines_sum:.2f} (+ VAT) != total {total:.2f}")
+        if subtotal > 0 and vat > 0 and invoice.get("vat_rate"):
+            checks["vat_rate"] = _close_product(subtotal * invoice["vat_rate"], vat)
+            if not checks["vat_rate"]:
+                issues.append(f"VAT {vat:.2f} != {invoice['vat_rate']:.0%} of subtotal {subtotal:.2f}")
+        if subtotal > 0 and total > 0:
+            checks["grand_total"] = _close(subtotal + vat, total)
+            if not checks["grand_total"]:
+                issues.append(f"Subtotal + VAT {subtotal + vat:.2f} != total {total:.2f}")
+
+        return checks, issues
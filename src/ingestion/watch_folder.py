@@ -0,0 +1,206 @@
+import contextvars
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from orchestration.output import write_json
+from monitoring.metrics import REGISTRY
+from monitoring.structured_logging import correlation, new_id
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class InotifyWatch:
+    """Minimal inotify binding (Linux) yielding names of files created, written or moved in"""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def read(self, timeout: float) -> set:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names, offset = set(), 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatch:
+    """Fallback where inotify is unavailable: report every file present on each tick"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def read(self, timeout: float) -> set:
+        time.sleep(timeout)
+        return set(os.listdir(self.directory))
+
+    def close(self):
+        pass
+
+
+class InboxWatcher:
+    """Process invoices as they land in the inbox, then move them to the archive.
+
+    A file is submitted once it has been quiet for `debounce` seconds with an
+    unchanged size and mtime, so scans still being written are never read.
+    """
+
+    def __init__(self, graph, inbox: str = None, archive_dir: str = None, workers: int = None,
+                 debounce: float = None):
+        self.graph = graph
+        self.inbox = inbox or Config.INBOX_DIR
+        self.archive_dir = archive_dir or Config.ARCHIVE_DIR
+        self.failed_dir = os.path.join(self.archive_dir, "failed")
+        self.debounce = Config.WATCH_DEBOUNCE_SECONDS if debounce is None else debounce
+        self.pool = ThreadPoolExecutor(max_workers=workers or Config.WATCH_WORKERS)
+        self._pending = {}  # filename -> (size, mtime, last change time)
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        REGISTRY.gauge("invoice_recon_inbox_pending", "Inbox files waiting for the debounce window", lambda: len(self._pending))
+        REGISTRY.gauge("invoice_recon_inbox_in_flight", "Inbox files being processed", lambda: len(self._in_flight))
+
+    @staticmethod
+    def is_invoice(filename: str) -> bool:
+        return not filename.startswith((".", "~")) and filename.lower().endswith(Config.INVOICE_EXTENSIONS)
+
+    def run(self):
+        os.makedirs(self.inbox, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+        try:
+            watch = InotifyWatch(self.inbox)
+            mode = "inotify"
+        except (OSError, AttributeError):
+            watch = PollingWatch(self.inbox)
+            mode = "polling"
+        # One job id per daemon session, inherited by every invoice it processes
+        with correlation(job=new_id()):
+            logger.info("Watching %s (%s), archiving to %s", self.inbox, mode, self.archive_dir)
+
+            # Files dropped while the daemon was down
+            self._touch(os.listdir(self.inbox))
+            try:
+                while not self._stop.is_set():
+                    self._touch(watch.read(min(self.debounce, 1.0) or 0.2))
+                    self._submit_ready()
+            finally:
+                watch.close()
+                self.pool.shutdown(wait=True)
+                logger.info("Watcher stopped: %d processed, %d failed", self.processed, self.failed,
+                            extra={"processed": self.processed, "failed": self.failed})
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def _touch(self, names):
+        now = time.monotonic()
+        for name in names:
+            if not self.is_invoice(name):
+                continue
+            with self._lock:
+                if name in self._in_flight:
+                    continue
+            try:
+                st = os.stat(os.path.join(self.inbox, name))
+            except FileNotFoundError:
+                self._pending.pop(name, None)
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            previous = self._pending.get(name)
+            if previous is None or previous[:2] != signature:
+                self._pending[name] = (*signature, now)
+
+    def _submit_ready(self):
+        now = time.monotonic()
+        for name, (size, mtime, changed_at) in list(self._pending.items()):
+            if now - changed_at < self.debounce:
+                continue
+            try:
+                st = os.stat(os.path.join(self.inbox, name))
+            except FileNotFoundError:
+                del self._pending[name]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime) or st.st_size == 0:
+                # Still being written: restart the quiet period
+                self._pending[name] = (st.st_size, st.st_mtime_ns, now)
+                continue
+            del self._pending[name]
+            with self._lock:
+                self._in_flight.add(name)
+            self.pool.submit(contextvars.copy_context().run, self._process, name)
+
+    def _process(self, name: str):
+        path = os.path.join(self.inbox, name)
+        try:
+            result = self.graph.process_invoice(path, name)
+            output_path = os.path.join(Config.OUTPUT_DIR, f"{os.path.splitext(name)[0]}_output.json")
+            write_json(output_path, result)
+            self._move(path, self.archive_dir)
+            with self._lock:
+                self.processed += 1
+            logger.info("Archived %s", name, extra={
+                "invoice_file": name, "action": result["processing_results"]["recommended_action"], "output": output_path
+            })
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error("Error processing %s: %s", name, e, exc_info=True, extra={"invoice_file": name})
+            if os.path.exists(path):
+                self._move(path, self.failed_dir)
+        finally:
+            with self._lock:
+                self._in_flight.discard(name)
+
+    @staticmethod
+    def _move(path: str, directory: str):
+        target = os.path.join(directory, os.path.basename(path))
+        if os.path.exists(target):
+            stem, ext = os.path.splitext(target)
+            target = f"{stem}_{time.strftime('%Y%m%d%H%M%S')}{ext}"
+        shutil.move(path, target)
+
+
+def watch(graph):
+    """Run the watcher until SIGINT/SIGTERM"""
+    watcher = InboxWatcher(graph)
+    signal.signal(signal.SIGINT, watcher.stop)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    watcher.run()
+    return watcher
@@ -0,0 +1,139 @@
+import json
+import urllib.request
+from typing import Iterator
+from config import Config
+
+
+class LLMBackend:
+    """Base interface for text-generation backends used by LLMClient"""
+
+    name = "base"
+
+    def generate(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        """Yield generated text incrementally; closing the iterator stops generation"""
+        yield self.generate(prompt, max_tokens, temperature)
+
+
+class HuggingFaceBackend(LLMBackend):
+    """Remote generation through the Hugging Face Inference API"""
+
+    name = "huggingface"
+
+    def __init__(self, model: str = None, token: str = None):
+        from huggingface_hub import InferenceClient
+
+        self.model = model or Config.HF_MODEL
+        self.client = InferenceClient(token=token if token is not None else Config.HF_TOKEN)
+
+    def generate(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        return self.client.text_generation(
+            prompt,
+            model=self.model,
+            max_new_tokens=max_tokens,
+            temperature=temperature,
+            return_full_text=False
+        )
+
+    def stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        yield from self.client.text_generation(
+            prompt,
+            model=self.model,
+            max_new_tokens=max_tokens,
+            temperature=temperature,
+            return_full_text=False,
+            stream=True
+        )
+
+
+class LlamaCppBackend(LLMBackend):
+    """Local CPU generation from a quantized GGUF model via llama-cpp-python"""
+
+    name = "llamacpp"
+
+    def __init__(self, model: str = None, n_threads: int = None, n_ctx: int = None):
+        try:
+            from llama_cpp import Llama
+        except ImportError as e:
+            raise ImportError("LLM_BACKEND=llamacpp requires 'llama-cpp-python' to be installed") from e
+
+        self.model = model or Config.LOCAL_MODEL_PATH
+        self.llm = Llama(
+            model_path=self.model,
+            n_threads=n_threads or Config.LOCAL_MODEL_THREADS,
+            n_ctx=n_ctx or Config.LOCAL_MODEL_CONTEXT,
+            verbose=False
+        )
+
+    def generate(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        output = self.llm(prompt, max_tokens=max_tokens, temperature=temperature, echo=False)
+        return output["choices"][0]["text"]
+
+    def stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        for chunk in self.llm(prompt, max_tokens=max_tokens, temperature=temperature, echo=False, stream=True):
+            yield chunk["choices"][0]["text"]
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Local OpenAI-compatible completion server (llama.cpp server, vLLM, Ollama, ...)"""
+
+    name = "openai_local"
+
+    def __init__(self, base_url: str = None, model: str = None, timeout: float = None):
+        self.base_url = (base_url or Config.LOCAL_LLM_URL).rstrip("/")
+        self.model = model or Config.LOCAL_LLM_MODEL
+        self.timeout = timeout or Config.LLM_TIMEOUT
+
+    def _request(self, prompt: str, max_tokens: int, temperature: float, stream: bool) -> urllib.request.Request:
+        payload = json.dumps({
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": stream
+        }).encode("utf-8")
+        return urllib.request.Request(
+            f"{self.base_url}/completions",
+            data=payload,
+            headers={"Content-Type": "application/json"}
+        )
+
+    def generate(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        request = self._request(prompt, max_tokens, temperature, stream=False)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = json.loads(response.read().decode("utf-8"))
+        return body["choices"][0]["text"]
+
+    def stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        # Server-sent events; leaving the with-block closes the connection,
+        # which makes the server abort the remaining generation
+        request = self._request(prompt, max_tokens, temperature, stream=True)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            for raw_line in response:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)["choices"][0]["text"]
+
+
+BACKENDS = {
+    HuggingFaceBackend.name: HuggingFaceBackend,
+    LlamaCppBackend.name: LlamaCppBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+}
+
+
+def create_backend(name: str = None, model: str = None) -> LLMBackend:
+    """Instantiate the backend selected by name or Config.LLM_BACKEND (model: backend default if None)"""
+    name = (name or Config.LLM_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Available: {', '.join(BACKENDS)}")
+    if Config.LLM_RECORD_MODE.lower() != "off":
+        from llm.recording import RecordReplayBackend
+        return RecordReplayBackend(name, model)
+    return BACKENDS[name](model=model)
@@ -1,44 +1,62 @@
-from huggingface_hub import InferenceClient
-from config import Config
-import json
-import re
+from llm.backends import create_backend, LLMBackend
+from llm.json_stream import JSONObjectScanner, parse_first_object
+from monitoring.metrics import LLM_SECONDS, LLM_ERRORS
+import logging
+import time
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+logger = logging.getLogger(__name__)
+
+
 class LLMClient:
-    def __init__(self):
-        self.client = InferenceClient(token=Config.HF_TOKEN)
-        self.model = Config.HF_MODEL
+    def __init__(self, backend: LLMBackend = None, model: str = None):
+        self.backend = backend or create_backend(model=model)
+        self.model = getattr(self.backend, "model", self.backend.name)
     
     def generate(self, prompt: str, max_tokens: int = 2000, temperature: float = 0.1) -> str:
-        """Generate text using Hugging Face Inference API"""
+        """Generate text using the configured backend (remote or local)"""
+        start = time.perf_counter()
         try:
-            response = self.client.text_generation(
-                prompt,
-                model=self.model,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                return_full_text=False
-            )
-            return response
+            return self.backend.generate(prompt, max_tokens, temperature)
         except Exception as e:
-            print(f"LLM Error: {e}")
+            LLM_ERRORS.inc(self.backend.name)
+            logger.error("LLM error: %s", e, extra={"backend": self.backend.name})
             return ""
+        finally:
+            LLM_SECONDS.observe(time.perf_counter() - start, self.backend.name, "generate")
     
     def extract_json(self, text: str) -> dict:
-        """Extract JSON from LLM response"""
+        """Extract the first JSON object from LLM response, ignoring trailing text"""
         try:
-            # Try to find JSON in the text
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            return {}
+            return parse_first_object(text)
         except Exception as e:
-            print(f"JSON extraction error: {e}")
+            logger.warning("JSON extraction error: %s", e)
             return {}
     
     def generate_structured(self, prompt: str, max_tokens: int = 2000) -> dict:
-        """Generate and return structured JSON response"""
-        response = self.generate(prompt, max_tokens, temperature=0.1)
-        return self.extract_json(response)
+        """Stream generation and stop as soon as the top-level JSON object closes"""
+        scanner = JSONObjectScanner()
+        received = []
+        stream = None
+        start = time.perf_counter()
+        try:
+            stream = self.backend.stream(prompt, max_tokens, 0.1)
+            for chunk in stream:
+                received.append(chunk)
+                if scanner.feed(chunk):
+                    break
+        except Exception as e:
+            LLM_ERRORS.inc(self.backend.name)
+            logger.error("LLM error: %s", e, extra={"backend": self.backend.name})
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            LLM_SECONDS.observe(time.perf_counter() - start, self.backend.name, "stream")
+
+        result = scanner.result()
+        if result is not None:
+            return result
+        # Malformed first object: fall back to scanning everything received
+        return self.extract_json("".join(received))
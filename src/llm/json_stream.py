@@ -0,0 +1,71 @@
+import json
+from typing import Optional
+
+
+class JSONObjectScanner:
+    """Incrementally track a streamed completion until its top-level JSON object closes"""
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk of generated text; return True once the object is closed"""
+        for char in chunk:
+            if self.complete:
+                break
+
+            if not self.started:
+                if char != "{":
+                    continue  # Skip any preamble before the object
+                self.started = True
+
+            self.buffer.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+
+        return self.complete
+
+    def text(self) -> str:
+        return "".join(self.buffer)
+
+    def result(self) -> Optional[dict]:
+        """Parsed object, or None if the object is incomplete or invalid"""
+        if not self.complete:
+            return None
+        try:
+            parsed = json.loads(self.text())
+        except json.JSONDecodeError:
+            return None
+        return parsed if isinstance(parsed, dict) else None
+
+
+def parse_first_object(text: str) -> dict:
+    """Return the first valid top-level JSON object in text, ignoring surrounding prose"""
+    start = text.find("{")
+    while start != -1:
+        scanner = JSONObjectScanner()
+        scanner.feed(text[start:])
+        parsed = scanner.result()
+        if parsed is not None:
+            return parsed
+        start = text.find("{", start + 1)
+    return {}
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, Optional
+from config import Config
+from llm.backends import LLMBackend, BACKENDS
+from monitoring.metrics import LLM_RECORDINGS
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay", "auto")
+
+# Model a backend uses when none is requested, so recordings stay keyed on the real model
+DEFAULT_MODELS = {
+    "huggingface": lambda: Config.HF_MODEL,
+    "llamacpp": lambda: os.path.basename(Config.LOCAL_MODEL_PATH),
+    "openai_local": lambda: Config.LOCAL_LLM_MODEL,
+}
+
+
+class ResponseStore:
+    """Append-only JSONL file of prompt -> response pairs, indexed in memory by request key"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._load()
+
+    @staticmethod
+    def key(backend: str, model: str, mode: str, prompt: str, max_tokens: int, temperature: float) -> str:
+        request = json.dumps([backend, model, mode, prompt, max_tokens, round(temperature, 4)])
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        # Later lines win, so re-recording a prompt replaces the old response
+                        self._responses[record["key"]] = record["response"]
+        except Exception as e:
+            logger.error("Error loading LLM recordings: %s", e)
+
+    def get(self, key: str) -> Optional[str]:
+        response = self._responses.get(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        LLM_RECORDINGS.inc("hit" if response is not None else "miss")
+        return response
+
+    def put(self, key: str, response: str, **request):
+        record = {"key": key, **request, "response": response,
+                  "recorded_at": datetime.utcnow().isoformat() + "Z"}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._responses[key] = response
+            self.recorded += 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        LLM_RECORDINGS.inc("recorded")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"responses": len(self._responses), "hits": self.hits,
+                    "misses": self.misses, "recorded": self.recorded}
+
+    def __len__(self):
+        return len(self._responses)
+
+
+@lru_cache(maxsize=None)
+def open_store(path: str) -> ResponseStore:
+    """One store per file and process, shared by every client (small and large model)"""
+    return ResponseStore(path)
+
+
+class RecordReplayBackend(LLMBackend):
+    """Wraps a live backend to record its responses or serve them back offline.
+
+    record: call the live backend and append every response to the store
+    replay: answer from the store only; a prompt never recorded raises LookupError
+    auto:   replay when recorded, otherwise call the live backend and record
+    The live backend is only constructed on the first miss, so a full replay needs
+    neither network access nor model weights.
+    """
+
+    def __init__(self, backend: str, model: str = None, mode: str = None, store: ResponseStore = None):
+        self.mode = (mode or Config.LLM_RECORD_MODE).lower()
+        if self.mode not in MODES[1:]:
+            raise ValueError(f"Unknown LLM record mode '{self.mode}'. Available: {', '.join(MODES[1:])}")
+        self.backend = backend
+        self.requested_model = model
+        self.model = model or DEFAULT_MODELS.get(backend, lambda: backend)()
+        self.name = f"{backend}-{self.mode}"
+        self.store = store if store is not None else open_store(Config.LLM_RECORDINGS_FILE)
+        self._live = None
+        self._live_lock = threading.Lock()
+
+    @property
+    def live(self) -> LLMBackend:
+        if self._live is None:
+            with self._live_lock:
+                if self._live is None:
+                    self._live = BACKENDS[self.backend](model=self.requested_model)
+        return self._live
+
+    def _key(self, call: str, prompt: str, max_tokens: int, temperature: float) -> str:
+        return self.store.key(self.backend, self.model, call, prompt, max_tokens, temperature)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if self.mode == "record":
+            return None
+        response = self.store.get(key)
+        if response is None and self.mode == "replay":
+            raise LookupError(f"No recorded {self.backend} response for request {key[:12]}")
+        return response
+
+    def _record(self, key: str, call: str, prompt: str, max_tokens: int, temperature: float, response: str):
+        self.store.put(key, response, backend=self.backend, model=self.model, call=call,
+                       max_tokens=max_tokens, temperature=temperature, prompt=prompt)
+
+    def generate(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        key = self._key("generate", prompt, max_tokens, temperature)
+        response = self._lookup(key)
+        if response is None:
+            response = self.live.generate(prompt, max_tokens, temperature)
+            self._record(key, "generate", prompt, max_tokens, temperature, response)
+        return response
+
+    def stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        key = self._key("stream", prompt, max_tokens, temperature)
+        response = self._lookup(key)
+        if response is not None:
+            yield response
+            return
+
+        # Record what the caller consumed: LLMClient stops reading once the JSON object
+        # closes, and replay must reproduce exactly that text
+        chunks, finished = [], False
+        live_stream = self.live.stream(prompt, max_tokens, temperature)
+        try:
+            for chunk in live_stream:
+                chunks.append(chunk)
+                yield chunk
+            finished = True
+        except GeneratorExit:
+            finished = True
+            raise
+        finally:
+            if hasattr(live_stream, "close"):
+                live_stream.close()
+            if finished:
+                self._record(key, "stream", prompt, max_tokens, temperature, "".join(chunks))
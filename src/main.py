@@ -1,6 +1,8 @@
+import argparse
+import logging
 import os
-import json
 import sys
+import time
 
 # Add src directory to path
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,32 +10,74 @@ sys.path.insert(0, CURRENT_DIR)
 
 from config import Config
 from orchestration.graph import InvoiceReconciliationGraph
+from orchestration.output import write_json
+from monitoring.structured_logging import configure_logging, job_id, new_id
+
+logger = logging.getLogger("main")
 
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="Invoice Reconciliation Agent System")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running: process invoices as they arrive in the inbox, then archive them")
+    parser.add_argument("--compact", action="store_true", help="write compact (unindented) output JSON")
+    parser.add_argument("--export-parquet", metavar="DIR", default=Config.PARQUET_EXPORT_DIR,
+                        help="also write results to partitioned Parquet datasets in DIR (needs pyarrow)")
+    parser.add_argument("--coordinator", action="store_true",
+                        help="shard the invoices onto the work queue, wait for workers and merge their results")
+    parser.add_argument("--worker", action="store_true", help="process shards from the work queue until it drains")
+    parser.add_argument("--queue", metavar="URL", default=Config.WORK_QUEUE_URL,
+                        help="work queue: sqlite:///path.db, file:///shared/dir or redis://host:6379/0")
+    parser.add_argument("--local-workers", type=int, default=0, metavar="N",
+                        help="with --coordinator, also start N worker processes on this node")
+    parser.add_argument("--shard-size", type=int, default=Config.BATCH_SHARD_SIZE, metavar="N",
+                        help="invoices per queued shard")
+    args = parser.parse_args()
+    if args.compact:
+        Config.OUTPUT_COMPACT = True
+
+    # Structured logs go to stderr; this run's records share one job id
+    configure_logging()
+    job_id.set(new_id())
+
     print("🚀 Invoice Reconciliation Agent System")
     print("=" * 60)
 
     # Ensure directories exist
     Config.ensure_directories()
 
+    if Config.METRICS_PORT:
+        from monitoring.metrics import start_metrics_server
+        start_metrics_server(Config.METRICS_PORT)
+        print(f"📈 Metrics on http://127.0.0.1:{Config.METRICS_PORT}/metrics")
+
+    if args.coordinator:
+        coordinate(args)
+        return
+
     # Initialize the graph
     graph = InvoiceReconciliationGraph()
 
-    # Get all invoice files
-    invoice_files = []
-    if os.path.exists(Config.INVOICES_DIR):
-        for file in os.listdir(Config.INVOICES_DIR):
-            if file.endswith(('.pdf', '.jpg', '.jpeg', '.png', '.txt')):
-                invoice_files.append(file)
+    if args.worker:
+        from batch.coordinator import BatchWorker
+        from batch.work_queue import create_queue
+        BatchWorker(create_queue(args.queue), graph).run()
+        return
+
+    if args.watch:
+        from ingestion.watch_folder import watch
+        watch(graph)
+        return
 
+    invoice_files = find_invoices()
     if not invoice_files:
-        print("❌ No invoice files found in data/invoices/")
-        print(f"Please add invoices to: {Config.INVOICES_DIR}")
         return
 
-    print(f"\nFound {len(invoice_files)} invoice(s) to process\n")
+    exporter = None
+    if args.export_parquet:
+        from export.parquet_export import ParquetExporter
+        exporter = ParquetExporter(args.export_parquet)
 
     # Process each invoice
     results = []
@@ -48,17 +92,73 @@ def main():
             output_filename = f"invoice_{idx}_output.json"
             output_path = os.path.join(Config.OUTPUT_DIR, output_filename)
 
-            with open(output_path, 'w') as f:
-                json.dump(result, f, indent=2)
+            write_json(output_path, result)
+
+            logger.info("Saved output to %s", output_path, extra={
+                "invoice_file": filename, "output": output_path, "correlation_id": result["correlation_id"]
+            })
 
-            print(f"💾 Saved output to: {output_path}")
+            if exporter:
+                exporter.add(result)
 
         except Exception as e:
-            print(f"❌ Error processing {filename}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("Error processing %s: %s", filename, e, exc_info=True, extra={"invoice_file": filename})
+
+    if exporter:
+        exporter.close()
 
     # Summary
+    total_time = print_summary(results)
+    if exporter:
+        print(f"🗃️  Parquet export: {exporter.files_written} file(s) in {args.export_parquet}")
+
+    routing = graph.routing_summary()
+    print(f"🔀 Average agent path length: {routing['avg_path_length']:.2f} nodes "
+          f"(skipped: {routing['skip_counts'] or 'none'})")
+
+    for tier, stats in graph.doc_agent.tier_summary().items():
+        if stats["attempts"]:
+            print(f"🧩 Extraction tier {tier}: {stats['attempts']} attempts, "
+                  f"{stats['hit_rate']:.0%} accepted, mean {stats['mean_ms']:.0f}ms")
+
+    rule_hits = graph.resolution_agent.rule_summary()
+    if rule_hits:
+        print(f"📐 Resolution rule hits: {rule_hits}")
+
+    ocr_stats = graph.doc_agent.extractor.ocr_stats()
+    if ocr_stats and ocr_stats["calls"]:
+        print(f"🔎 OCR ({ocr_stats['engine']}): {ocr_stats['calls']} calls, "
+              f"mean {ocr_stats['mean_ms']:.0f}ms, p95 {ocr_stats['p95_ms']:.0f}ms")
+
+    if Config.METRICS_DUMP_FILE:
+        from monitoring.metrics import REGISTRY
+        REGISTRY.dump(Config.METRICS_DUMP_FILE)
+        print(f"📈 Metrics written to: {Config.METRICS_DUMP_FILE}")
+
+    if total_time < 300:  # 5 minutes
+        print("✅ Performance target met (<5 minutes)")
+    else:
+        print("⚠️  Performance target exceeded (>5 minutes)")
+
+
+def find_invoices() -> list:
+    """Invoice file names in INVOICES_DIR (output files are numbered in this order)"""
+    invoice_files = []
+    if os.path.exists(Config.INVOICES_DIR):
+        for file in os.listdir(Config.INVOICES_DIR):
+            if file.lower().endswith(Config.INVOICE_EXTENSIONS):
+                invoice_files.append(file)
+
+    if not invoice_files:
+        print("❌ No invoice files found in data/invoices/")
+        print(f"Please add invoices to: {Config.INVOICES_DIR}")
+    else:
+        print(f"\nFound {len(invoice_files)} invoice(s) to process\n")
+    return invoice_files
+
+
+def print_summary(results: list) -> float:
+    """Action counts and processing time; returns the summed per-invoice seconds"""
     print(f"\n{'=' * 60}")
     print("📊 PROCESSING SUMMARY")
     print(f"{'=' * 60}")
@@ -76,11 +176,59 @@ def main():
     # Total time
     total_time = sum(r['processing_duration_seconds'] for r in results)
     print(f"⏱️  Total processing time: {total_time:.2f}s")
+    return total_time
 
-    if total_time < 300:  # 5 minutes
-        print("✅ Performance target met (<5 minutes)")
-    else:
-        print("⚠️  Performance target exceeded (>5 minutes)")
+
+def coordinate(args):
+    """Sharded run: queue the invoices, wait for workers (local and remote), merge into OUTPUT_DIR"""
+    from batch.coordinator import Coordinator, spawn_local_workers
+    from batch.work_queue import create_queue
+
+    invoice_files = find_invoices()
+    if not invoice_files:
+        return
+
+    exporter = None
+    if args.export_parquet:
+        # Before queueing, so a missing pyarrow fails fast rather than after the batch
+        from export.parquet_export import ParquetExporter
+        exporter = ParquetExporter(args.export_parquet)
+
+    coordinator = Coordinator(create_queue(args.queue), args.shard_size)
+    start = time.perf_counter()
+    batch = coordinator.submit(list(enumerate(invoice_files, 1)))
+    print(f"📦 Batch {batch} queued on {args.queue}")
+
+    workers = spawn_local_workers(args.local_workers, args.queue)
+    if workers:
+        print(f"👷 Started {len(workers)} local worker(s); remote workers: python src/main.py --worker --queue URL")
+    try:
+        coordinator.wait(workers)
+    finally:
+        for proc in workers:
+            proc.wait()
+    wall_time = time.perf_counter() - start
+
+    results, failed = coordinator.merge()
+    if exporter:
+        for result in results:
+            exporter.add(result)
+        exporter.close()
+
+    print_summary(results)
+    if exporter:
+        print(f"🗃️  Parquet export: {exporter.files_written} file(s) in {args.export_parquet}")
+    print(f"🖧  Wall time: {wall_time:.2f}s ({len(results) / wall_time:.2f} invoices/s)")
+    stats = coordinator.queue.stats()
+    print(f"📦 Shards: {stats['done']} done, {stats['dead']} dead, {stats['pending'] + stats['leased']} unfinished")
+    for filename, error in failed:
+        print(f"❌ {filename}: {error}")
+
+    if Config.METRICS_DUMP_FILE:
+        # Includes the metrics workers shipped with their shard results
+        from monitoring.metrics import REGISTRY
+        REGISTRY.dump(Config.METRICS_DUMP_FILE)
+        print(f"📈 Metrics written to: {Config.METRICS_DUMP_FILE}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Optional
+from config import Config
+from matching.normalization import normalize_supplier
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8  # 8-bit bands: any pair within 7 bits shares at least one band
+
+
+class FingerprintIndex:
+    """Exact and near-duplicate lookup for submitted invoices"""
+
+    def __init__(self, index_file: str = None):
+        self.index_file = index_file if index_file is not None else Config.FINGERPRINT_INDEX_FILE
+        self.max_distance = Config.DUPLICATE_SIMHASH_DISTANCE
+        self._lock = threading.Lock()
+        self._by_hash: Dict[str, dict] = {}
+        self._by_key: Dict[tuple, dict] = {}
+        self._bands: Dict[tuple, list] = {}
+        self._load()
+
+    @staticmethod
+    def content_hash(file_path: str) -> str:
+        """SHA-256 of the raw file bytes"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def simhash(text: str) -> int:
+        """64-bit SimHash over word 3-gram shingles of the normalised text"""
+        words = re.findall(r'[a-z0-9]+', text.lower())
+        shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+        weights = [0] * SIMHASH_BITS
+        for shingle in shingles:
+            value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+            for bit in range(SIMHASH_BITS):
+                weights[bit] += 1 if value >> bit & 1 else -1
+        return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+    @staticmethod
+    def invoice_key(supplier: str, invoice_number: str, total: float) -> Optional[tuple]:
+        """Normalised (supplier, invoice_number, total) key, or None if incomplete"""
+        if not invoice_number or not total:
+            return None
+        supplier = normalize_supplier(supplier)
+        number = re.sub(r'[^A-Z0-9]', "", invoice_number.upper())
+        return supplier, number, round(float(total), 2)
+
+    @staticmethod
+    def _band_keys(fingerprint: int) -> list:
+        width = SIMHASH_BITS // SIMHASH_BANDS
+        mask = (1 << width) - 1
+        return [(band, fingerprint >> (band * width) & mask) for band in range(SIMHASH_BANDS)]
+
+    def find_exact(self, content_hash: str) -> Optional[dict]:
+        return self._by_hash.get(content_hash)
+
+    def find_near(self, fingerprint: int) -> Optional[dict]:
+        """Closest indexed invoice within max_distance bits, checking only shared bands"""
+        best, best_distance = None, self.max_distance + 1
+        for band_key in self._band_keys(fingerprint):
+            for entry in self._bands.get(band_key, []):
+                distance = bin(entry["simhash"] ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+        return best
+
+    def find_by_key(self, key: Optional[tuple]) -> Optional[dict]:
+        return self._by_key.get(key) if key else None
+
+    def register(self, filename: str, content_hash: str, fingerprint: int, key: Optional[tuple] = None,
+                 extracted: dict = None, quality: str = ""):
+        """Index an original invoice together with its extraction for later duplicates"""
+        entry = {"filename": filename, "content_hash": content_hash, "simhash": fingerprint,
+                 "key": list(key) if key else None, "extracted": extracted, "quality": quality}
+        with self._lock:
+            self._add(entry)
+            if self.index_file:
+                with open(self.index_file, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def register_alias(self, content_hash: str, original: dict):
+        """Map another file's bytes (a re-scan or re-keyed copy) to an indexed original"""
+        with self._lock:
+            self._by_hash[content_hash] = original
+            if self.index_file:
+                with open(self.index_file, "a") as f:
+                    f.write(json.dumps({"content_hash": content_hash, "alias_of": original["content_hash"]}) + "\n")
+
+    def _add(self, entry: dict):
+        if "alias_of" in entry:
+            original = self._by_hash.get(entry["alias_of"])
+            if original:
+                self._by_hash[entry["content_hash"]] = original
+            return
+        self._by_hash[entry["content_hash"]] = entry
+        if entry.get("key"):
+            self._by_key[tuple(entry["key"])] = entry
+        for band_key in self._band_keys(entry["simhash"]):
+            self._bands.setdefault(band_key, []).append(entry)
+
+    def _load(self):
+        """Load a persisted index (one JSON entry per line), if configured"""
+        if not self.index_file or not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+        except Exception as e:
+            logger.error("Error loading fingerprint index: %s", e)
@@ -0,0 +1,215 @@
+"""Pair invoice lines with PO lines when item codes do not match exactly.
+
+Lines whose normalised codes agree are paired directly. The remaining lines are
+scored on every (invoice, PO) pair at once with numpy: character-bigram overlap of
+OCR-folded codes, description token overlap and quantity/unit-price proximity in
+base units. Pairs below LINE_ALIGN_MIN_SCORE are ruled out, the candidate graph is
+split into connected blocks, and each block is solved as an optimal assignment
+(scipy's linear_sum_assignment when installed, otherwise a numpy Hungarian solver).
+"""
+import re
+from typing import List, NamedTuple
+from config import Config
+from matching.normalization import Normalizer
+
+# numpy (and scipy, when installed) are imported only when some line needs aligning
+
+# Characters OCR commonly confuses, folded to one form before codes are compared
+OCR_CONFUSIONS = str.maketrans({"O": "0", "Q": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2"})
+FORBIDDEN_COST = 1e6
+
+
+class LineAlignment(NamedTuple):
+    invoice_index: int
+    po_index: int
+    score: float
+    method: str  # "exact_code" or "aligned"
+
+
+def normalize_code(code: str) -> str:
+    return re.sub(r'[^A-Z0-9]', "", (code or "").upper())
+
+
+def _code_bigrams(code: str) -> set:
+    folded = "^" + normalize_code(code).translate(OCR_CONFUSIONS) + "$"
+    return {folded[k:k + 2] for k in range(len(folded) - 1)}
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r'[a-z0-9]+', (text or "").lower()))
+
+
+def _incidence(np, left: list, right: list) -> tuple:
+    """Binary feature matrices over the shared vocabulary of two lists of sets"""
+    vocab = {feature: k for k, feature in enumerate(set().union(*left, *right))}
+    matrices = []
+    for sets in (left, right):
+        matrix = np.zeros((len(sets), max(len(vocab), 1)), dtype=np.float32)
+        rows = [row for row, features in enumerate(sets) for _ in features]
+        cols = [vocab[feature] for features in sets for feature in features]
+        matrix[rows, cols] = 1.0
+        matrices.append(matrix)
+    return matrices
+
+
+def _dice(np, left: list, right: list):
+    a, b = _incidence(np, left, right)
+    sizes = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :]
+    return np.divide(2 * (a @ b.T), sizes, out=np.zeros_like(sizes), where=sizes > 0)
+
+
+def _jaccard(np, left: list, right: list):
+    a, b = _incidence(np, left, right)
+    overlap = a @ b.T
+    union = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - overlap
+    return np.divide(overlap, union, out=np.zeros_like(union), where=union > 0)
+
+
+def _proximity(np, left: list, right: list):
+    """min/max ratio of two positive values: 1.0 when equal, 0.0 when either is missing"""
+    a = np.array([x if x and x > 0 else np.nan for x in left], dtype=np.float64)[:, None]
+    b = np.array([x if x and x > 0 else np.nan for x in right], dtype=np.float64)[None, :]
+    return np.nan_to_num(np.minimum(a, b) / np.maximum(a, b), nan=0.0)
+
+
+def _blocks(candidates) -> list:
+    """Connected components of the bipartite candidate graph, as (rows, cols) index lists"""
+    n, m = candidates.shape
+    parent = list(range(n + m))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in zip(*candidates.nonzero()):
+        parent[find(int(i))] = find(n + int(j))
+
+    groups = {}
+    for node in range(n + m):
+        rows, cols = groups.setdefault(find(node), ([], []))
+        (rows if node < n else cols).append(node if node < n else node - n)
+    return [(rows, cols) for rows, cols in groups.values() if rows and cols]
+
+
+def _hungarian(np, cost) -> tuple:
+    """Minimum-cost assignment (rows, cols) for a dense cost matrix; O(n^2 m), vectorised per step"""
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)  # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0], j0 = i, 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            slack = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(slack)) + 1
+            delta = slack[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assigned = np.nonzero(p[1:])[0]
+    rows, cols = p[1:][assigned] - 1, assigned
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def linear_sum_assignment(cost) -> tuple:
+    import numpy as np
+    try:
+        from scipy.optimize import linear_sum_assignment as scipy_assignment
+    except ImportError:
+        return _hungarian(np, cost)
+    return scipy_assignment(cost)
+
+
+class LineAligner:
+    """Optimal one-to-one pairing of invoice and PO line items"""
+
+    def __init__(self, normalizer: Normalizer = None):
+        self.normalizer = normalizer or Normalizer()
+        self.weights = Config.LINE_ALIGN_WEIGHTS
+        self.min_score = Config.LINE_ALIGN_MIN_SCORE
+
+    def align(self, invoice: dict, po: dict) -> List[LineAlignment]:
+        inv_items = invoice.get("line_items") or []
+        po_items = po.get("line_items") or []
+
+        # Identical codes need no scoring (and are the common case)
+        po_by_code = {}
+        for j, item in enumerate(po_items):
+            po_by_code.setdefault(normalize_code(item.get("item_id")), []).append(j)
+        pairs, unpaired = [], []
+        for i, item in enumerate(inv_items):
+            code = normalize_code(item.get("item_code"))
+            same_code = po_by_code.get(code) if code else None
+            if same_code:
+                pairs.append(LineAlignment(i, same_code.pop(0), 1.0, "exact_code"))
+            else:
+                unpaired.append(i)
+
+        paired_po = {pair.po_index for pair in pairs}
+        remaining_po = [j for j in range(len(po_items)) if j not in paired_po]
+        if unpaired and remaining_po:
+            pairs.extend(self._solve(invoice, po, unpaired, remaining_po))
+        return sorted(pairs)
+
+    def score_matrix(self, invoice: dict, po: dict, inv_idx: list, po_idx: list):
+        """Weighted similarity of every (invoice line, PO line) pair, shape (len(inv_idx), len(po_idx))"""
+        import numpy as np
+
+        inv_items = [invoice["line_items"][i] for i in inv_idx]
+        po_items = [po["line_items"][j] for j in po_idx]
+        currency = self.normalizer.comparison_currency(invoice, po)
+        on_date = invoice.get("invoice_date")
+        inv_norm = [self.normalizer.normalize_line(item, invoice.get("currency"), on_date, currency) for item in inv_items]
+        po_norm = [self.normalizer.normalize_line(item, po.get("currency"), on_date, currency) for item in po_items]
+
+        w = self.weights
+        return (
+            w["code"] * _dice(np, [_code_bigrams(x.get("item_code")) for x in inv_items],
+                              [_code_bigrams(x.get("item_id")) for x in po_items])
+            + w["description"] * _jaccard(np, [_tokens(x.get("description")) for x in inv_items],
+                                          [_tokens(x.get("description")) for x in po_items])
+            + w["quantity"] * _proximity(np, [x["quantity"] for x in inv_norm], [x["quantity"] for x in po_norm])
+            + w["price"] * _proximity(np, [x["unit_price"] for x in inv_norm], [x["unit_price"] for x in po_norm])
+        )
+
+    def _solve(self, invoice: dict, po: dict, inv_idx: list, po_idx: list) -> List[LineAlignment]:
+        import numpy as np
+
+        score = self.score_matrix(invoice, po, inv_idx, po_idx)
+        candidates = score >= self.min_score
+        result = []
+        # Lines in different blocks can never pair, so each block is an independent, smaller problem
+        for rows, cols in _blocks(candidates):
+            block = np.ix_(rows, cols)
+            cost = np.where(candidates[block], 1.0 - score[block], FORBIDDEN_COST)
+            for r, c in zip(*linear_sum_assignment(cost)):
+                i, j = rows[r], cols[c]
+                if candidates[i, j]:
+                    result.append(LineAlignment(inv_idx[i], po_idx[j], round(float(score[i, j]), 3), "aligned"))
+        return result
@@ -0,0 +1,142 @@
+import json
+import logging
+import re
+from bisect import bisect_right
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CURRENCY_SYMBOLS = {"GBP": "£", "EUR": "€", "USD": "$"}
+
+
+def normalize_supplier(name: str) -> str:
+    """Lower-case supplier name without legal suffixes or punctuation"""
+    return re.sub(r'\b(ltd|limited|plc|inc|co)\b|[^a-z0-9]', "", (name or "").lower())
+
+
+def supplier_matches(query: str, supplier: str) -> bool:
+    """Supplier search shared by every PO backend (PODatabase and SQLitePODatabase).
+
+    Both names are normalised (normalize_supplier) and match when either contains the
+    other, so "The EuroChem Trading Ltd", "EuroChem Trading Limited" and "Chem" all
+    find "EuroChem Trading Ltd". An empty name on either side matches nothing.
+    """
+    query, supplier = normalize_supplier(query), normalize_supplier(supplier)
+    return bool(query and supplier) and (query in supplier or supplier in query)
+
+
+class Normalizer:
+    """Currency and unit-of-measure normalisation against cached reference tables.
+
+    FX rates are effective-dated (a rate applies from its effective_from date until
+    the next one) and expressed as base-currency units per unit of foreign currency.
+    Tables are loaded and sorted once; per-(currency, date) lookups are memoised.
+    """
+
+    def __init__(self, reference_file: str = None):
+        self.reference_file = reference_file or Config.FX_RATES_FILE
+        self.base_currency = Config.BASE_CURRENCY
+        self._dates: Dict[str, list] = {}
+        self._rates: Dict[str, list] = {}
+        self._units: Dict[str, tuple] = {}
+        self._base_units: Dict[str, str] = {}
+        self._load()
+        self.rate = lru_cache(maxsize=1024)(self._rate)
+
+    def _load(self):
+        try:
+            with open(self.reference_file, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error("Error loading FX/unit reference data: %s", e)
+            data = {}
+
+        self.base_currency = data.get("base_currency", self.base_currency).upper()
+        self._base_units = data.get("base_units", {})
+
+        by_currency = {}
+        for entry in data.get("rates", []):
+            by_currency.setdefault(entry["currency"].upper(), []).append(
+                (entry["effective_from"], float(entry["rate_to_base"]))
+            )
+        for currency, rows in by_currency.items():
+            rows.sort()
+            self._dates[currency] = [row[0] for row in rows]
+            self._rates[currency] = [row[1] for row in rows]
+
+        for unit, spec in data.get("units", {}).items():
+            value = (unit, spec["dimension"], float(spec["factor"]))
+            for alias in [unit] + spec.get("aliases", []):
+                self._units[alias.lower()] = value
+
+    def _rate(self, currency: str, on_date: str) -> Optional[float]:
+        """Base-currency units per unit of `currency` in effect on an ISO date"""
+        if currency == self.base_currency:
+            return 1.0
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        idx = bisect_right(dates, on_date) - 1
+        # Dates before the first effective rate fall back to the earliest known rate
+        return self._rates[currency][max(idx, 0)]
+
+    def to_base(self, amount: float, currency: str = None, on_date: str = None) -> Optional[float]:
+        """Convert an amount to the base currency; None if no rate is known"""
+        return self.convert(amount, currency, None, on_date)
+
+    def convert(self, amount: float, currency: str = None, target: str = None, on_date: str = None) -> Optional[float]:
+        """Convert an amount to `target` (default: base currency); None if either rate is unknown"""
+        currency = (currency or self.base_currency).upper()
+        target = (target or self.base_currency).upper()
+        if currency == target:
+            return amount
+        # Unparsed or missing dates use today's rate
+        if not on_date or not re.match(r'^\d{4}-\d{2}-\d{2}$', on_date):
+            on_date = date.today().isoformat()
+        rate, target_rate = self.rate(currency, on_date), self.rate(target, on_date)
+        return amount * rate / target_rate if rate is not None and target_rate else None
+
+    def comparison_currency(self, invoice: dict, po: dict) -> str:
+        """Currency an invoice and its PO are compared in: their own if they share one, else the base.
+
+        Amounts in the same currency are compared as printed. Otherwise both sides are
+        converted at the invoice date, so the comparison doesn't pick up FX movement
+        between the PO and invoice dates.
+        """
+        inv_currency = (invoice.get("currency") or self.base_currency).upper()
+        po_currency = (po.get("currency") or self.base_currency).upper()
+        return inv_currency if inv_currency == po_currency else self.base_currency
+
+    def unit_factor(self, unit: str) -> Optional[tuple]:
+        """(dimension, factor to the dimension's base unit) or None if unknown"""
+        spec = self._units.get((unit or "").strip().lower())
+        return (spec[1], spec[2]) if spec else None
+
+    def base_unit(self, unit: str) -> str:
+        spec = self.unit_factor(unit)
+        return self._base_units.get(spec[0], unit) if spec else unit
+
+    def normalize_line(self, item: dict, currency: str = None, on_date: str = None, target: str = None) -> dict:
+        """Quantity in base units and unit price in `target` (default: base) currency per base unit"""
+        quantity = item.get("quantity", 0)
+        unit_price = self.convert(item.get("unit_price", 0), currency, target, on_date)
+        spec = self.unit_factor(item.get("unit"))
+        if spec:
+            factor = spec[1]
+            quantity = quantity * factor
+            if unit_price is not None:
+                unit_price = unit_price / factor
+        return {
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "dimension": spec[0] if spec else None,
+            "unit": self.base_unit(item.get("unit"))
+        }
+
+    def format(self, amount: float, currency: str = None) -> str:
+        currency = (currency or self.base_currency).upper()
+        symbol = CURRENCY_SYMBOLS.get(currency)
+        return f"{symbol}{amount:.2f}" if symbol else f"{amount:.2f} {currency}"
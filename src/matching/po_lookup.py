@@ -1,10 +1,15 @@
 import json
 from typing import List, Dict, Optional
 from config import Config
+from matching.normalization import supplier_matches
+import logging
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+logger = logging.getLogger(__name__)
+
+
 class PODatabase:
     def __init__(self):
         self.pos = self._load_pos()
@@ -16,7 +21,7 @@ class PODatabase:
                 data = json.load(f)
                 return data.get("purchase_orders", [])
         except Exception as e:
-            print(f"Error loading POs: {e}")
+            logger.error("Error loading POs: %s", e)
             return []
     
     def get_po_by_number(self, po_number: str) -> Optional[Dict]:
@@ -27,16 +32,8 @@ class PODatabase:
         return None
     
     def search_by_supplier(self, supplier_name: str) -> List[Dict]:
-        """Search POs by supplier name (fuzzy)"""
-        results = []
-        supplier_lower = supplier_name.lower()
-        
-        for po in self.pos:
-            po_supplier = po.get("supplier", "").lower()
-            if supplier_lower in po_supplier or po_supplier in supplier_lower:
-                results.append(po)
-        
-        return results
+        """Search POs by supplier name (fuzzy, see supplier_matches)"""
+        return [po for po in self.pos if supplier_matches(supplier_name, po.get("supplier", ""))]
     
     def search_by_products(self, product_codes: List[str]) -> List[Dict]:
         """Search POs by product codes"""
@@ -63,3 +60,11 @@ class PODatabase:
     def get_all(self) -> List[Dict]:
         """Get all POs"""
         return self.pos
+
+
+def create_po_database():
+    """PO repository for the configured backend ("json" in memory, or "sqlite")"""
+    if Config.PO_BACKEND == "sqlite":
+        from matching.po_repository import SQLitePODatabase
+        return SQLitePODatabase()
+    return PODatabase()
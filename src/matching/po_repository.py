@@ -0,0 +1,191 @@
+"""SQLite-backed PO repository for catalogues too large to hold in memory.
+
+Build the database from the JSON book once (from the project root):
+    PYTHONPATH=src python -m matching.po_repository --json data/purchase_orders/purchase_orders.json
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional
+from config import Config
+from matching.normalization import normalize_supplier
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS purchase_orders (
+    id INTEGER PRIMARY KEY,
+    po_key TEXT NOT NULL UNIQUE,
+    supplier_norm TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_po_supplier_norm ON purchase_orders (supplier_norm);
+CREATE TABLE IF NOT EXISTS po_line_items (
+    id INTEGER PRIMARY KEY,
+    po_id INTEGER NOT NULL REFERENCES purchase_orders (id),
+    item_id TEXT NOT NULL,
+    description TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_line_item_id ON po_line_items (item_id, po_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS po_line_items_fts USING fts5 (
+    description, content='po_line_items', content_rowid='id'
+);
+"""
+
+# Constant statements so each connection's statement cache reuses the prepared plans
+GET_BY_NUMBER = "SELECT data FROM purchase_orders WHERE po_key = ?"
+# normalization.supplier_matches in SQL; the subquery only reads the supplier_norm index
+SEARCH_BY_SUPPLIER = """
+WITH matches AS MATERIALIZED (
+    SELECT id FROM purchase_orders
+    WHERE supplier_norm != '' AND (instr(supplier_norm, ?1) > 0 OR instr(?1, supplier_norm) > 0)
+)
+SELECT p.data FROM matches m JOIN purchase_orders p ON p.id = m.id ORDER BY m.id
+"""
+ALL_POS = "SELECT data FROM purchase_orders ORDER BY id"
+SEARCH_BY_DESCRIPTION = """
+SELECT p.data, bm25(po_line_items_fts) AS score
+FROM po_line_items_fts
+JOIN po_line_items l ON l.id = po_line_items_fts.rowid
+JOIN purchase_orders p ON p.id = l.po_id
+WHERE po_line_items_fts MATCH ?
+ORDER BY score LIMIT ?
+"""
+
+
+def _products_query(n: int) -> str:
+    return (
+        "SELECT p.data, p.item_count, COUNT(DISTINCT l.item_id) AS matched "
+        "FROM po_line_items l JOIN purchase_orders p ON p.id = l.po_id "
+        f"WHERE l.item_id IN ({','.join('?' * n)}) GROUP BY p.id ORDER BY p.id"
+    )
+
+
+class SQLitePODatabase:
+    """Same lookups as PODatabase, served from indexed SQLite (one read connection per thread)"""
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or Config.PO_SQLITE_FILE
+        self._local = threading.local()
+        if not os.path.exists(self.db_file):
+            logger.error("Error loading POs: SQLite database not found at %s", self.db_file)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, cached_statements=256)
+            self._local.conn = conn
+        return conn
+
+    def _rows(self, sql: str, params=()) -> List[Dict]:
+        try:
+            return [json.loads(row[0]) for row in self.conn.execute(sql, params)]
+        except sqlite3.Error as e:
+            logger.error("Error querying POs: %s", e)
+            return []
+
+    def get_po_by_number(self, po_number: str) -> Optional[Dict]:
+        """Get PO by exact (case-insensitive) number match"""
+        rows = self._rows(GET_BY_NUMBER, (po_number.upper(),))
+        return rows[0] if rows else None
+
+    def search_by_supplier(self, supplier_name: str) -> List[Dict]:
+        """Search POs by supplier name (fuzzy, see normalization.supplier_matches)"""
+        key = normalize_supplier(supplier_name)
+        if not key:
+            return []
+        return self._rows(SEARCH_BY_SUPPLIER, (key,))
+
+    def search_by_products(self, product_codes: List[str]) -> List[Dict]:
+        """Search POs by product codes"""
+        codes = sorted({code.upper() for code in product_codes})
+        if not codes:
+            return []
+        try:
+            rows = self.conn.execute(_products_query(len(codes)), codes).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error querying POs: %s", e)
+            return []
+
+        results = [{
+            "po": json.loads(data),
+            "match_count": matched,
+            "match_rate": matched / max(len(product_codes), item_count)
+        } for data, item_count, matched in rows]
+        results.sort(key=lambda x: x["match_rate"], reverse=True)
+        return results
+
+    def search_by_description(self, text: str, limit: int = 10) -> List[Dict]:
+        """Full-text search over line item descriptions, best BM25 match first"""
+        terms = [t for t in "".join(c if c.isalnum() else " " for c in text).split() if t]
+        if not terms:
+            return []
+        query = " OR ".join(f'"{t}"' for t in terms)
+        seen, results = set(), []
+        for po in self._rows(SEARCH_BY_DESCRIPTION, (query, limit * 4)):
+            if po["po_number"] not in seen:
+                seen.add(po["po_number"])
+                results.append(po)
+        return results[:limit]
+
+    def get_all(self) -> Iterator[Dict]:
+        """Stream every PO (not materialised in memory)"""
+        try:
+            for row in self.conn.execute(ALL_POS):
+                yield json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.error("Error querying POs: %s", e)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def import_json(json_file: str, db_file: str) -> int:
+    """(Re)build the SQLite database from the JSON PO book; returns the number of POs"""
+    with open(json_file, "r") as f:
+        pos = json.load(f).get("purchase_orders", [])
+
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.executescript(
+            "DROP TABLE IF EXISTS po_line_items_fts; DROP TABLE IF EXISTS po_line_items; "
+            "DROP TABLE IF EXISTS purchase_orders;" + SCHEMA
+        )
+        with conn:
+            for po in pos:
+                items = po.get("line_items", [])
+                po_id = conn.execute(
+                    "INSERT INTO purchase_orders (po_key, supplier_norm, item_count, data) VALUES (?, ?, ?, ?)",
+                    (po.get("po_number", "").upper(), normalize_supplier(po.get("supplier", "")),
+                     len({item.get("item_id", "").upper() for item in items}), json.dumps(po))
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO po_line_items (po_id, item_id, description) VALUES (?, ?, ?)",
+                    [(po_id, item.get("item_id", "").upper(), item.get("description", "")) for item in items]
+                )
+            conn.execute("INSERT INTO po_line_items_fts (po_line_items_fts) VALUES ('rebuild')")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return len(pos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the JSON PO book into SQLite")
+    parser.add_argument("--json", default=Config.PO_FILE)
+    parser.add_argument("--db", default=Config.PO_SQLITE_FILE)
+    args = parser.parse_args()
+    count = import_json(args.json, args.db)
+    print(f"Imported {count} purchase orders into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from bisect import bisect_right, insort
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from config import Config
+from matching.normalization import normalize_supplier
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in O(1) memory (Jain & Chlamtac P-square)"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.q = []  # marker heights; the first 5 observations are kept sorted verbatim
+        self.n = [0, 1, 2, 3, 4]
+        self.np = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q, n = self.q, self.n
+        if len(q) < 5:
+            insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0], k = x, 0
+        elif x >= q[4]:
+            q[4], k = x, 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+
+        # Move the three middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.q, self.n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if not self.q:
+            return None
+        if len(self.q) < 5:
+            return self.q[round(self.p * (len(self.q) - 1))]
+        return self.q[2]
+
+    def to_dict(self) -> dict:
+        return {"p": self.p, "q": self.q, "n": self.n, "np": self.np}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "P2Quantile":
+        sketch = cls(data["p"])
+        sketch.q, sketch.n, sketch.np = data["q"], data["n"], data["np"]
+        return sketch
+
+
+class PriceStats:
+    """Exponentially weighted mean/variance plus quantile sketches for one (supplier, item)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_price = None
+        self.last_date = ""
+        self.sketches = [P2Quantile(p) for p in QUANTILES]
+
+    def update(self, price: float, on_date: str = ""):
+        self.count += 1
+        # Plain running mean until 1/alpha samples, then exponentially weighted
+        alpha = max(Config.PRICE_HISTORY_ALPHA, 1 / self.count)
+        diff = price - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.var = (1 - alpha) * (self.var + diff * increment)
+        self.last_price = price
+        self.last_date = on_date or self.last_date
+        for sketch in self.sketches:
+            sketch.add(price)
+
+    def quantiles(self) -> dict:
+        return {f"p{round(s.p * 100):02d}": s.value() for s in self.sketches}
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": self.mean, "var": self.var, "last_price": self.last_price,
+                "last_date": self.last_date, "sketches": [s.to_dict() for s in self.sketches]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceStats":
+        stats = cls()
+        stats.count, stats.mean, stats.var = data["count"], data["mean"], data["var"]
+        stats.last_price, stats.last_date = data.get("last_price"), data.get("last_date", "")
+        stats.sketches = [P2Quantile.from_dict(s) for s in data["sketches"]]
+        return stats
+
+
+class PriceHistory:
+    """Per-(supplier, item_code) price statistics, updated incrementally as invoices are processed.
+
+    Prices are expected in base currency per base unit (see Normalizer). Checks and
+    updates are O(1) per line; history is never rescanned. An item without history
+    is started from `seeder(supplier, item_code)` -> (price, date) pairs the first
+    time it is seen, e.g. the agreed prices on its POs.
+    """
+
+    def __init__(self, history_file: str = None,
+                 seeder: Callable[[str, str], Iterable[Tuple[float, str]]] = None):
+        self.history_file = history_file if history_file is not None else Config.PRICE_HISTORY_FILE
+        self.seeder = seeder
+        self._stats: Dict[str, PriceStats] = {}
+        self._seeded = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+        if self.history_file:
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(supplier: str, item_code: str) -> str:
+        return f"{normalize_supplier(supplier)}|{(item_code or '').strip().upper()}"
+
+    def check(self, supplier: str, item_code: str, price: float) -> Optional[dict]:
+        """Anomaly details if `price` deviates from this item's history, else None"""
+        stats = self._get(supplier, item_code)
+        if not stats or stats.count < Config.PRICE_HISTORY_MIN_SAMPLES or stats.mean <= 0:
+            return None
+        # Floor the deviation so a perfectly stable history does not flag rounding noise
+        std = max(stats.var ** 0.5, Config.PRICE_TOLERANCE * stats.mean)
+        z = (price - stats.mean) / std
+        quantiles = stats.quantiles()
+        outside = price < quantiles["p05"] or price > quantiles["p95"]
+        if abs(z) <= Config.PRICE_ANOMALY_Z or not outside:
+            return None
+        return {
+            "z_score": z,
+            "mean": stats.mean,
+            "std": std,
+            "samples": stats.count,
+            "last_price": stats.last_price,
+            "last_date": stats.last_date,
+            **quantiles
+        }
+
+    def update(self, supplier: str, item_code: str, price: float, on_date: str = ""):
+        if price is None or price <= 0:
+            return
+        self._get(supplier, item_code)
+        self._add(self.key(supplier, item_code), price, on_date)
+
+    def _get(self, supplier: str, item_code: str) -> Optional[PriceStats]:
+        """Statistics for one item, seeding it on first sight if it has no history"""
+        key = self.key(supplier, item_code)
+        stats = self._stats.get(key)
+        if stats is not None or not self.seeder or not (item_code or "").strip():
+            return stats
+        with self._lock:
+            if key in self._seeded:
+                return self._stats.get(key)
+            self._seeded.add(key)
+        for price, on_date in self.seeder(supplier, item_code):
+            if price is not None and price > 0:
+                self._add(key, price, on_date)
+        return self._stats.get(key)
+
+    def _add(self, key: str, price: float, on_date: str):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = PriceStats()
+            stats.update(price, on_date)
+            self._dirty = True
+
+    def save(self):
+        """Snapshot the statistics (size grows with distinct items, not with invoices)"""
+        if not self.history_file or not self._dirty:
+            return
+        with self._lock:
+            data = {key: stats.to_dict() for key, stats in self._stats.items()}
+            self._dirty = False
+        tmp_file = self.history_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.history_file)
+
+    def _load(self):
+        if not self.history_file or not os.path.exists(self.history_file):
+            return
+        try:
+            with open(self.history_file, "r") as f:
+                data = json.load(f)
+            self._stats = {key: PriceStats.from_dict(value) for key, value in data.items()}
+        except Exception as e:
+            logger.error("Error loading price history: %s", e)
+
+    def __len__(self):
+        return len(self._stats)
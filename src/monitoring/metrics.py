@@ -0,0 +1,266 @@
+"""In-process metrics with Prometheus text exposition.
+
+Hot-path updates (inc/observe) write to per-thread cells without taking a
+lock; cells are only summed when /metrics is scraped or the registry is
+dumped. Gauges are callbacks evaluated at scrape time, so queue depths and
+cache ratios cost nothing while invoices are processed.
+"""
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _ThreadCells:
+    """One dict per writer thread; only first use in a thread takes the lock"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> dict:
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = self._local.cells = {}
+            with self._lock:
+                self._all.append(cells)
+        return cells
+
+    def snapshot(self) -> list:
+        with self._lock:
+            shards = list(self._all)
+        return [list(shard.items()) for shard in shards]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._cells = _ThreadCells()
+
+    def inc(self, *labels, amount: float = 1.0):
+        cells = self._cells.mine()
+        cells[labels] = cells.get(labels, 0.0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        totals = {}
+        for shard in self._cells.snapshot():
+            for labels, value in shard:
+                totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+    def merge(self, values: list):
+        for labels, value in values:
+            self.inc(*labels, amount=value)
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._cells = _ThreadCells()
+
+    def observe(self, value: float, *labels):
+        cells = self._cells.mine()
+        cell = cells.get(labels)
+        if cell is None:
+            # [per-bucket counts..., +Inf count, sum]
+            cell = cells[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def values(self) -> Dict[Tuple, list]:
+        totals = {}
+        for shard in self._cells.snapshot():
+            for labels, cell in shard:
+                total = totals.setdefault(labels, [0] * len(cell))
+                for i, value in enumerate(list(cell)):
+                    total[i] += value
+        return totals
+
+    def merge(self, values: list):
+        cells = self._cells.mine()
+        for labels, counts in values:
+            cell = cells.setdefault(tuple(labels), [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(counts):
+                cell[i] += value
+
+    def render(self) -> list:
+        lines = []
+        for labels, cell in sorted(self.values().items()):
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {cell[-1]:g}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value computed on scrape: fn() returns a number or {label tuple: number}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Callable, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames, self.fn = name, help_text, tuple(labelnames), fn
+
+    def render(self) -> list:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {float(v):g}"
+                for labels, v in sorted(value.items()) if v is not None]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and existing.kind != "gauge":
+                return existing
+            # Gauges are replaced so the newest owner (e.g. a rebuilt graph) reports
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, fn: Callable, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, fn, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            body = metric.render()
+            if body:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Counter and histogram values as {name: [[labels, value], ...]} (JSON-serialisable)"""
+        with self._lock:
+            metrics = [m for m in self._metrics.values() if m.kind != "gauge"]
+        return {m.name: [[list(labels), value] for labels, value in m.values().items()] for m in metrics}
+
+    def merge(self, snapshot: dict):
+        """Add another process's snapshot (or snapshot_delta) to this registry's values"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, values in snapshot.items():
+            metric = metrics.get(name)
+            if metric is not None and metric.kind != "gauge":
+                metric.merge(values)
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            f.write(self.render())
+
+
+def snapshot_delta(current: dict, previous: dict) -> dict:
+    """What was recorded between two snapshots of the same registry"""
+    delta = {}
+    for name, values in current.items():
+        before = {tuple(labels): value for labels, value in previous.get(name, [])}
+        for labels, value in values:
+            old = before.get(tuple(labels))
+            if isinstance(value, list):
+                diff = [v - o for v, o in zip(value, old)] if old else value
+                changed = any(diff)
+            else:
+                diff = value - (old or 0.0)
+                changed = diff != 0
+            if changed:
+                delta.setdefault(name, []).append([labels, diff])
+    return delta
+
+
+REGISTRY = MetricsRegistry()
+
+INVOICES = REGISTRY.counter(
+    "invoice_recon_invoices_total", "Invoices processed by recommended action and risk level",
+    ("action", "risk")
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "invoice_recon_stage_seconds", "Wall time per graph stage", ("stage",)
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "invoice_recon_llm_call_seconds", "LLM call latency", ("backend", "mode"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+LLM_ERRORS = REGISTRY.counter("invoice_recon_llm_errors_total", "Failed LLM calls", ("backend",))
+LLM_RECORDINGS = REGISTRY.counter(
+    "invoice_recon_llm_recordings_total", "Recorded LLM response lookups and writes", ("result",)
+)
+OCR_SECONDS = REGISTRY.histogram(
+    "invoice_recon_ocr_call_seconds", "OCR call latency", ("engine",)
+)
+OCR_REGION_RETRIES = REGISTRY.counter(
+    "invoice_recon_ocr_region_retries_total", "Low-confidence regions re-OCRed, by whether the retry was kept",
+    ("outcome",)
+)
+DUPLICATES = REGISTRY.counter(
+    "invoice_recon_duplicates_total", "Duplicate invoices detected", ("match_type",)
+)
+BATCH_JOBS = REGISTRY.counter(
+    "invoice_recon_batch_jobs_total", "Work-queue shards by outcome (acked, retried, dead, lost)", ("outcome",)
+)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """Serve /metrics from a daemon thread; returns the server (call shutdown() to stop)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
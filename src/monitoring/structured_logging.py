@@ -0,0 +1,177 @@
+"""JSON logging through a background queue, with invoice/job correlation ids.
+
+Call sites use plain `logging.getLogger(__name__)`. `configure_logging()` installs a
+single root handler that only enqueues records; one listener thread formats and
+writes them, so logging I/O never blocks an invoice. Chatty progress records are
+marked with `extra={"sample": True}` and thinned to Config.LOG_SAMPLE_RATE.
+"""
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from config import Config
+from monitoring.metrics import REGISTRY
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)  # one per invoice
+job_id = contextvars.ContextVar("job_id", default=None)
+
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "invoice_recon_log_records_dropped_total", "Log records not written (sampled out or queue full)", ("reason",)
+)
+
+# Third-party loggers that are noisy at INFO (one line per HTTP request)
+QUIET_LOGGERS = ("httpx", "httpcore", "urllib3", "huggingface_hub", "PIL")
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample", "correlation_id", "job_id"}
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+@contextlib.contextmanager
+def correlation(invoice: str = None, job: str = None):
+    """Tag records logged in this context (thread or task) with an invoice correlation id and/or job id"""
+    tokens = []
+    if invoice is not None:
+        tokens.append((correlation_id, correlation_id.set(invoice)))
+    if job is not None:
+        tokens.append((job_id, job_id.set(job)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the correlation ids onto the record while still on the logging thread.
+
+    Ids passed explicitly through `extra` take precedence over the context.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = correlation_id.get()
+        if getattr(record, "job_id", None) is None:
+            record.job_id = job_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep the first and then every Nth record marked sample=True, per message template.
+
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False) or record.levelno >= logging.WARNING:
+            return True
+        if self.every:
+            with self._lock:
+                seen = self._counts[(record.name, record.msg)]
+                self._counts[(record.name, record.msg)] = seen + 1
+            if seen % self.every == 0:
+                return True
+        LOG_RECORDS_DROPPED.inc("sampled")
+        return False
+
+
+class BufferedQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue without blocking; a full queue drops the record instead of stalling the caller"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now (arguments may change after this call),
+        # but leave formatting and the extra fields to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc("queue_full")
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, correlation ids and extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+            "job_id": getattr(record, "job_id", None),
+            "thread": record.threadName,
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local runs (LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(correlation)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        ids = [getattr(record, "job_id", None), getattr(record, "correlation_id", None)]
+        record.correlation = "/".join(i for i in ids if i) or "-"
+        return super().format(record)
+
+
+def configure_logging(level: str = None, fmt: str = None, stream=None) -> logging.handlers.QueueListener:
+    """Install the queue handler on the root logger and start the writer thread (idempotent)"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return _listener
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JSONFormatter() if (fmt or Config.LOG_FORMAT) == "json" else TextFormatter())
+
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        handler = BufferedQueueHandler(log_queue)
+        handler.addFilter(ContextFilter())
+        handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_RATE))
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel((level or Config.LOG_LEVEL).upper())
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        # Flush whatever is still queued on exit
+        atexit.register(_listener.stop)
+        REGISTRY.gauge("invoice_recon_log_queue_depth", "Log records waiting to be written", log_queue.qsize)
+        return _listener
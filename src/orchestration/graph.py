@@ -1,62 +1,218 @@
-from langgraph.graph import StateGraph, END
 from orchestration.state import AgentState
 from agents.document_intelligence_agent import DocumentIntelligenceAgent
 from agents.matching_agent import MatchingAgent
 from agents.discrepancy_detection_agent import DiscrepancyDetectionAgent
 from agents.resolution_recommendation_agent import ResolutionRecommendationAgent
+from matching.po_lookup import create_po_database
+from orchestration.payloads import PayloadStore
+from monitoring.metrics import REGISTRY, INVOICES, STAGE_SECONDS
+from monitoring.structured_logging import correlation, new_id
+from config import Config
+from collections import Counter
+import logging
 import time
 from datetime import datetime
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+logger = logging.getLogger(__name__)
+
 class InvoiceReconciliationGraph:
-    def __init__(self):
-        self.doc_agent = DocumentIntelligenceAgent()
-        self.matching_agent = MatchingAgent()
-        self.discrepancy_agent = DiscrepancyDetectionAgent()
+    # Graph node name -> handler method
+    NODES = {
+        "document_intelligence": "_document_intelligence_node",
+        "llm_re_extraction": "_re_extraction_node",
+        "matching": "_matching_node",
+        "fallback_matching": "_fallback_matching_node",
+        "discrepancy_detection": "_discrepancy_node",
+        "resolution": "_resolution_node",
+    }
+    
+    def __init__(self, po_db=None):
+        # One PO catalogue shared by the agents that look POs up
+        self.po_db = po_db or create_po_database()
+        self.payloads = PayloadStore()
+        self.doc_agent = DocumentIntelligenceAgent(self.payloads)
+        self.matching_agent = MatchingAgent(self.po_db)
+        self.discrepancy_agent = DiscrepancyDetectionAgent(self.po_db)
         self.resolution_agent = ResolutionRecommendationAgent()
         
+        # Routing statistics across all invoices processed by this graph
+        self.skip_counts = Counter()
+        self.path_lengths = []
+        
         self.graph = self._build_graph()
+        self._register_gauges()
     
     def _build_graph(self):
         """Build the agent workflow graph"""
+        from langgraph.graph import StateGraph, END
+
         workflow = StateGraph(AgentState)
         
         # Add nodes
-        workflow.add_node("document_intelligence", self._document_intelligence_node)
-        workflow.add_node("matching", self._matching_node)
-        workflow.add_node("discrepancy_detection", self._discrepancy_node)
-        workflow.add_node("resolution", self._resolution_node)
+        for name, node in self.NODES.items():
+            workflow.add_node(name, getattr(self, node))
         
-        # Define edges (linear flow for now)
+        # Define edges - later stages are skipped once the outcome is already decided
         workflow.set_entry_point("document_intelligence")
-        workflow.add_edge("document_intelligence", "matching")
-        workflow.add_edge("matching", "discrepancy_detection")
+        workflow.add_conditional_edges(
+            "document_intelligence", self._route_after_extraction,
+            ["llm_re_extraction", "matching", "resolution"]
+        )
+        workflow.add_conditional_edges(
+            "llm_re_extraction", self._route_after_re_extraction,
+            ["matching", "resolution"]
+        )
+        workflow.add_conditional_edges(
+            "matching", self._route_after_matching,
+            ["fallback_matching", "discrepancy_detection"]
+        )
+        workflow.add_conditional_edges(
+            "fallback_matching", self._route_after_fallback_matching,
+            ["discrepancy_detection", "resolution"]
+        )
         workflow.add_edge("discrepancy_detection", "resolution")
         workflow.add_edge("resolution", END)
         
         return workflow.compile()
     
-    def _document_intelligence_node(self, state: AgentState) -> AgentState:
+    def _register_gauges(self):
+        """Scrape-time gauges for this graph's caches and queues"""
+        tiers = self.doc_agent.tier_summary
+        REGISTRY.gauge(
+            "invoice_recon_extraction_tier_hit_ratio", "Share of attempts accepted per extraction tier",
+            lambda: {(tier,): stats["hit_rate"] for tier, stats in tiers().items() if stats["attempts"]}, ("tier",)
+        )
+        rate_cache = self.discrepancy_agent.normalizer.rate
+        
+        def fx_hit_ratio():
+            info = rate_cache.cache_info()
+            return info.hits / (info.hits + info.misses) if info.hits + info.misses else None
+        
+        REGISTRY.gauge("invoice_recon_fx_cache_hit_ratio", "FX rate lookup cache hit ratio", fx_hit_ratio)
+        REGISTRY.gauge(
+            "invoice_recon_ocr_queue_depth", "Regions waiting for an OCR worker thread",
+            lambda: self.doc_agent.extractor.ocr_pool._work_queue.qsize()
+        )
+        REGISTRY.gauge("invoice_recon_payloads_held", "Raw text payloads currently held", lambda: len(self.payloads))
+    
+    def _route_after_extraction(self, state: AgentState) -> str:
+        """Skip to resolution when extraction failed; re-extract only when confidence is marginal"""
+        if state.get("duplicate_of"):
+            return "matching"  # Still matched so the duplicate is reported against its PO
+        if not state.get("extracted_data") or state["extraction_confidence"] < Config.LOW_CONFIDENCE:
+            return "resolution"
+        # Arithmetic already checks out: a costly second LLM pass cannot improve the result
+        validation = state.get("extraction_validation")
+        if validation and not validation["needs_reextraction"]:
+            return "matching"
+        if state["extraction_confidence"] < Config.MEDIUM_CONFIDENCE and self.payloads.get(state.get("raw_text_ref")):
+            return "llm_re_extraction"
+        return "matching"
+    
+    def _route_after_re_extraction(self, state: AgentState) -> str:
+        if state["extraction_confidence"] < Config.LOW_CONFIDENCE:
+            return "resolution"
+        return "matching"
+    
+    def _route_after_matching(self, state: AgentState) -> str:
+        """Exact PO match found: the supplier/product fallback search is unnecessary"""
+        matching = state.get("matching_results")
+        if matching and matching["matched_po"]:
+            return "discrepancy_detection"
+        return "fallback_matching"
+    
+    def _route_after_fallback_matching(self, state: AgentState) -> str:
+        """No PO at all means escalation; line items still get a price-history check"""
+        matching = state.get("matching_results")
+        if (matching and matching["matched_po"]) or state.get("duplicate_of"):
+            return "discrepancy_detection"
+        if (state.get("extracted_data") or {}).get("line_items"):
+            return "discrepancy_detection"
+        return "resolution"
+    
+    def _delta(self, state: AgentState, node: str, run) -> dict:
+        """Run an agent on a shallow view of the state and return only the keys it changed.
+
+        Agents assign top-level keys, so an unchanged key still holds the very same
+        object and is left out; errors and trace entries start empty and are
+        appended/merged by the state reducers.
+        """
+        view = dict(state)
+        view["errors"] = []
+        view["agent_execution_trace"] = {}
+        start = time.perf_counter()
+        result = run(view)
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, node)
+        logger.info("Stage %s complete", node,
+                    extra={"stage": node, "duration_ms": round(elapsed * 1000, 1), "sample": True})
+        delta = {
+            key: value for key, value in result.items()
+            if state.get(key) is not value and not (key in ("errors", "agent_execution_trace") and not value)
+        }
+        delta["route"] = [node]
+        return delta
+    
+    def _document_intelligence_node(self, state: AgentState) -> dict:
         """Document Intelligence Agent node"""
-        print("📄 Running Document Intelligence Agent...")
-        return self.doc_agent.process(state)
+        return self._delta(state, "document_intelligence", self.doc_agent.process)
     
-    def _matching_node(self, state: AgentState) -> AgentState:
-        """Matching Agent node"""
-        print("🔍 Running Matching Agent...")
-        return self.matching_agent.process(state)
+    def _re_extraction_node(self, state: AgentState) -> dict:
+        """Second, full-text LLM extraction for low-confidence documents"""
+        return self._delta(state, "llm_re_extraction", self.doc_agent.reextract)
     
-    def _discrepancy_node(self, state: AgentState) -> AgentState:
+    def _matching_node(self, state: AgentState) -> dict:
+        """Matching Agent node (exact PO reference)"""
+        return self._delta(state, "matching", lambda view: self.matching_agent.process(view, stages=("exact",)))
+    
+    def _fallback_matching_node(self, state: AgentState) -> dict:
+        """Matching Agent fallback (supplier / product search)"""
+        def run(view):
+            view = self.matching_agent.process(view, stages=("fallback",))
+            if self._route_after_fallback_matching(view) == "resolution" and view.get("extracted_data"):
+                # Discrepancy detection is skipped, but the missing PO must still be reported
+                view["discrepancies"] = [self.discrepancy_agent.missing_po_discrepancy(view["extracted_data"])]
+                view["discrepancy_reasoning"] = self.discrepancy_agent.build_reasoning(view["discrepancies"])
+            return view
+        
+        return self._delta(state, "fallback_matching", run)
+    
+    def _discrepancy_node(self, state: AgentState) -> dict:
         """Discrepancy Detection Agent node"""
-        print("⚠️  Running Discrepancy Detection Agent...")
-        return self.discrepancy_agent.process(state)
+        return self._delta(state, "discrepancy_detection", self.discrepancy_agent.process)
     
-    def _resolution_node(self, state: AgentState) -> AgentState:
+    def _resolution_node(self, state: AgentState) -> dict:
         """Resolution Recommendation Agent node"""
-        print("✅ Running Resolution Recommendation Agent...")
-        return self.resolution_agent.process(state)
+        def run(view):
+            view = self.resolution_agent.process(view)
+            # Only approved invoices feed the price history
+            self.discrepancy_agent.record_prices(view)
+            return view
+        
+        return self._delta(state, "resolution", run)
+    
+    def _record_routing(self, state: AgentState):
+        """Store skipped nodes in the trace and update graph-wide statistics"""
+        path = state.get("route", [])
+        skipped = [node for node in self.NODES if node not in path]
+        state["agent_execution_trace"]["routing"] = {
+            "path": path,
+            "skipped_nodes": skipped,
+            "nodes_skipped": len(skipped)
+        }
+        self.skip_counts.update(skipped)
+        self.path_lengths.append(len(path))
+    
+    def routing_summary(self) -> dict:
+        """Average path length and per-node skip counts so far"""
+        return {
+            "invoices": len(self.path_lengths),
+            "avg_path_length": sum(self.path_lengths) / len(self.path_lengths) if self.path_lengths else 0.0,
+            "skip_counts": dict(self.skip_counts)
+        }
     
     def process_invoice(self, invoice_path: str, invoice_filename: str) -> dict:
         """Process a single invoice through the workflow"""
@@ -64,9 +220,13 @@ class InvoiceReconciliationGraph:
         
         # Initialize state
         initial_state: AgentState = {
+            "correlation_id": new_id(),
             "invoice_path": invoice_path,
             "invoice_filename": invoice_filename,
+            "raw_text_ref": self.payloads.new_ref(),
+            "duplicate_of": None,
             "extraction_confidence": 0.0,
+            "extraction_validation": None,
             "document_quality": "",
             "extracted_data": None,
             "extraction_reasoning": "",
@@ -82,24 +242,31 @@ class InvoiceReconciliationGraph:
             "resolution_reasoning": "",
             "processing_timestamp": datetime.utcnow().isoformat() + "Z",
             "processing_duration_seconds": 0.0,
+            "route": [],
             "agent_execution_trace": {},
             "errors": []
         }
         
-        # Run the graph
-        print(f"\n{'='*60}")
-        print(f"Processing: {invoice_filename}")
-        print(f"{'='*60}")
-        
-        final_state = self.graph.invoke(initial_state)
-        
-        # Calculate duration
-        duration = time.time() - start_time
-        final_state["processing_duration_seconds"] = duration
-        
-        print(f"\n✓ Processing complete in {duration:.2f}s")
-        print(f"Action: {final_state['recommended_action']}")
-        print(f"Risk: {final_state['risk_level']}")
+        # Run the graph; every record logged on the way carries this invoice's correlation id
+        with correlation(invoice=initial_state["correlation_id"]):
+            logger.info("Processing %s", invoice_filename, extra={"invoice_file": invoice_filename})
+            try:
+                final_state = self.graph.invoke(initial_state)
+            finally:
+                self.payloads.release(initial_state["raw_text_ref"])
+            
+            # Calculate duration
+            duration = time.time() - start_time
+            final_state["processing_duration_seconds"] = duration
+            self._record_routing(final_state)
+            INVOICES.inc(final_state["recommended_action"] or "none", final_state["risk_level"] or "none")
+            
+            logger.info("Processed %s", invoice_filename, extra={
+                "invoice_file": invoice_filename,
+                "action": final_state["recommended_action"],
+                "risk": final_state["risk_level"],
+                "duration_ms": round(duration * 1000, 1)
+            })
         
         return self._format_output(final_state)
     
@@ -110,14 +277,17 @@ class InvoiceReconciliationGraph:
         
         return {
             "invoice_id": extracted.get("invoice_number", "UNKNOWN") if extracted else "UNKNOWN",
+            "correlation_id": state["correlation_id"],
             "processing_timestamp": state["processing_timestamp"],
             "processing_duration_seconds": state["processing_duration_seconds"],
             "document_info": {
                 "filename": state["invoice_filename"],
-                "document_quality": state["document_quality"]
+                "document_quality": state["document_quality"],
+                "duplicate_of": state.get("duplicate_of")
             },
             "processing_results": {
                 "extraction_confidence": state["extraction_confidence"],
+                "extraction_validation": state.get("extraction_validation"),
                 "document_quality": state["document_quality"],
                 "extracted_data": extracted,
                 "matching_results": matching,
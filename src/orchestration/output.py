@@ -0,0 +1,22 @@
+import json
+from config import Config
+
+
+def dumps(data, compact: bool = None) -> bytes:
+    """Serialise a result; orjson when installed, compact separators when requested"""
+    compact = Config.OUTPUT_COMPACT if compact is None else compact
+    try:
+        import orjson
+    except ImportError:
+        if compact:
+            return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return json.dumps(data, indent=2).encode("utf-8")
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if not compact:
+        options |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, option=options)
+
+
+def write_json(path: str, data, compact: bool = None):
+    with open(path, "wb") as f:
+        f.write(dumps(data, compact))
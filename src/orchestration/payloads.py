@@ -0,0 +1,35 @@
+import threading
+import uuid
+from typing import Any, Optional
+
+
+class PayloadStore:
+    """Holds large per-invoice payloads (e.g. raw OCR text) outside the graph state.
+
+    The state carries only a short reference, so state updates, checkpoints and
+    outputs never copy the payload itself.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_ref() -> str:
+        return uuid.uuid4().hex
+
+    def put(self, value: Any, ref: str = None) -> str:
+        ref = ref or self.new_ref()
+        with self._lock:
+            self._items[ref] = value
+        return ref
+
+    def get(self, ref: Optional[str], default: Any = None) -> Any:
+        return self._items.get(ref, default) if ref else default
+
+    def release(self, ref: Optional[str]):
+        with self._lock:
+            self._items.pop(ref, None)
+
+    def __len__(self):
+        return len(self._items)
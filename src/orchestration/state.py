@@ -1,7 +1,13 @@
-from typing import TypedDict, List, Dict, Any, Optional
+import operator
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
 from datetime import datetime
 
 
+def merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer: nodes return only their own trace entries"""
+    return {**left, **right}
+
+
 class LineItem(TypedDict):
     item_code: str
     description: str
@@ -36,6 +42,7 @@ class MatchingResult(TypedDict):
     line_items_matched: int
     line_items_total: int
     match_rate: float
+    line_item_alignment: List[Dict[str, Any]]  # invoice line -> PO line pairs (see LineAligner)
     alternative_matches: List[Dict[str, Any]]
 
 
@@ -52,11 +59,15 @@ class Discrepancy(TypedDict):
 
 class AgentState(TypedDict):
     # Input
+    correlation_id: str  # tags this invoice's log records and output
     invoice_path: str
     invoice_filename: str
 
     # Document Intelligence Agent outputs
+    raw_text_ref: Optional[str]  # key into the graph's PayloadStore, not the text itself
+    duplicate_of: Optional[Dict[str, str]]
     extraction_confidence: float
+    extraction_validation: Optional[Dict[str, Any]]
     document_quality: str
     extracted_data: Optional[ExtractedInvoice]
     extraction_reasoning: str
@@ -80,5 +91,7 @@ class AgentState(TypedDict):
     # Metadata
     processing_timestamp: str
     processing_duration_seconds: float
-    agent_execution_trace: Dict[str, Any]
-    errors: List[str]
+    # Appended to / merged by LangGraph, so nodes return only what they add
+    route: Annotated[List[str], operator.add]
+    agent_execution_trace: Annotated[Dict[str, Any], merge_dicts]
+    errors: Annotated[List[str], operator.add]